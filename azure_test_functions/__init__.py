@@ -1,9 +1,40 @@
 """
 azure_test_functions
+
+The functions are imported on first access, so importing the package
+does not load the SDKs of the services which are not used.
 """
 
-from .bing_search import bing_search
-from .gpt import gpt
-from .ocr import ocr, ocr_merge_texts
-from .speech_to_text import speech_to_text
-from .translation import translation
+from typing import TYPE_CHECKING
+from .common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .bing_search import bing_search
+    from .embedding import embedding
+    from .gpt import gpt, gpt_session, gpt_summarize
+    from .ocr import ocr, ocr_dedup, ocr_merge_texts
+    from .pipeline import pipeline
+    from .service import service
+    from .speech_to_text import speech_to_text, speech_to_text_streaming
+    from .translation import translation
+
+__all__ = [
+    "bing_search", "embedding", "gpt", "gpt_session", "gpt_summarize",
+    "ocr", "ocr_dedup", "ocr_merge_texts", "pipeline", "service", "speech_to_text",
+    "speech_to_text_streaming", "translation"
+]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "bing_search": ".bing_search.src.main",
+    "embedding": ".embedding.src.main",
+    "gpt": ".gpt.src.main",
+    "gpt_session": ".gpt.src.session",
+    "gpt_summarize": ".gpt.src.summarize",
+    "ocr": ".ocr.src.main",
+    "ocr_dedup": ".ocr.src.dedup",
+    "ocr_merge_texts": ".ocr.src.merge_texts",
+    "pipeline": ".pipeline.src.main",
+    "service": ".service.src.main",
+    "speech_to_text": ".speech_to_text.src.main",
+    "speech_to_text_streaming": ".speech_to_text.src.streaming",
+    "translation": ".translation.src.main"
+})
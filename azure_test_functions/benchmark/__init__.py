@@ -0,0 +1,14 @@
+"""benchmark"""
+
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import import_time, mock_servers, throughput
+
+__all__ = ["import_time", "mock_servers", "throughput"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "import_time": ".src.import_time",
+    "mock_servers": ".src.mock_servers",
+    "throughput": ".src.throughput"
+})
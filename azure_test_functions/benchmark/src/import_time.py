@@ -0,0 +1,153 @@
+"""import_time.py
+
+Import-time benchmark guarding the lazy loading of `azure_test_functions`.
+
+Each statement is run in a fresh interpreter, so modules cached by a previous
+run do not hide a regression. A case fails if it loads one of its forbidden
+modules, e.g. the Speech SDK for `import azure_test_functions`, or if its
+median time exceeds its budget. The package is compiled first, so the time
+of compiling modules whose bytecode is missing or stale, e.g. with
+PYTHONDONTWRITEBYTECODE, is not counted.
+"""
+
+import compileall
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+N_REPEATS: int = 5
+HEAVY_MODULES: List[str] = [
+    "azure.ai.translation.text",
+    "azure.ai.vision.imageanalysis",
+    "azure.cognitiveservices.speech",
+    "httpx",
+    "mutagen",
+    "numpy",
+    "openai",
+    "requests",
+]
+CASES: Dict[str, Dict[str, Any]] = {
+    "package": {
+        "statement": "import azure_test_functions",
+        "forbidden": HEAVY_MODULES,
+        "budget_ms": 50.0,
+    },
+    "ocr_merge_texts": {
+        "statement": "from azure_test_functions import ocr_merge_texts",
+        "forbidden": HEAVY_MODULES,
+        "budget_ms": 50.0,
+    },
+    "bing_search": {
+        "statement": "from azure_test_functions import bing_search",
+        "forbidden": [name for name in HEAVY_MODULES if name != "requests"],
+        "budget_ms": 300.0,
+    },
+    "gpt": {
+        "statement": "from azure_test_functions import gpt",
+        "forbidden": HEAVY_MODULES,
+        "budget_ms": 100.0,
+    },
+    "ocr": {
+        "statement": "from azure_test_functions import ocr",
+        "forbidden": HEAVY_MODULES,
+        "budget_ms": 50.0,
+    },
+    "translation": {
+        "statement": "from azure_test_functions import translation",
+        "forbidden": HEAVY_MODULES,
+        "budget_ms": 50.0,
+    },
+    "speech_to_text": {
+        "statement": "from azure_test_functions import speech_to_text",
+        "forbidden": [name for name in HEAVY_MODULES if name != "requests"],
+        "budget_ms": 300.0,
+    },
+}
+_SCRIPT: str = """
+import json, sys, time
+st = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - st
+print(json.dumps({{
+    "elapsed_sec": elapsed,
+    "loaded": [name for name in {modules!r} if name in sys.modules]
+}}))
+"""
+
+
+def measure(statement: str, n_repeats: int = N_REPEATS) -> Dict[str, Any]:
+    """Runs a statement in fresh interpreters and measures its time.
+
+    Args:
+        statement (str): The import statement.
+        n_repeats (int, optional): The number of runs. Defaults to N_REPEATS.
+
+    Returns:
+        dict: The median and the minimum milliseconds and the heavy modules loaded.
+
+    Raises:
+        subprocess.CalledProcessError: If the statement fails.
+    """
+    elapsed: List[float] = []
+    loaded: List[str] = []
+    for _ in range(n_repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _SCRIPT.format(statement=statement, modules=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result: Dict[str, Any] = json.loads(output.strip().splitlines()[-1])
+        elapsed.append(float(result["elapsed_sec"]) * 1000.0)
+        loaded = list(result["loaded"])
+    return {
+        "median_ms": statistics.median(elapsed),
+        "min_ms": min(elapsed),
+        "loaded": loaded,
+    }
+
+
+def main(n_repeats: int = N_REPEATS, budget_scale: float = 1.0) -> None:
+    """Runs every case, prints the results and exits with 1 if any case fails.
+
+    Args:
+        n_repeats (int, optional): The number of runs per case. Defaults to N_REPEATS.
+        budget_scale (float, optional): The factor to scale the budgets by,
+            e.g. on a slow machine. Defaults to 1.0.
+    """
+    compileall.compile_dir(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), quiet=1
+    )
+    n_failed: int = 0
+    for name, case in CASES.items():
+        result = measure(case["statement"], n_repeats)
+        violations: List[str] = [
+            module for module in result["loaded"] if module in case["forbidden"]
+        ]
+        budget_ms: float = float(case["budget_ms"]) * budget_scale
+        failed: bool = bool(violations) or result["median_ms"] > budget_ms
+        n_failed += int(failed)
+        print(
+            f"{'FAIL' if failed else 'ok'}: {name}: "
+            f"{result['median_ms']:.1f} ms (budget {budget_ms:.0f} ms), "
+            f"loaded: {', '.join(result['loaded']) or '-'}"
+        )
+        if violations:
+            print(f"    forbidden modules loaded: {', '.join(violations)}")
+    print(f"finished. {n_failed} of {len(CASES)} cases failed.")
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repeats", dest="repeats", type=int, default=N_REPEATS
+    )
+    parser.add_argument(
+        "--budget_scale", dest="budget_scale", type=float, default=1.0
+    )
+    args = parser.parse_args()
+    main(args.repeats, args.budget_scale)
@@ -0,0 +1,375 @@
+"""mock_servers.py
+
+Local stand-in of the Azure endpoints for benchmarks.
+
+One HTTP server answers the requests of every service module with responses
+shaped like those of the real services:
+    * Vision `/computervision/imageanalysis:analyze`,
+    * Translator `/translate`,
+    * Speech fast transcription `/speechtotext/transcriptions:transcribe`,
+    * OpenAI `/openai/deployments/<model>/chat/completions` and `.../embeddings`,
+    * Bing `/v7.0/search`.
+The latency of each response, the rate of throttled (429) responses and
+the size of the payloads are configurable. Point the modules at the server
+by the environment variables of `MockAzureServer.environ` before they are imported.
+"""
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+HOST: str = "127.0.0.1"
+LATENCY_MS: float = 50.0
+PAYLOAD_SIZE: int = 20
+EMBEDDING_DIM: int = 256
+TOTAL_MATCHES: int = 1000
+MODEL: str = "mock-model"
+
+
+@dataclass
+class MockConfig:
+    """Behavior of the mock server.
+
+    `payload_size` is the number of recognized lines, transcribed phrases,
+    words per translation or chat answer, and web pages per search result.
+    """
+    latency_ms: float = LATENCY_MS
+    jitter_ms: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after_sec: float = 0.1
+    payload_size: int = PAYLOAD_SIZE
+    embedding_dim: int = EMBEDDING_DIM
+
+
+def _words(n_words: int, seed: int) -> str:
+    return " ".join(f"word{(seed + ii) % 97}" for ii in range(n_words))
+
+
+def vision_response(config: MockConfig) -> Dict[str, Any]:
+    """Returns a READ result of `payload_size` lines."""
+    lines: List[Dict[str, Any]] = []
+    for ii in range(config.payload_size):
+        y: int = 20 + ii * 30
+        polygon = [
+            {"x": 10, "y": y}, {"x": 610, "y": y},
+            {"x": 610, "y": y + 25}, {"x": 10, "y": y + 25}
+        ]
+        text: str = _words(8, ii)
+        lines.append({
+            "text": text, "boundingPolygon": polygon,
+            "words": [
+                {"text": word, "boundingPolygon": polygon, "confidence": 0.99}
+                for word in text.split()
+            ]
+        })
+    return {
+        "modelVersion": "2023-10-01",
+        "metadata": {"width": 640, "height": 40 + config.payload_size * 30},
+        "readResult": {"blocks": [{"lines": lines}]}
+    }
+
+
+def translation_response(config: MockConfig, body: Any, to_language: str) -> Any:
+    """Returns one translation of `payload_size` words per input text.
+
+    A body of `inputs` (API 2025-10-01, SDK 2.x) is answered by a `value`
+    list, and a list of texts (API 3.0) by a bare list.
+    """
+    if isinstance(body, list):
+        return [
+            {
+                "detectedLanguage": {"language": "en", "score": 1.0},
+                "translations": [{"text": _words(config.payload_size, ii), "to": to_language}]
+            }
+            for ii in range(len(body))
+        ]
+    return {"value": [
+        {
+            "detectedLanguage": {"language": "en", "score": 1.0},
+            "translations": [
+                {"text": _words(config.payload_size, ii), "language": target.get("language")}
+                for target in item.get("targets", [{"language": to_language}])
+            ]
+        }
+        for ii, item in enumerate(body.get("inputs", []))
+    ]}
+
+
+def speech_response(config: MockConfig) -> Dict[str, Any]:
+    """Returns a fast transcription of `payload_size` phrases."""
+    phrases: List[str] = [_words(10, ii) for ii in range(config.payload_size)]
+    return {
+        "durationMilliseconds": 3000 * len(phrases),
+        "combinedPhrases": [{"text": " ".join(phrases)}],
+        "phrases": [
+            {"offsetMilliseconds": 3000 * ii, "durationMilliseconds": 3000,
+             "text": text, "locale": "ja-JP", "confidence": 0.9}
+            for ii, text in enumerate(phrases)
+        ]
+    }
+
+
+def chat_response(config: MockConfig, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a chat completion of `payload_size` words."""
+    prompt_tokens: int = sum(
+        len(str(message.get("content", ""))) // 4 + 4 for message in body.get("messages", [])
+    )
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+        "model": body.get("model") or MODEL,
+        "choices": [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": _words(config.payload_size, prompt_tokens)}
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens, "completion_tokens": config.payload_size,
+            "total_tokens": prompt_tokens + config.payload_size
+        }
+    }
+
+
+def embedding_response(config: MockConfig, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a deterministic vector per input."""
+    inputs = body.get("input", [])
+    inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+    data: List[Dict[str, Any]] = []
+    for ii, text in enumerate(inputs):
+        rng = random.Random(str(text))
+        data.append({
+            "object": "embedding", "index": ii,
+            "embedding": [rng.uniform(-1.0, 1.0) for _ in range(config.embedding_dim)]
+        })
+    return {"object": "list", "data": data, "model": MODEL,
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}}
+
+
+def search_response(config: MockConfig, query: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Returns a page of web pages honoring `count` and `offset`."""
+    count: int = int(query.get("count", [str(config.payload_size)])[0])
+    offset: int = int(query.get("offset", ["0"])[0])
+    end: int = min(offset + count, TOTAL_MATCHES)
+    return {
+        "_type": "SearchResponse",
+        "queryContext": {"originalQuery": query.get("q", [""])[0]},
+        "webPages": {
+            "totalEstimatedMatches": TOTAL_MATCHES,
+            "value": [
+                {"id": str(ii), "name": f"page {ii}", "url": f"https://example.com/{ii}",
+                 "snippet": _words(20, ii)}
+                for ii in range(offset, end)
+            ]
+        }
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # the headers and the body are sent separately
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, status: int, value: Any, headers: Dict[str, str] | None = None) -> None:
+        data: bytes = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, header in (headers or {}).items():
+            self.send_header(key, header)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self) -> None:
+        length: int = int(self.headers.get("Content-Length") or 0)
+        raw: bytes = self.rfile.read(length) if length else b""
+        url = urlsplit(self.path)
+        query: Dict[str, List[str]] = parse_qs(url.query)
+        route: str = self.server.route(url.path)
+        config: MockConfig = self.server.config
+        self.server.count(route, len(raw))
+        delay_ms: float = config.latency_ms + random.uniform(0.0, config.jitter_ms)
+        time.sleep(delay_ms / 1000.0)
+        if route == "unknown":
+            self._reply(404, {"error": {"code": "NotFound", "message": url.path}})
+            return
+        if random.random() < config.throttle_rate:
+            self.server.count("throttled", 0)
+            self._reply(429, {"error": {"code": "429", "message": "Too many requests."}}, {
+                "Retry-After": str(max(int(config.retry_after_sec), 0)),
+                "retry-after-ms": str(int(config.retry_after_sec * 1000))
+            })
+            return
+        body: Any = {}
+        if raw and "json" in (self.headers.get("Content-Type") or ""):
+            body = json.loads(raw)
+        if route == "vision":
+            self._reply(200, vision_response(config))
+        elif route == "translation":
+            self._reply(200, translation_response(config, body, query.get("to", ["ja"])[0]))
+        elif route == "speech":
+            self._reply(200, speech_response(config))
+        elif route == "chat":
+            self._reply(200, chat_response(config, body), {
+                "x-ratelimit-remaining-tokens": "1000000",
+                "x-ratelimit-remaining-requests": "10000"
+            })
+        elif route == "embedding":
+            self._reply(200, embedding_response(config, body))
+        else:
+            self._reply(200, search_response(config, query))
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    ROUTES: List[Tuple[str, str]] = [
+        ("/imageanalysis:analyze", "vision"),
+        ("/translate", "translation"),
+        ("/transcriptions:transcribe", "speech"),
+        ("/chat/completions", "chat"),
+        ("/embeddings", "embedding"),
+        ("/v7.0/search", "search"),
+    ]
+
+    def __init__(self, address: Tuple[str, int], config: MockConfig) -> None:
+        super().__init__(address, _Handler)
+        self.config: MockConfig = config
+        self.counts: Dict[str, int] = {}
+        self.bytes_received: int = 0
+        self._lock = threading.Lock()
+
+    def route(self, path: str) -> str:
+        for suffix, name in self.ROUTES:
+            if path.endswith(suffix):
+                return name
+        return "unknown"
+
+    def count(self, route: str, n_bytes: int) -> None:
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+            self.bytes_received += n_bytes
+
+
+class MockAzureServer:
+    """Mock server of every service running in a background thread.
+
+    Usage:
+
+        with MockAzureServer(MockConfig(latency_ms=100, throttle_rate=0.05)) as server:
+            env = {**os.environ, **server.environ()}
+            subprocess.run([...], env=env)
+
+    Args:
+        config (MockConfig, optional): Defaults to `MockConfig()`.
+        host (str, optional): Defaults to HOST.
+        port (int, optional): A free port is chosen if 0.
+    """
+
+    def __init__(
+        self, config: MockConfig | None = None, host: str = HOST, port: int = 0
+    ) -> None:
+        self._server = _Server((host, port), config or MockConfig())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """The base URL, e.g. `http://127.0.0.1:8080`."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    @property
+    def config(self) -> MockConfig:
+        """The configuration, which may be changed while the server is running."""
+        return self._server.config
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """The number of requests received per route, and of throttled responses."""
+        with self._server._lock:  # pylint: disable=protected-access
+            return dict(self._server.counts)
+
+    def environ(self) -> Dict[str, str]:
+        """Returns the environment variables pointing every service module at the server."""
+        return {
+            "AZURE_CV_KEY": "mock", "AZURE_CV_ENDPOINT": self.url,
+            "AZURE_TRANSLATION_KEY": "mock", "AZURE_TRANSLATION_ENDPOINT": self.url,
+            "AZURE_TRANSLATION_ENDPOINT_REGION": "mock",
+            "AZURE_SPEECH_KEY": "mock", "AZURE_SPEECH_ENDPOINT": self.url,
+            "AZURE_SPEECH_ENDPOINT_REGION": "mock",
+            "AZURE_OPENAI_KEY": "mock", "AZURE_OPENAI_ENDPOINT": self.url,
+            "AZURE_OPENAI_CHAT_MODEL": MODEL, "AZURE_OPENAI_CHAT_API_VERSION": "2024-06-01",
+            "AZURE_OPENAI_EMBEDDING_MODEL": MODEL,
+            "AZURE_OPENAI_EMBEDDING_API_VERSION": "2024-06-01",
+            "AZURE_BING_KEY": "mock", "AZURE_BING_ENDPOINT": self.url,
+        }
+
+    def start(self) -> "MockAzureServer":
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving and closes the socket."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> "MockAzureServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+
+def main(
+    port: int = 0, latency_ms: float = LATENCY_MS, jitter_ms: float = 0.0,
+    throttle_rate: float = 0.0, payload_size: int = PAYLOAD_SIZE
+) -> None:
+    """Serves until interrupted and prints the environment variables to use it."""
+    config = MockConfig(
+        latency_ms=latency_ms, jitter_ms=jitter_ms,
+        throttle_rate=throttle_rate, payload_size=payload_size
+    )
+    with MockAzureServer(config, port=port) as server:
+        for key, value in server.environ().items():
+            print(f"{key}={value}")
+        print(f"serving on {server.url}. press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        print(f"requests: {server.counts}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--port", dest="port", type=int, default=0
+    )
+    parser.add_argument(
+        "--latency_ms", dest="latency_ms", type=float, default=LATENCY_MS
+    )
+    parser.add_argument(
+        "--jitter_ms", dest="jitter_ms", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--throttle_rate", dest="throttle_rate", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--payload_size", dest="payload_size", type=int, default=PAYLOAD_SIZE
+    )
+    args = parser.parse_args()
+    main(args.port, args.latency_ms, args.jitter_ms, args.throttle_rate, args.payload_size)
@@ -0,0 +1,337 @@
+"""throughput.py
+
+Throughput and latency benchmark of the batch paths against the mock services.
+
+Each case runs in a fresh interpreter pointed at a `MockAzureServer`, so the
+module constants read from the environment at import time refer to the mock,
+and the peak RSS is that of the case alone. The pauses between files of the
+`*_from_dir` functions (`WAIT_TIME_SEC`) are set to 0 so that the client
+itself is measured, and one call is made before the measurement so that
+the SDKs imported on the first call are not counted. A case reports the
+items per second, the p50 and p99 latencies of the calls to the service,
+including the retries, and the peak RSS.
+"""
+
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List
+from .mock_servers import MockAzureServer, MockConfig, LATENCY_MS, PAYLOAD_SIZE
+
+N_ITEMS: int = 20
+MAX_WORKERS: int = 4
+UPLOAD_KB: int = 64
+TOLERANCE: float = 0.2
+CASES: List[str] = ["ocr", "translation", "speech_to_text", "gpt", "bing_search"]
+_SCRIPT: str = """
+import json
+from azure_test_functions.benchmark.src.throughput import run_case
+print(json.dumps(run_case({name!r}, {workdir!r}, {n_items!r}, {max_workers!r}, {upload_kb!r})))
+"""
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Returns the nearest-rank percentile `q` (0-100) of values, or 0 if there are none."""
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    rank: int = max(math.ceil(q / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def peak_rss_mb() -> float | None:
+    """Returns the peak resident set size of this process, or None if unknown (Windows)."""
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak: float = float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _timed(func: Callable[..., Any], latencies: List[float]) -> Callable[..., Any]:
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        st: float = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - st)
+    return wrapper
+
+
+def _write_inputs(dirpath: str, ext: str, n_items: int, upload_kb: int) -> None:
+    data: bytes = b"benchmark " * (upload_kb * 1024 // 10)
+    for ii in range(n_items):
+        with open(os.path.join(dirpath, f"item{ii:05d}{ext}"), "wb") as ff:
+            ff.write(data)
+
+
+def run_case(
+    name: str, workdir: str, n_items: int = N_ITEMS,
+    max_workers: int = MAX_WORKERS, upload_kb: int = UPLOAD_KB
+) -> Dict[str, Any]:
+    """Runs one case in this process. Called in the child interpreter.
+
+    Args:
+        name (str): One of CASES.
+        workdir (str): An empty directory for the inputs and the outputs.
+        n_items (int, optional): The number of files or calls. Defaults to N_ITEMS.
+        max_workers (int, optional): The concurrent calls of `gpt` and
+            `bing_search`. The `*_from_dir` functions are sequential.
+            Defaults to MAX_WORKERS.
+        upload_kb (int, optional): The size of each input file. Defaults to UPLOAD_KB.
+
+    Returns:
+        dict: The measurements.
+
+    Raises:
+        ValueError: If `name` is not one of CASES.
+    """
+    # pylint: disable=import-outside-toplevel
+    latencies: List[float] = []
+    run: Callable[[], Any]
+    warmup: Callable[[], Any]
+    if name == "ocr":
+        from ...ocr.src import main as ocr
+        _write_inputs(workdir, ".png", n_items, upload_kb)
+        ocr.WAIT_TIME_SEC = 0.0
+        warmup = partial(ocr.analyze, os.path.join(workdir, "item00000.png"))
+        ocr.analyze = _timed(ocr.analyze, latencies)
+
+        def run_ocr() -> None:
+            ocr.analyze_from_dir(workdir)
+        run = run_ocr
+    elif name == "translation":
+        from ...translation.src import main as translation
+        _write_inputs(workdir, ".txt", n_items, upload_kb)
+        translation.WAIT_TIME_SEC = 0.0
+        warmup = partial(translation.translate, "warm up")
+        translation.translate = _timed(translation.translate, latencies)
+
+        def run_translation() -> None:
+            translation.translate_from_dir(workdir)
+        run = run_translation
+    elif name == "speech_to_text":
+        from ...speech_to_text.src import main as speech_to_text
+        _write_inputs(workdir, ".wav", n_items, upload_kb)
+        speech_to_text.WAIT_TIME_SEC = 0.0
+        warmup = partial(
+            speech_to_text.analyze_with_fast, os.path.join(workdir, "item00000.wav")
+        )
+        speech_to_text.analyze_with_fast = _timed(speech_to_text.analyze_with_fast, latencies)
+
+        def run_speech_to_text() -> None:
+            speech_to_text.analyze_from_dir(workdir, fast_mode=True)
+        run = run_speech_to_text
+    elif name == "gpt":
+        from ...gpt.src import main as gpt
+        warmup = partial(gpt.chat, "warm up")
+        chat = _timed(gpt.chat, latencies)
+
+        def run_chat() -> None:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(chat, [f"question {ii}" for ii in range(n_items)]))
+        run = run_chat
+    elif name == "bing_search":
+        from ...bing_search.src import main as bing_search
+        warmup = partial(bing_search.search_with_retry, "warm up")
+        search = _timed(bing_search.search_with_retry, latencies)
+
+        def run_search() -> None:
+            session = bing_search.create_session(max_workers)
+            with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(
+                    lambda query: search(query, session=session),
+                    [f"query {ii}" for ii in range(n_items)]
+                ))
+        run = run_search
+    else:
+        raise ValueError(f"'name' must be one of {CASES}.")
+    warmup()
+    st: float = time.perf_counter()
+    run()
+    elapsed_sec: float = time.perf_counter() - st
+    return {
+        "items": n_items,
+        "calls": len(latencies),
+        "elapsed_sec": elapsed_sec,
+        "items_per_sec": n_items / elapsed_sec if elapsed_sec > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000.0,
+        "p99_ms": percentile(latencies, 99) * 1000.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure(
+    name: str, config: MockConfig | None = None, n_items: int = N_ITEMS,
+    max_workers: int = MAX_WORKERS, upload_kb: int = UPLOAD_KB
+) -> Dict[str, Any]:
+    """Runs one case in a fresh interpreter against a new mock server.
+
+    Args:
+        name (str): One of CASES.
+        config (MockConfig, optional): The behavior of the mock server.
+        n_items (int, optional): Defaults to N_ITEMS.
+        max_workers (int, optional): Defaults to MAX_WORKERS.
+        upload_kb (int, optional): Defaults to UPLOAD_KB.
+
+    Returns:
+        dict: The measurements of `run_case` and the requests received by the server.
+
+    Raises:
+        subprocess.CalledProcessError: If the case fails.
+    """
+    with MockAzureServer(config) as server, tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, "-c", _SCRIPT.format(
+                name=name, workdir=workdir, n_items=n_items,
+                max_workers=max_workers, upload_kb=upload_kb
+            )],
+            env={**os.environ, **server.environ()},
+            capture_output=True, text=True, check=True
+        ).stdout
+        result: Dict[str, Any] = json.loads(output.strip().splitlines()[-1])
+        counts: Dict[str, int] = server.counts
+    result["requests"] = sum(count for route, count in counts.items() if route != "throttled")
+    result["throttled"] = counts.get("throttled", 0)
+    return result
+
+
+def compare(
+    result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE
+) -> List[str]:
+    """Returns the regressions of a case from its baseline.
+
+    Args:
+        result (dict): The measurements of the case.
+        baseline (dict): The measurements of the case in the baseline.
+        tolerance (float, optional): The allowed relative change. Defaults to TOLERANCE.
+
+    Returns:
+        list of str: The descriptions of the regressions.
+    """
+    regressions: List[str] = []
+    if result["items_per_sec"] < baseline["items_per_sec"] * (1.0 - tolerance):
+        regressions.append(
+            f"items/sec {result['items_per_sec']:.2f} < {baseline['items_per_sec']:.2f}"
+        )
+    if result["p99_ms"] > baseline["p99_ms"] * (1.0 + tolerance):
+        regressions.append(f"p99 {result['p99_ms']:.1f} ms > {baseline['p99_ms']:.1f} ms")
+    if (
+        result["peak_rss_mb"] is not None and baseline.get("peak_rss_mb") is not None
+        and result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1.0 + tolerance)
+    ):
+        regressions.append(
+            f"peak RSS {result['peak_rss_mb']:.1f} MB > {baseline['peak_rss_mb']:.1f} MB"
+        )
+    return regressions
+
+
+def main(
+    cases: List[str] | None = None, n_items: int = N_ITEMS,
+    max_workers: int = MAX_WORKERS, latency_ms: float = LATENCY_MS,
+    jitter_ms: float = 0.0, throttle_rate: float = 0.0,
+    payload_size: int = PAYLOAD_SIZE, upload_kb: int = UPLOAD_KB,
+    output: str | None = None, baseline: str | None = None,
+    tolerance: float = TOLERANCE
+) -> None:
+    """Runs the cases, prints the results and exits with 1 if any case
+    regressed from the baseline.
+
+    Args:
+        cases (list of str, optional): The cases to run. All of CASES if None.
+        n_items (int, optional): The number of files or calls per case. Defaults to N_ITEMS.
+        max_workers (int, optional): Defaults to MAX_WORKERS.
+        latency_ms (float, optional): The latency of the mock server. Defaults to LATENCY_MS.
+        jitter_ms (float, optional): The maximum random latency added to `latency_ms`.
+        throttle_rate (float, optional): The fraction of responses throttled with 429.
+        payload_size (int, optional): The size of the responses. Defaults to PAYLOAD_SIZE.
+        upload_kb (int, optional): The size of each input file. Defaults to UPLOAD_KB.
+        output (str, optional): A JSON file to save the results in, e.g. to use as a baseline.
+        baseline (str, optional): A JSON file saved by a previous run to compare with.
+        tolerance (float, optional): The allowed relative change from the baseline.
+            Defaults to TOLERANCE.
+    """
+    config = MockConfig(
+        latency_ms=latency_ms, jitter_ms=jitter_ms,
+        throttle_rate=throttle_rate, payload_size=payload_size
+    )
+    baselines: Dict[str, Dict[str, Any]] = {}
+    if baseline is not None:
+        with open(baseline, "r", encoding="utf-8") as ff:
+            baselines = json.load(ff)
+    results: Dict[str, Dict[str, Any]] = {}
+    n_failed: int = 0
+    for name in cases or CASES:
+        result = measure(name, config, n_items, max_workers, upload_kb)
+        results[name] = result
+        regressions: List[str] = (
+            compare(result, baselines[name], tolerance) if name in baselines else []
+        )
+        n_failed += int(bool(regressions))
+        rss: str = "-" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.1f} MB"
+        print(
+            f"{'FAIL' if regressions else 'ok'}: {name}: "
+            f"{result['items_per_sec']:.2f} items/sec, "
+            f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+            f"peak RSS {rss}, {result['requests']} requests, {result['throttled']} throttled"
+        )
+        for regression in regressions:
+            print(f"    {regression}")
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as ff:
+            json.dump(results, ff, indent=4)
+    print(f"finished. {n_failed} of {len(results)} cases regressed.")
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cases", dest="cases", type=str, nargs="+", choices=CASES, default=None
+    )
+    parser.add_argument(
+        "--items", dest="items", type=int, default=N_ITEMS
+    )
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=MAX_WORKERS
+    )
+    parser.add_argument(
+        "--latency_ms", dest="latency_ms", type=float, default=LATENCY_MS
+    )
+    parser.add_argument(
+        "--jitter_ms", dest="jitter_ms", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--throttle_rate", dest="throttle_rate", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--payload_size", dest="payload_size", type=int, default=PAYLOAD_SIZE
+    )
+    parser.add_argument(
+        "--upload_kb", dest="upload_kb", type=int, default=UPLOAD_KB
+    )
+    parser.add_argument(
+        "--output", dest="output", type=str, default=None
+    )
+    parser.add_argument(
+        "--baseline", dest="baseline", type=str, default=None
+    )
+    parser.add_argument(
+        "--tolerance", dest="tolerance", type=float, default=TOLERANCE
+    )
+    args = parser.parse_args()
+    main(
+        args.cases, args.items, args.workers, args.latency_ms, args.jitter_ms,
+        args.throttle_rate, args.payload_size, args.upload_kb,
+        args.output, args.baseline, args.tolerance
+    )
@@ -1,3 +1,12 @@
 """bing_search"""
 
-from .src import main as bing_search
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as bing_search
+
+__all__ = ["bing_search"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "bing_search": ".src.main"
+}, fallback=".src.main")
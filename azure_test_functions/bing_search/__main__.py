@@ -1,16 +1,49 @@
 """bing_search"""
 
-from .src.main import main, MARKET_DEFAULT
+from .src.main import main, main_batch, MARKET_DEFAULT, MAX_WORKERS, OUTPUT_MODES
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("query", type=str)
+    parser.add_argument("query", type=str, nargs="?", default=None)
     parser.add_argument(
         "--mkt", dest="mkt", type=str, default=MARKET_DEFAULT
     )
     parser.add_argument(
         "--dst", dest="dst", type=str, default=""
     )
+    parser.add_argument(
+        "--queries", dest="queries", type=str, default=None,
+        help="a file with one query per line"
+    )
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=MAX_WORKERS
+    )
+    parser.add_argument(
+        "--count", dest="count", type=int, default=0,
+        help="the number of results to get by paging"
+    )
+    parser.add_argument(
+        "--ttl", dest="ttl", type=float, default=0.0,
+        help="the seconds a cached result is fresh (no cache if 0)"
+    )
+    parser.add_argument(
+        "--cache_dir", dest="cache_dir", type=str, default=None
+    )
+    parser.add_argument(
+        "--output_mode", dest="output_mode", type=str, default="file",
+        choices=OUTPUT_MODES
+    )
     args = parser.parse_args()
-    main(args.query, args.mkt, args.dst)
+    if args.queries is not None:
+        main_batch(
+            args.queries, args.mkt, args.dst, args.workers,
+            args.ttl, args.cache_dir, args.output_mode
+        )
+    elif args.query is not None:
+        main(
+            args.query, args.mkt, args.dst, args.count,
+            args.ttl, args.cache_dir, args.output_mode
+        )
+    else:
+        parser.error("either 'query' or '--queries' is required.")
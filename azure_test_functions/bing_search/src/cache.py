@@ -0,0 +1,177 @@
+"""cache.py
+
+TTL result cache for Bing search queries.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Set, Tuple
+
+TTL_SEC: float = 900.0
+STALE_SEC: float = 3600.0
+MAX_ENTRIES: int = 1024
+REFRESH_WORKERS: int = 2
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a query so that trivially different queries share a cache entry."""
+    return " ".join(query.casefold().split())
+
+
+def cache_key(query: str, mkt: str, params: Dict[str, str] | None = None) -> str:
+    """Returns the key of a cache entry.
+
+    Args:
+        query (str): The search query.
+        mkt (str): The market.
+        params (dict, optional): Additional query parameters.
+
+    Returns:
+        str: The SHA-256 hex digest of the normalized query, market and parameters.
+    """
+    value = json.dumps(
+        [normalize_query(query), mkt.lower(), sorted((params or {}).items())],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    """Cache of search results with an in-memory LRU tier and an optional on-disk tier.
+
+    A result younger than `ttl_sec` is returned as it is. A result older than
+    that but younger than `ttl_sec + stale_sec` is returned immediately too,
+    while it is refreshed in the background (stale-while-revalidate).
+    Older results are fetched again before returning.
+
+    Args:
+        fetch (callable): A function searching the web with a query, a market
+            and additional parameters, e.g. `search_with_retry`.
+        ttl_sec (float, optional): The seconds a result is fresh. Defaults to TTL_SEC.
+        stale_sec (float, optional): The seconds a stale result may still be returned.
+            Defaults to STALE_SEC.
+        max_entries (int, optional): The number of results kept in memory.
+            Defaults to MAX_ENTRIES.
+        dirpath (str, optional): The directory of the on-disk tier.
+            Results are kept only in memory if None.
+    """
+
+    def __init__(
+        self, fetch: Callable[[str, str, Dict[str, str] | None], Dict[str, Any] | None],
+        ttl_sec: float = TTL_SEC, stale_sec: float = STALE_SEC,
+        max_entries: int = MAX_ENTRIES, dirpath: str | None = None
+    ) -> None:
+        self.fetch = fetch
+        self.ttl_sec: float = ttl_sec
+        self.stale_sec: float = stale_sec
+        self.max_entries: int = max_entries
+        self.dirpath: str | None = dirpath
+        if dirpath is not None and not os.path.exists(dirpath):
+            os.makedirs(dirpath, exist_ok=True)
+        self._entries: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS)
+
+    def close(self) -> None:
+        """Waits for the background refreshes."""
+        self._executor.shutdown(wait=True)
+
+    def _path(self, key: str) -> str:
+        assert self.dirpath is not None
+        return os.path.join(self.dirpath, f"{key}.json")
+
+    def _lookup(self, key: str) -> Tuple[float, Dict[str, Any]] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.dirpath is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as ff:
+                value = json.load(ff)
+        except (OSError, ValueError):
+            return None
+        entry = (float(value["fetched_at"]), dict(value["result"]))
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(
+        self, query: str, mkt: str, params: Dict[str, str] | None,
+        result: Dict[str, Any]
+    ) -> None:
+        """Stores a result in both tiers."""
+        key = cache_key(query, mkt, params)
+        entry = (time.time(), result)
+        self._remember(key, entry)
+        if self.dirpath is None:
+            return
+        tmppath: str = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmppath, "w", encoding="utf-8") as ff:
+            json.dump({
+                "fetched_at": entry[0], "query": query, "mkt": mkt,
+                "params": params or {}, "result": result
+            }, ff, ensure_ascii=False)
+        os.replace(tmppath, self._path(key))
+
+    def _fetch(
+        self, query: str, mkt: str, params: Dict[str, str] | None
+    ) -> Dict[str, Any] | None:
+        result = self.fetch(query, mkt, params)
+        if result is not None:
+            self.put(query, mkt, params, result)
+        return result
+
+    def _refresh(self, key: str, query: str, mkt: str, params: Dict[str, str] | None) -> None:
+        try:
+            self._fetch(query, mkt, params)
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            print(f"failure in refreshing '{query}': {ex}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def search(
+        self, query: str, mkt: str, params: Dict[str, str] | None = None
+    ) -> Dict[str, Any] | None:
+        """Returns a cached result, or searches the web if there is none.
+
+        Args:
+            query (str): The search query.
+            mkt (str): The market to target for the search.
+            params (dict, optional): Additional query parameters.
+
+        Returns:
+            dict: A JSON dictionary containing the search results, or None if no API key is provided.
+
+        Raises:
+            Exception: If `fetch` fails.
+        """
+        key = cache_key(query, mkt, params)
+        entry = self._lookup(key)
+        if entry is not None:
+            age: float = time.time() - entry[0]
+            if age < self.ttl_sec:
+                return entry[1]
+            if age < self.ttl_sec + self.stale_sec:
+                with self._lock:
+                    refresh: bool = key not in self._refreshing
+                    self._refreshing.add(key)
+                if refresh:
+                    self._executor.submit(self._refresh, key, query, mkt, params)
+                return entry[1]
+        return self._fetch(query, mkt, params)
@@ -1,17 +1,31 @@
 """Bing Search"""
 
+import contextlib
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+)
 from datetime import datetime
 import json
 import os
-from typing import Dict, Any
+from typing import ContextManager, Dict, Any, Iterable, Iterator, List, Set, TextIO, Tuple
 import warnings
 import requests
+from requests.adapters import HTTPAdapter
+from ...common.src.executor import EXECUTOR, CircuitOpenError
+from ...common.src.metrics import METRICS, profiled
+from ...common.src.result_log import ResultLog
+from .cache import SearchCache, STALE_SEC
 
 TIMEOUT_SEC: float = 30.0
 WAIT_TIME_SEC: float = 3.0
+MAX_WORKERS: int = 8
+PAGE_SIZE: int = 50
+MAX_RETRIES: int = 5
 MARKET_DEFAULT: str = 'en-US'
 DEFAULT_OUTPUT_DIRPATH: str = r'C:\home\local\test\data\bing_search'
 DATETIME_FORMAT: str = '%Y%m%d%H%M%S'
+LOG_DIRNAME: str = "log"
+OUTPUT_MODES: List[str] = ["file", "log"]
 
 KEY_BING: str | None = os.environ.get("AZURE_BING_KEY", None)
 ENDPOINT_BING_BASE: str | None = os.environ.get("AZURE_BING_ENDPOINT", None)
@@ -21,6 +35,7 @@ if ENDPOINT_BING_BASE is not None:
 ENDPOINT_LOCATION: str | None = os.environ.get("AZURE_BING_LOCATION", None)
 
 
+@METRICS.timed("bing_search.save")
 def save(fpath: str, value: Dict[str, Any]) -> None:
     """Saves a dictionary to a JSON file.
 
@@ -34,18 +49,47 @@ def save(fpath: str, value: Dict[str, Any]) -> None:
         json.dump(value, ff, indent=4)
 
 
-def search(query: str, mkt: str = MARKET_DEFAULT) -> Dict[str, Any] | None:
+def create_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """Creates a session keeping up to `pool_size` connections alive.
+
+    Args:
+        pool_size (int, optional): The number of pooled connections. Defaults to MAX_WORKERS.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@METRICS.timed("bing_search.search")
+def search(
+    query: str, mkt: str = MARKET_DEFAULT,
+    session: requests.Session | None = None,
+    params: Dict[str, str] | None = None, max_retries: int | None = None
+) -> Dict[str, Any] | None:
     """Searches the web using the Microsoft Bing Search API.
 
+    The request is sent through `EXECUTOR`, which retries throttled and failed requests.
+
     Args:
         query (str): The search query.
         mkt (str, optional): The market to target for the search. Defaults to MARKET_DEFAULT.
+        session (requests.Session, optional): The session to send the request with.
+            A new connection is opened if None.
+        params (dict, optional): Additional query parameters, e.g. `count` and `offset`.
+        max_retries (int, optional): The maximum number of retries.
+            Defaults to the retries of `EXECUTOR`.
 
     Returns:
         dict: A JSON dictionary containing the search results, or None if no API key is provided.
 
     Raises:
-        requests.exceptions.RequestException: If there is an error making the request.
+        requests.exceptions.RequestException: If the request still fails after the retries.
+        CircuitOpenError: If the endpoint keeps failing.
 
     Notes:
         This function requires a valid Azure Bing Search API key to be set.
@@ -55,22 +99,318 @@ def search(query: str, mkt: str = MARKET_DEFAULT) -> Dict[str, Any] | None:
         warnings.warn("No key for Azure Bing Search allocated.")
         return None
     headers = {'Ocp-Apim-Subscription-Key': KEY_BING}
-    params: Dict[str, str] = {'q': query, 'mkt': mkt}
-    response = requests.get(
-        ENDPOINT_BING, headers=headers,
-        params=params, timeout=TIMEOUT_SEC
+    params = {**(params or {}), 'q': query, 'mkt': mkt}
+
+    def send() -> Dict[str, Any]:
+        response = (session or requests).get(
+            ENDPOINT_BING, headers=headers,
+            params=params, timeout=TIMEOUT_SEC
+        )
+        response.raise_for_status()
+        return dict(response.json())
+    return EXECUTOR.call(ENDPOINT_BING, send, max_retries)
+
+
+def search_with_retry(
+    query: str, mkt: str = MARKET_DEFAULT,
+    session: requests.Session | None = None, max_retries: int = MAX_RETRIES,
+    params: Dict[str, str] | None = None
+) -> Dict[str, Any] | None:
+    """Searches the web like `search`, with `max_retries` defaulting to MAX_RETRIES.
+
+    A 429 or 5xx response, or a connection error, is retried after the time
+    given by the `Retry-After` header, or after an exponential backoff with
+    full jitter if the header is not given.
+
+    Args:
+        query (str): The search query.
+        mkt (str, optional): The market to target for the search. Defaults to MARKET_DEFAULT.
+        session (requests.Session, optional): The session to send the request with.
+        max_retries (int, optional): The maximum number of retries. Defaults to MAX_RETRIES.
+        params (dict, optional): Additional query parameters.
+
+    Returns:
+        dict: A JSON dictionary containing the search results, or None if no API key is provided.
+
+    Raises:
+        requests.exceptions.RequestException: If the request still fails after the retries.
+        CircuitOpenError: If the endpoint keeps failing.
+    """
+    return search(query, mkt, session, params, max_retries)
+
+
+def create_cache(
+    ttl_sec: float, dirpath: str | None = None,
+    session: requests.Session | None = None
+) -> SearchCache:
+    """Creates a result cache searching with `search_with_retry`.
+
+    Args:
+        ttl_sec (float): The seconds a result is fresh.
+        dirpath (str, optional): The directory of the on-disk tier.
+        session (requests.Session, optional): The session to send the requests with.
+
+    Returns:
+        SearchCache: The cache.
+    """
+    def fetch(query: str, mkt: str, params: Dict[str, str] | None) -> Dict[str, Any] | None:
+        return search_with_retry(query, mkt, session, MAX_RETRIES, params)
+    return SearchCache(fetch, ttl_sec, STALE_SEC, dirpath=dirpath)
+
+
+def search_batch(
+    queries: Iterable[str], mkt: str = MARKET_DEFAULT,
+    max_workers: int = MAX_WORKERS, cache: SearchCache | None = None,
+    session: requests.Session | None = None
+) -> Iterator[Tuple[str, Dict[str, Any] | None, str | None]]:
+    """Searches many queries concurrently over a pooled keep-alive session.
+
+    At most `2 * max_workers` queries are in flight, so `queries` may be
+    a lazy iterator over a large file.
+
+    Args:
+        queries (iterable of str): The search queries.
+        mkt (str, optional): The market to target for the search. Defaults to MARKET_DEFAULT.
+        max_workers (int, optional): The number of concurrent requests. Defaults to MAX_WORKERS.
+        cache (SearchCache, optional): The cache to look up before searching.
+        session (requests.Session, optional): The session to send the requests with,
+            e.g. the one of `cache`, left open. A new session is used and closed if None.
+
+    Yields:
+        tuple: The query, the search results or None, and the error message or None,
+        in the order the searches finish.
+    """
+    session_context: ContextManager[requests.Session] = (
+        contextlib.nullcontext(session) if session is not None
+        else create_session(max_workers)
     )
-    response.raise_for_status()
-    return dict(response.json())
+    in_flight: Dict[Future[Dict[str, Any] | None], str] = {}
+    query_iter = iter(queries)
+
+    def collect(done: Iterable[Future[Dict[str, Any] | None]]) -> Iterator[
+        Tuple[str, Dict[str, Any] | None, str | None]
+    ]:
+        for future in done:
+            query = in_flight.pop(future)
+            try:
+                yield query, future.result(), None
+            except (requests.exceptions.RequestException, CircuitOpenError) as ex:
+                yield query, None, str(ex)
+
+    with session_context as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for query in query_iter:
+            if cache is not None:
+                future = executor.submit(cache.search, query, mkt)
+            else:
+                future = executor.submit(search_with_retry, query, mkt, session)
+            in_flight[future] = query
+            if len(in_flight) >= 2 * max_workers:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                yield from collect(done)
+        while in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            yield from collect(done)
+
+
+def merge_pages(pages: List[Dict[str, Any]], count: int) -> Dict[str, Any]:
+    """Merges pages of results into a single result.
+
+    Web pages are deduplicated by URL keeping the first occurrence, and
+    the other answers (news, images, ...) are taken from the first page.
+
+    Args:
+        pages (list of dict): The pages in the order of their offsets.
+        count (int): The maximum number of web pages to keep.
+
+    Returns:
+        dict: The merged result.
+    """
+    if not pages:
+        return {}
+    merged: Dict[str, Any] = dict(pages[0])
+    values: List[Dict[str, Any]] = []
+    urls: Set[str] = set()
+    for page in pages:
+        for value in page.get("webPages", {}).get("value", []):
+            url: str = value.get("url", "")
+            if url in urls:
+                continue
+            urls.add(url)
+            values.append(value)
+    web_pages: Dict[str, Any] = dict(merged.get("webPages", {}))
+    web_pages["value"] = values[:count]
+    merged["webPages"] = web_pages
+    return merged
+
+
+def search_pages(
+    query: str, count: int, mkt: str = MARKET_DEFAULT,
+    page_size: int = PAGE_SIZE, max_workers: int = MAX_WORKERS,
+    session: requests.Session | None = None
+) -> Dict[str, Any] | None:
+    """Searches up to `count` results of a query by requesting pages concurrently.
+
+    All the `count`/`offset` pages are requested at once with up to
+    `max_workers` concurrent requests, so the whole search takes about as long
+    as one request. Once a page reports `totalEstimatedMatches`, or returns
+    fewer results than requested, the pages beyond the end are cancelled.
+
+    Args:
+        query (str): The search query.
+        count (int): The number of results to get.
+        mkt (str, optional): The market to target for the search. Defaults to MARKET_DEFAULT.
+        page_size (int, optional): The results per page, at most 50. Defaults to PAGE_SIZE.
+        max_workers (int, optional): The number of concurrent requests. Defaults to MAX_WORKERS.
+        session (requests.Session, optional): The session to send the requests with.
+            A pooled session is created if None.
+
+    Returns:
+        dict: The merged result, or None if no API key is provided.
+
+    Raises:
+        requests.exceptions.RequestException: If a request fails after the retries.
+    """
+    if not KEY_BING:
+        warnings.warn("No key for Azure Bing Search allocated.")
+        return None
+    own_session: bool = session is None
+    session = session or create_session(max_workers)
+    pages: Dict[int, Dict[str, Any]] = {}
+    end: int = count
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures: Dict[Future[Dict[str, Any] | None], int] = {
+                executor.submit(
+                    search_with_retry, query, mkt, session, MAX_RETRIES,
+                    {"count": str(min(page_size, count - offset)), "offset": str(offset)}
+                ): offset
+                for offset in range(0, count, page_size)
+            }
+            for future in as_completed(futures):
+                offset = futures[future]
+                if future.cancelled():
+                    continue
+                page = future.result()
+                if page is None:
+                    continue
+                pages[offset] = page
+                web_pages: Dict[str, Any] = page.get("webPages", {})
+                estimated = web_pages.get("totalEstimatedMatches")
+                if estimated is not None:
+                    end = min(end, int(estimated))
+                if len(web_pages.get("value", [])) < min(page_size, count - offset):
+                    end = min(end, offset + len(web_pages.get("value", [])))
+                for other, other_offset in futures.items():
+                    if other_offset >= end:
+                        other.cancel()
+    finally:
+        if own_session:
+            session.close()
+    return merge_pages([pages[offset] for offset in sorted(pages)], count)
+
+
+def read_queries(fpath: str) -> Iterator[str]:
+    """Yields the queries in a file, one per line, skipping blank lines and comments."""
+    with open(fpath, "r", encoding="utf-8") as ff:
+        for line in ff:
+            query = line.strip()
+            if query and not query.startswith("#"):
+                yield query
+
 
+@profiled("bing_search.main_batch")
+def main_batch(
+    queries_fpath: str, mkt: str = MARKET_DEFAULT, dst: str = "",
+    max_workers: int = MAX_WORKERS, ttl_sec: float = 0.0,
+    cache_dir: str | None = None, output_mode: str = "file"
+) -> None:
+    """Searches the queries in a file and appends the results to a JSON Lines file,
+    or to a result log, as they finish.
 
-def main(query: str, mkt: str = MARKET_DEFAULT, dst: str = "") -> None:
+    Args:
+        queries_fpath (str): The path of a file with one query per line.
+        mkt (str, optional): The market to target for the search. Defaults to MARKET_DEFAULT.
+        dst (str, optional): The path of the JSON Lines file, or the directory
+            of the result log. Defaults to a path in DEFAULT_OUTPUT_DIRPATH.
+        max_workers (int, optional): The number of concurrent requests. Defaults to MAX_WORKERS.
+        ttl_sec (float, optional): The seconds a cached result is fresh.
+            Results are not cached if 0.
+        cache_dir (str, optional): The directory to cache results in across runs.
+        output_mode (str, optional): "file" or "log". Defaults to "file".
+    """
+    if not KEY_BING:
+        warnings.warn("No key for Azure Bing Search allocated.")
+        return
+    EXECUTOR.configure(ENDPOINT_BING, max_workers)
+    session = create_session(max_workers)
+    cache: SearchCache | None = None
+    if ttl_sec > 0:
+        cache = create_cache(ttl_sec, cache_dir, session)
+    log: ResultLog | None = None
+    ff: TextIO | None = None
+    if output_mode == "log":
+        log = ResultLog(dst or os.path.join(DEFAULT_OUTPUT_DIRPATH, LOG_DIRNAME))
+    else:
+        if not dst:
+            now: str = datetime.now().strftime(DATETIME_FORMAT)
+            dst = os.path.join(DEFAULT_OUTPUT_DIRPATH, f"{now}_results.jsonl")
+        if not os.path.exists(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        ff = open(dst, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+    n_done: int = 0
+    n_failed: int = 0
+    try:
+        for query, result, error in search_batch(
+            read_queries(queries_fpath), mkt, max_workers, cache, session
+        ):
+            record: Dict[str, Any] = {"query": query, "mkt": mkt}
+            if error is None:
+                record["result"] = result
+            else:
+                record["error"] = error
+                n_failed += 1
+            if log is not None:
+                log.write(record)
+            elif ff is not None:
+                ff.write(json.dumps(record, ensure_ascii=False) + "\n")
+                ff.flush()
+            n_done += 1
+            if n_done % 100 == 0:
+                print(f"{n_done} queries done ({n_failed} failed).")
+    finally:
+        if log is not None:
+            log.close()
+        if ff is not None:
+            ff.close()
+        if cache is not None:
+            cache.close()
+        session.close()
+    print(f"finished. {n_done} queries done ({n_failed} failed).")
+
+
+def main(
+    query: str, mkt: str = MARKET_DEFAULT, dst: str = "", count: int = 0,
+    ttl_sec: float = 0.0, cache_dir: str | None = None,
+    output_mode: str = "file"
+) -> None:
     """main"""
-    response = search(query, mkt)
+    response: Dict[str, Any] | None = None
+    if count > 0:
+        response = search_pages(query, count, mkt)
+    elif ttl_sec > 0:
+        cache = create_cache(ttl_sec, cache_dir)
+        response = cache.search(query, mkt)
+        cache.close()
+    else:
+        response = search(query, mkt)
     if response is None:
         return
+    now: str = datetime.now().strftime(DATETIME_FORMAT)
+    if output_mode == "log":
+        with ResultLog(dst or os.path.join(DEFAULT_OUTPUT_DIRPATH, LOG_DIRNAME)) as log:
+            log.write({"datetime": now, "query": query, "mkt": mkt, "result": response})
+        return
     if not dst:
-        now: str = datetime.now().strftime(DATETIME_FORMAT)
         dst = os.path.join(DEFAULT_OUTPUT_DIRPATH, f"{now}_result.json")
     if not os.path.exists(os.path.dirname(dst)):
         os.makedirs(os.path.dirname(dst))
@@ -80,12 +420,45 @@ def main(query: str, mkt: str = MARKET_DEFAULT, dst: str = "") -> None:
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("query", type=str)
+    parser.add_argument("query", type=str, nargs="?", default=None)
     parser.add_argument(
         "--mkt", dest="mkt", type=str, default=MARKET_DEFAULT
     )
     parser.add_argument(
         "--dst", dest="dst", type=str, default=""
     )
+    parser.add_argument(
+        "--queries", dest="queries", type=str, default=None,
+        help="a file with one query per line"
+    )
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=MAX_WORKERS
+    )
+    parser.add_argument(
+        "--count", dest="count", type=int, default=0,
+        help="the number of results to get by paging"
+    )
+    parser.add_argument(
+        "--ttl", dest="ttl", type=float, default=0.0,
+        help="the seconds a cached result is fresh (no cache if 0)"
+    )
+    parser.add_argument(
+        "--cache_dir", dest="cache_dir", type=str, default=None
+    )
+    parser.add_argument(
+        "--output_mode", dest="output_mode", type=str, default="file",
+        choices=OUTPUT_MODES
+    )
     args = parser.parse_args()
-    main(args.query, args.mkt, args.dst)
+    if args.queries is not None:
+        main_batch(
+            args.queries, args.mkt, args.dst, args.workers,
+            args.ttl, args.cache_dir, args.output_mode
+        )
+    elif args.query is not None:
+        main(
+            args.query, args.mkt, args.dst, args.count,
+            args.ttl, args.cache_dir, args.output_mode
+        )
+    else:
+        parser.error("either 'query' or '--queries' is required.")
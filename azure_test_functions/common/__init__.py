@@ -0,0 +1,12 @@
+"""common"""
+
+from typing import TYPE_CHECKING
+from .src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import result_log
+
+__all__ = ["result_log"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "result_log": ".src.result_log"
+})
@@ -0,0 +1 @@
+"""common"""
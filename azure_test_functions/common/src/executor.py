@@ -0,0 +1,337 @@
+"""executor.py
+
+Resilient execution of calls to the Azure services.
+
+Every service module sends its calls through `EXECUTOR`, which retries
+transient failures with jittered exponential backoff or after `Retry-After`,
+caps the concurrent calls per endpoint and stops calling an endpoint that
+keeps failing for a while (circuit breaker). The attempts, retries and waits
+are recorded in `METRICS`.
+"""
+
+import random
+import threading
+import time
+from typing import Callable, Dict, Mapping, Set, TypeVar
+from .metrics import METRICS
+
+T = TypeVar("T")
+
+MAX_RETRIES: int = 5
+BACKOFF_BASE_SEC: float = 1.0
+BACKOFF_MAX_SEC: float = 60.0
+MAX_CONCURRENCY: int = 8
+FAILURE_THRESHOLD: int = 5
+RESET_TIMEOUT_SEC: float = 30.0
+CIRCUIT_WAIT_SEC: float = 120.0
+RETRY_STATUS_CODES: Set[int] = {408, 429, 500, 502, 503, 504}
+TRANSIENT_ERROR_NAMES: Set[str] = {
+    # requests
+    "ConnectionError", "Timeout", "ChunkedEncodingError",
+    # azure-core
+    "ServiceRequestError", "ServiceResponseError",
+    # openai
+    "APIConnectionError", "APITimeoutError",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit of an endpoint stays open longer than a call may wait."""
+
+
+def retry_after_sec(headers: Mapping[str, str] | None) -> float | None:
+    """Reads the time to wait from the headers of a throttled response.
+
+    `retry-after-ms` is preferred to `retry-after`, which may be
+    either a number of seconds or an HTTP date.
+
+    Args:
+        headers (dict): The response headers.
+
+    Returns:
+        float or None: The seconds to wait, or None if no header is given.
+    """
+    if not headers:
+        return None
+    lowered = {key.lower(): value for key, value in headers.items()}
+    value_ms = lowered.get("retry-after-ms")
+    if value_ms:
+        try:
+            return max(float(value_ms) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    value = lowered.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    import email.utils  # pylint: disable=import-outside-toplevel
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def status_code(ex: BaseException) -> int | None:
+    """Returns the HTTP status of an error raised by requests, azure-core or openai."""
+    value = getattr(ex, "status_code", None)
+    if value is None:
+        value = getattr(getattr(ex, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def error_retry_after_sec(ex: BaseException) -> float | None:
+    """Returns the time to wait given by the response of an error, if any."""
+    headers = getattr(getattr(ex, "response", None), "headers", None)
+    return retry_after_sec(headers) if isinstance(headers, Mapping) else None
+
+
+def is_transient(ex: BaseException) -> bool:
+    """Returns True if an error is worth retrying, i.e. a throttled or failed
+    response in RETRY_STATUS_CODES, a connection error or a timeout."""
+    status: int | None = status_code(ex)
+    if status is not None:
+        return status in RETRY_STATUS_CODES
+    if isinstance(ex, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(ex).__mro__)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` transient failures in a row, the circuit opens
+    and calls wait `reset_timeout_sec`. Then a single probe is let through
+    (half open): its success closes the circuit and its failure opens it again.
+    Throttling (429) is not counted as a failure: the endpoint is answering,
+    and `Executor` pauses it instead.
+
+    Args:
+        failure_threshold (int, optional): Defaults to FAILURE_THRESHOLD.
+        reset_timeout_sec (float, optional): Defaults to RESET_TIMEOUT_SEC.
+    """
+
+    def __init__(
+        self, failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout_sec: float = RESET_TIMEOUT_SEC
+    ) -> None:
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout_sec: float = reset_timeout_sec
+        self._lock = threading.Lock()
+        self._failures: int = 0
+        self._opened_at: float | None = None
+        self._probing: bool = False
+
+    @property
+    def is_open(self) -> bool:
+        """True if calls are being held back."""
+        with self._lock:
+            return self._opened_at is not None
+
+    def acquire(self) -> float:
+        """Returns 0 if a call may be made now, or else the seconds to wait before asking again."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            wait_sec: float = self._opened_at + self.reset_timeout_sec - time.monotonic()
+            if wait_sec > 0:
+                return wait_sec
+            if self._probing:
+                return min(self.reset_timeout_sec, 1.0)
+            self._probing = True
+            return 0.0
+
+    def record_success(self) -> None:
+        """Closes the circuit."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        """Counts a transient failure and opens the circuit at the threshold."""
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def cancel(self) -> None:
+        """Lets another call probe after a probe is interrupted."""
+        with self._lock:
+            self._probing = False
+
+
+class _Endpoint:
+    """State shared by the calls to one endpoint."""
+
+    def __init__(
+        self, max_concurrency: int, failure_threshold: int, reset_timeout_sec: float
+    ) -> None:
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout_sec)
+        self.lock = threading.Lock()
+        self.paused_until: float = 0.0
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_pause(self) -> None:
+        while True:
+            with self.lock:
+                wait_sec: float = self.paused_until - time.monotonic()
+            if wait_sec <= 0:
+                return
+            time.sleep(wait_sec)
+
+
+class Executor:
+    """Executor of calls with retries, per-endpoint concurrency caps and circuit breakers.
+
+    A transient failure (see `is_transient`) is retried after the time given
+    by `Retry-After` or after a full-jitter exponential backoff. A 429 response
+    pauses every call to the endpoint for that time, so that concurrent callers
+    slow down together instead of each being throttled in turn. The other
+    errors are raised immediately.
+    While the circuit of the endpoint is open, a call waits up to
+    `circuit_wait_sec` in total without using its retries.
+
+    Args:
+        max_retries (int, optional): Defaults to MAX_RETRIES.
+        backoff_base_sec (float, optional): The backoff of the first retry.
+            Defaults to BACKOFF_BASE_SEC.
+        backoff_max_sec (float, optional): The maximum backoff. Defaults to BACKOFF_MAX_SEC.
+        max_concurrency (int, optional): The concurrent calls per endpoint.
+            Defaults to MAX_CONCURRENCY.
+        failure_threshold (int, optional): Defaults to FAILURE_THRESHOLD.
+        reset_timeout_sec (float, optional): Defaults to RESET_TIMEOUT_SEC.
+        circuit_wait_sec (float, optional): The maximum seconds a call waits for
+            an open circuit. Defaults to CIRCUIT_WAIT_SEC.
+    """
+
+    def __init__(
+        self, max_retries: int = MAX_RETRIES,
+        backoff_base_sec: float = BACKOFF_BASE_SEC,
+        backoff_max_sec: float = BACKOFF_MAX_SEC,
+        max_concurrency: int = MAX_CONCURRENCY,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout_sec: float = RESET_TIMEOUT_SEC,
+        circuit_wait_sec: float = CIRCUIT_WAIT_SEC
+    ) -> None:
+        self.max_retries: int = max_retries
+        self.backoff_base_sec: float = backoff_base_sec
+        self.backoff_max_sec: float = backoff_max_sec
+        self.max_concurrency: int = max_concurrency
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout_sec: float = reset_timeout_sec
+        self.circuit_wait_sec: float = circuit_wait_sec
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, _Endpoint] = {}
+        self._concurrency: Dict[str, int] = {}
+
+    def configure(self, endpoint: str, max_concurrency: int) -> None:
+        """Sets the concurrency cap of an endpoint before its first call."""
+        with self._lock:
+            self._concurrency[endpoint] = max_concurrency
+            self._endpoints.pop(endpoint, None)
+
+    def _endpoint(self, endpoint: str) -> _Endpoint:
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = _Endpoint(
+                    self._concurrency.get(endpoint, self.max_concurrency),
+                    self.failure_threshold, self.reset_timeout_sec
+                )
+            return self._endpoints[endpoint]
+
+    def backoff_sec(self, attempt: int) -> float:
+        """Returns a full-jitter backoff of a retry."""
+        return random.uniform(
+            0.0, min(self.backoff_max_sec, self.backoff_base_sec * 2 ** attempt)
+        )
+
+    def call(
+        self, endpoint: str, func: Callable[[], T], max_retries: int | None = None
+    ) -> T:
+        """Calls a function sending one request to an endpoint.
+
+        Args:
+            endpoint (str): The key of the endpoint, e.g. its base URL.
+            func (callable): A function without arguments sending the request.
+                It is called again on each retry.
+            max_retries (int, optional): Overrides `self.max_retries`.
+
+        Returns:
+            The return value of `func`.
+
+        Raises:
+            CircuitOpenError: If the circuit of the endpoint is still open after `circuit_wait_sec`.
+            Exception: The error of the last attempt, or a non-transient error.
+        """
+        state = self._endpoint(endpoint)
+        n_retries: int = self.max_retries if max_retries is None else max_retries
+        attempt: int = 0
+        circuit_deadline: float | None = None
+        while True:
+            wait_sec: float = state.breaker.acquire()
+            if wait_sec > 0:
+                now: float = time.monotonic()
+                if circuit_deadline is None:
+                    circuit_deadline = now + self.circuit_wait_sec
+                if now >= circuit_deadline:
+                    METRICS.inc("calls_total", endpoint=endpoint, outcome="circuit_open")
+                    raise CircuitOpenError(f"circuit open for '{endpoint}'.")
+                wait_sec = min(wait_sec, circuit_deadline - now)
+                METRICS.inc("wait_seconds_total", wait_sec, endpoint=endpoint, reason="circuit")
+                time.sleep(wait_sec)
+                continue
+            st: float = time.perf_counter()
+            state.wait_pause()
+            if attempt:
+                METRICS.inc("retries_total", endpoint=endpoint)
+            paused_sec: float = time.perf_counter() - st
+            if paused_sec > 0.001:
+                METRICS.inc("wait_seconds_total", paused_sec, endpoint=endpoint, reason="pause")
+            st = time.perf_counter()
+            try:
+                with state.semaphore:
+                    result: T = func()
+            except Exception as ex:
+                METRICS.observe("call_seconds", time.perf_counter() - st, endpoint=endpoint)
+                if not is_transient(ex):
+                    METRICS.inc("calls_total", endpoint=endpoint, outcome="error")
+                    state.breaker.record_success()
+                    raise
+                METRICS.inc("calls_total", endpoint=endpoint, outcome="transient")
+                if status_code(ex) == 429:
+                    METRICS.inc("throttled_total", endpoint=endpoint)
+                    state.breaker.cancel()
+                else:
+                    state.breaker.record_failure()
+                if attempt >= n_retries:
+                    raise
+                delay: float | None = error_retry_after_sec(ex)
+                if delay is not None and status_code(ex) == 429:
+                    state.pause(delay)
+                sleep_sec: float = self.backoff_sec(attempt) if delay is None else delay
+                METRICS.inc(
+                    "wait_seconds_total", sleep_sec, endpoint=endpoint,
+                    reason="backoff" if delay is None else "retry_after"
+                )
+                time.sleep(sleep_sec)
+                attempt += 1
+                continue
+            except BaseException:
+                state.breaker.cancel()
+                raise
+            METRICS.observe("call_seconds", time.perf_counter() - st, endpoint=endpoint)
+            METRICS.inc("calls_total", endpoint=endpoint, outcome="ok")
+            state.breaker.record_success()
+            return result
+
+
+EXECUTOR: Executor = Executor()
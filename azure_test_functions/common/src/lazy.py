@@ -0,0 +1,55 @@
+"""lazy.py
+
+Module-level lazy attribute loading (PEP 562).
+"""
+
+import importlib
+import sys
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def lazy_attributes(
+    package: str, submodules: Dict[str, str], fallback: str | None = None
+) -> Tuple[Callable[[str], Any], Callable[[], List[str]]]:
+    """Returns `__getattr__` and `__dir__` of a package importing submodules on first access.
+
+    The imported module is bound to the package, so `__getattr__` is called
+    only once per name. Usage in `__init__.py`:
+
+        __getattr__, __dir__ = lazy_attributes(__name__, {"ocr": ".src.main"})
+
+    Importing a subpackage binds it to its parent package, which shadows an
+    attribute of the same name, e.g. `azure_test_functions.ocr` is the package
+    instead of `ocr.src.main` after `azure_test_functions.ocr_merge_texts` is
+    imported. Such bindings are dropped after each import so that the
+    attribute is resolved again, and a package given `fallback` looks up the
+    other public attributes in that module, so both behave alike.
+
+    Args:
+        package (str): The name of the package, i.e. `__name__`.
+        submodules (dict): The relative module paths keyed by the attribute names.
+        fallback (str, optional): The relative path of the module to look up
+            the other attributes in.
+
+    Returns:
+        tuple: The functions to assign to `__getattr__` and `__dir__`.
+    """
+    def __getattr__(name: str) -> Any:
+        if name not in submodules:
+            if fallback is None or name.startswith("__"):
+                raise AttributeError(f"module {package!r} has no attribute {name!r}")
+            return getattr(importlib.import_module(fallback, package), name)
+        module: ModuleType = importlib.import_module(submodules[name], package)
+        namespace: Dict[str, Any] = vars(sys.modules[package])
+        for other in submodules:
+            bound = namespace.get(other)
+            if isinstance(bound, ModuleType) and bound.__name__ == f"{package}.{other}":
+                del namespace[other]
+        namespace[name] = module
+        return module
+
+    def __dir__() -> List[str]:
+        return sorted(set(vars(sys.modules[package])) | set(submodules))
+
+    return __getattr__, __dir__
@@ -0,0 +1,420 @@
+"""manifest.py
+
+Per-run job manifest of directory runs.
+
+A manifest is a SQLite database in the output directory of a run holding
+one row per input file with its state, the number of attempts, the last
+error, the latency of the last attempt and the path of its output.
+Once a directory has been scanned, reruns read the pending items from the
+manifest instead of listing and checking the directory again.
+
+Several workers, e.g. processes on VMs sharing the directory over NFS, can
+run on the same manifest. An item is claimed by an atomic update of its row
+before it is processed, so no item is processed by two workers, and:
+    * with a shard `i/N`, a worker only takes the items whose names hash to `i`,
+    * with a lease, a worker holds its running item for `lease_sec` seconds,
+      renewed while it is alive, and the item of a crashed worker is taken
+      over by another worker once its lease has expired.
+The database relies on the file locks of the file system, which NFSv4
+supports; the lease covers the items left by workers that lost their mount.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple
+
+MANIFEST_FILENAME: str = "manifest.sqlite3"
+PENDING: str = "pending"
+RUNNING: str = "running"
+DONE: str = "done"
+FAILED: str = "failed"
+STATES: List[str] = [PENDING, RUNNING, DONE, FAILED]
+LEASE_SEC: float = 300.0
+BUSY_TIMEOUT_SEC: float = 60.0
+HISTORY_SIZE: int = 200
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parses a shard given as `i/N`, e.g. `0/4`, into `(i, N)`.
+
+    Raises:
+        ValueError: If `value` is not `i/N` with 0 <= i < N.
+    """
+    index, sep, count = value.partition("/")
+    if not sep or not index.isdigit() or not count.isdigit() or not int(index) < int(count):
+        raise ValueError(f"a shard must be 'i/N' with 0 <= i < N: {value}")
+    return int(index), int(count)
+
+
+def shard_of(name: str, count: int) -> int:
+    """Returns the shard of an item, the same on every host and process."""
+    return zlib.crc32(name.encode("utf-8")) % count
+
+
+def default_worker() -> str:
+    """Returns the name of this process, `<host>:<pid>`."""
+    import socket  # pylint: disable=import-outside-toplevel
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_worker_alive(worker: str) -> bool | None:
+    """Tells if a worker named by `default_worker` is still running.
+
+    Returns:
+        bool or None: Whether the process exists, or None if it runs on
+        another host (or on Windows), where it cannot be told.
+    """
+    import socket  # pylint: disable=import-outside-toplevel
+    host, _, pid = worker.rpartition(":")
+    if os.name == "nt" or host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # owned by another user
+        return True
+    return True
+
+
+def existing_path(path: str) -> str | None:
+    """Returns the path if it exists, or else None."""
+    return path if os.path.exists(path) else None
+
+
+class Manifest:
+    """Item states of a directory run.
+
+    Items are the names of the input files relative to the input directory.
+    An item left `running` by an interrupted run is pending again at the
+    next run, while a `failed` item is retried only if asked to.
+    With `lease_sec`, an item left `running` by another worker is only taken
+    once its lease has expired, and the leases of this worker are renewed
+    by a background thread until the manifest is closed.
+
+    Args:
+        dirpath (str): The output directory of the run. It is created if it does not exist.
+        shard (tuple of int, optional): `(i, N)` to take only the items of the shard `i`
+            of `N`, e.g. from `parse_shard`. Every item if None.
+        lease_sec (float, optional): The length of the leases on the running items
+            to share the items with other workers. No lease if None.
+        worker (str, optional): The name of this worker. Defaults to `default_worker()`.
+    """
+
+    def __init__(
+        self, dirpath: str, shard: Tuple[int, int] | None = None,
+        lease_sec: float | None = None, worker: str | None = None
+    ) -> None:
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self.path: str = os.path.join(dirpath, MANIFEST_FILENAME)
+        self.shard: Tuple[int, int] | None = shard
+        self.lease_sec: float | None = lease_sec
+        self.worker: str = worker or default_worker()
+        self.opened_at: float = time.time()
+        self.conn: sqlite3.Connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SEC)
+        self.conn.create_function("shard_of", 2, shard_of, deterministic=True)
+        self.conn.create_function("is_abandoned", 2, self._is_abandoned)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                latency_sec REAL,
+                output TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS items_state ON items (state, name);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL
+            );
+            """
+        )
+        columns = {str(row[1]) for row in self.conn.execute("PRAGMA table_info(items)")}
+        for column, kind in [("worker", "TEXT"), ("lease_expires", "REAL")]:
+            if column not in columns:
+                try:
+                    self.conn.execute(f"ALTER TABLE items ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError as ex:
+                    if "duplicate column" not in str(ex):  # added by another worker
+                        raise
+        self._stop_renewal = threading.Event()
+        self._renewal: threading.Thread | None = None
+        if lease_sec is not None:
+            self._renewal = threading.Thread(target=self._renew_leases, daemon=True)
+            self._renewal.start()
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Releases the items still running in this worker and closes the database."""
+        if self._renewal is not None:
+            self._stop_renewal.set()
+            self._renewal.join()
+            self._renewal = None
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE items SET state = ?, lease_expires = NULL "
+                    "WHERE state = ? AND worker = ?",
+                    (PENDING, RUNNING, self.worker)
+                )
+        self.conn.close()
+
+    def _renew_leases(self) -> None:
+        assert self.lease_sec is not None
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SEC)
+        try:
+            while not self._stop_renewal.wait(self.lease_sec / 3):
+                with conn:
+                    conn.execute(
+                        "UPDATE items SET lease_expires = ? WHERE state = ? AND worker = ?",
+                        (time.time() + self.lease_sec, RUNNING, self.worker)
+                    )
+        finally:
+            conn.close()
+
+    def _is_abandoned(self, worker: str | None, updated_at: float) -> bool:
+        """Tells if an item running without a lease was left by a worker that is gone."""
+        if worker is None or worker == self.worker:
+            return True
+        alive: bool | None = is_worker_alive(worker)
+        if alive is None:
+            return updated_at < self.opened_at
+        return not alive
+
+    def is_scanned(self) -> bool:
+        """Returns True if the input directory has been scanned."""
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'scanned_at'"
+        ).fetchone()
+        return row is not None
+
+    def add(self, items: Iterable[Tuple[str, str | None]]) -> int:
+        """Adds items not known yet and marks the directory as scanned.
+
+        Args:
+            items (iterable of tuple): Pairs of a name and the path of its
+                output if it already exists, e.g. from a run without a manifest.
+
+        Returns:
+            int: The number of items added.
+        """
+        now: float = time.time()
+        with self.conn:
+            n_before: int = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO items (name, state, output, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (name, PENDING if output is None else DONE, output, now)
+                    for name, output in items
+                ]
+            )
+            n_added: int = self.conn.total_changes - n_before
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('scanned_at', ?)", (str(now),)
+            )
+        return n_added
+
+    def pending(self, retry_failed: bool = False) -> List[str]:
+        """Returns the names of the items to process in order.
+
+        The items of other shards are left out. An item in the list may be
+        taken by another worker in the meantime, which `start` tells.
+
+        Args:
+            retry_failed (bool, optional): Includes the failed items if True.
+
+        Returns:
+            list of str: The names.
+        """
+        states: List[str] = [PENDING, RUNNING] + ([FAILED] if retry_failed else [])
+        query: str = f"SELECT name FROM items WHERE state IN ({','.join('?' * len(states))})"
+        params: List[Any] = list(states)
+        if self.shard is not None:
+            query += " AND shard_of(name, ?) = ?"
+            params += [self.shard[1], self.shard[0]]
+        return [
+            str(name) for (name,) in self.conn.execute(query + " ORDER BY name", params)
+        ]
+
+    def _update(self, name: str, state: str, **values: Any) -> None:
+        assignments: str = "".join(f", {key} = ?" for key in values)
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE items SET state = ?, updated_at = ?{assignments} WHERE name = ?",
+                [state, time.time(), *values.values(), name]
+            )
+
+    def start(self, name: str) -> bool:
+        """Claims an item, marking it as running and counting the attempt.
+
+        The claim fails if another worker has taken the item since `pending`
+        was called, i.e. if the item is done, has failed since this manifest
+        was opened, or is running under a lease that has not expired. An item
+        running without a lease is only taken from a worker which has exited,
+        or, for a worker of another host, if it was started before this
+        manifest was opened; workers of several hosts should use leases.
+
+        Returns:
+            bool: True if the item is claimed by this worker.
+        """
+        now: float = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE items SET state = ?, attempts = attempts + 1, updated_at = ?, "
+                "worker = ?, lease_expires = ? "
+                "WHERE name = ? AND (state = ? OR (state = ? AND updated_at < ?) "
+                "OR (state = ? AND (lease_expires < ? "
+                "OR (lease_expires IS NULL AND is_abandoned(worker, updated_at)))))",
+                (
+                    RUNNING, now, self.worker,
+                    None if self.lease_sec is None else now + self.lease_sec,
+                    name, PENDING, FAILED, self.opened_at, RUNNING, now
+                )
+            )
+            return cursor.rowcount == 1
+
+    def is_finished(self) -> bool:
+        """Returns True if no item is pending or running in any worker."""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM items WHERE state IN (?, ?)", (PENDING, RUNNING)
+        ).fetchone()
+        return int(row[0]) == 0
+
+    def succeed(self, name: str, output: str, latency_sec: float) -> None:
+        """Marks an item as done."""
+        self._update(name, DONE, output=output, latency_sec=latency_sec, last_error=None)
+
+    def fail(self, name: str, error: str, latency_sec: float) -> None:
+        """Marks an item as failed."""
+        self._update(name, FAILED, last_error=error, latency_sec=latency_sec)
+
+    def retry(self, names: Iterable[str] | None = None) -> int:
+        """Marks failed items as pending.
+
+        Args:
+            names (iterable of str, optional): The items to retry. All the failed items if None.
+
+        Returns:
+            int: The number of items marked.
+        """
+        with self.conn:
+            if names is None:
+                cursor = self.conn.execute(
+                    "UPDATE items SET state = ? WHERE state = ?", (PENDING, FAILED)
+                )
+            else:
+                cursor = self.conn.executemany(
+                    "UPDATE items SET state = ? WHERE state = ? AND name = ?",
+                    [(PENDING, FAILED, name) for name in names]
+                )
+            return cursor.rowcount
+
+    def reset(self, names: Iterable[str]) -> int:
+        """Marks items as pending again, e.g. the inputs changed since they were done.
+
+        Returns:
+            int: The number of items marked.
+        """
+        with self.conn:
+            cursor = self.conn.executemany(
+                "UPDATE items SET state = ?, updated_at = ? WHERE name = ?",
+                [(PENDING, time.time(), name) for name in names]
+            )
+            return cursor.rowcount
+
+    def remove(self, names: Iterable[str]) -> int:
+        """Removes items, e.g. the inputs deleted from the directory.
+        Their outputs are left as they are.
+
+        Returns:
+            int: The number of items removed.
+        """
+        with self.conn:
+            cursor = self.conn.executemany(
+                "DELETE FROM items WHERE name = ?", [(name,) for name in names]
+            )
+            return cursor.rowcount
+
+    def outputs(self) -> List[str]:
+        """Returns the outputs of the done items in order of their names."""
+        return [
+            str(output) for (output,) in self.conn.execute(
+                "SELECT output FROM items WHERE state = ? ORDER BY name", (DONE,)
+            )
+        ]
+
+    def summary(self) -> Dict[str, int]:
+        """Returns the number of items in each state."""
+        counts: Dict[str, int] = {state: 0 for state in STATES}
+        for state, count in self.conn.execute(
+            "SELECT state, COUNT(*) FROM items GROUP BY state"
+        ):
+            counts[str(state)] = int(count)
+        return counts
+
+    def latencies(self, limit: int = HISTORY_SIZE) -> List[Tuple[str, float]]:
+        """Returns the latest done items with the latencies of their last attempts.
+
+        The items whose outputs existed before the first scan have no latency.
+        """
+        return [
+            (str(name), float(latency_sec)) for name, latency_sec in self.conn.execute(
+                "SELECT name, latency_sec FROM items WHERE state = ? AND latency_sec IS NOT NULL "
+                "ORDER BY updated_at DESC LIMIT ?", (DONE, limit)
+            )
+        ]
+
+    def failures(self) -> List[Dict[str, Any]]:
+        """Returns the failed items with their attempts and last errors."""
+        return [
+            {"name": name, "attempts": attempts, "last_error": last_error,
+             "latency_sec": latency_sec}
+            for name, attempts, last_error, latency_sec in self.conn.execute(
+                "SELECT name, attempts, last_error, latency_sec FROM items "
+                "WHERE state = ? ORDER BY name", (FAILED,)
+            )
+        ]
+
+
+def main(dirpath: str, retry: List[str] | None = None, retry_all: bool = False) -> None:
+    """Prints the states of a run, and marks failed items to be retried at the next run.
+
+    Args:
+        dirpath (str): The output directory of the run, e.g. `<src>/analyzed`.
+        retry (list of str, optional): The names of the failed items to retry.
+        retry_all (bool, optional): Retries every failed item if True.
+    """
+    if not os.path.exists(os.path.join(dirpath, MANIFEST_FILENAME)):
+        raise FileNotFoundError(f"no manifest in {dirpath}")
+    with Manifest(dirpath) as manifest:
+        if retry_all or retry:
+            print(f"{manifest.retry(None if retry_all else retry)} items to retry.")
+        print(", ".join(f"{state}: {count}" for state, count in manifest.summary().items()))
+        for item in manifest.failures():
+            print(f"failed: {item['name']} ({item['attempts']} attempts): {item['last_error']}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str, help="the output directory of a run")
+    parser.add_argument(
+        "--retry", dest="retry", type=str, nargs="+", default=None,
+        help="the names of the failed items to retry"
+    )
+    parser.add_argument(
+        "--retry_all", dest="retry_all", action="store_true"
+    )
+    args = parser.parse_args()
+    main(args.src, args.retry, args.retry_all)
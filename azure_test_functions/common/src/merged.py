@@ -0,0 +1,109 @@
+"""merged.py
+
+Incrementally updated merged outputs of directory runs.
+
+The merged output of a run, e.g. `translated_merged.txt`, joins the outputs
+of the done items in order of their names. An index saved next to it records
+the byte range, the modification time and the size of each output, so an
+update keeps the merged file up to the first output added, changed or
+removed, and only writes the rest, reusing the unchanged outputs from the
+old merged file instead of reading them again. Outputs added after the last
+one, e.g. of files named by timestamps, are just appended.
+"""
+
+import json
+import os
+from typing import Dict, List, Tuple
+
+INDEX_SUFFIX: str = ".index.json"
+SEPARATOR: str = "\n\n"
+
+# [output path, start, end, mtime_ns, size]
+_Entry = Tuple[str, int, int, int, int]
+
+
+def _encode(text: str) -> bytes:
+    """Encodes a text as a file opened in the text mode would write it."""
+    return text.replace("\n", os.linesep).encode("utf-8")
+
+
+class MergedText:
+    """A text file joining the outputs of a run.
+
+    Args:
+        fpath (str): The path of the merged file.
+        separator (str, optional): The string between outputs. Defaults to SEPARATOR.
+    """
+
+    def __init__(self, fpath: str, separator: str = SEPARATOR) -> None:
+        self.fpath: str = fpath
+        self.index_path: str = fpath + INDEX_SUFFIX
+        self.separator: bytes = _encode(separator)
+
+    def _load(self) -> List[_Entry]:
+        """Returns the index, or nothing if it does not match the merged file."""
+        if not os.path.exists(self.index_path) or not os.path.exists(self.fpath):
+            return []
+        with open(self.index_path, "r", encoding="utf-8") as ff:
+            entries: List[_Entry] = [
+                (str(entry[0]), int(entry[1]), int(entry[2]), int(entry[3]), int(entry[4]))
+                for entry in json.load(ff)
+            ]
+        if os.path.getsize(self.fpath) != (entries[-1][2] if entries else 0):
+            return []
+        return entries
+
+    def _save(self, entries: List[_Entry]) -> None:
+        tmppath: str = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmppath, "w", encoding="utf-8") as ff:
+            json.dump(entries, ff)
+        os.replace(tmppath, self.index_path)
+
+    def update(self, fpaths: List[str]) -> int:
+        """Updates the merged file to join the outputs.
+
+        Args:
+            fpaths (list of str): The paths of the outputs in order, e.g. `Manifest.outputs()`.
+
+        Returns:
+            int: The number of outputs read, i.e. added or changed.
+        """
+        stats: List[Tuple[int, int]] = []
+        for fpath in fpaths:
+            stat = os.stat(fpath)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        entries: List[_Entry] = self._load()
+        n_kept: int = 0
+        for fpath, stat_, entry in zip(fpaths, stats, entries):
+            if entry[0] != fpath or (entry[3], entry[4]) != stat_:
+                break
+            n_kept += 1
+        if n_kept == len(fpaths) == len(entries) and os.path.exists(self.fpath):
+            return 0
+        end: int = entries[n_kept - 1][2] if n_kept else 0
+        reusable: Dict[str, _Entry] = {entry[0]: entry for entry in entries[n_kept:]}
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)  # the merged file is rebuilt if interrupted
+        updated: List[_Entry] = entries[:n_kept]
+        n_read: int = 0
+        with open(self.fpath, "r+b" if entries else "wb") as ff:
+            ff.seek(end)
+            tail: bytes = ff.read() if reusable else b""
+            ff.seek(end)
+            ff.truncate()
+            for fpath, stat_ in zip(fpaths[n_kept:], stats[n_kept:]):
+                reused = reusable.get(fpath)
+                data: bytes
+                if reused is not None and (reused[3], reused[4]) == stat_:
+                    data = tail[reused[1] - end:reused[2] - end]
+                else:
+                    with open(fpath, "r", encoding="utf-8") as src:
+                        data = _encode(src.read())
+                    n_read += 1
+                if updated:
+                    ff.write(self.separator)
+                position: int = ff.tell()
+                ff.write(data)
+                updated.append((fpath, position, position + len(data), *stat_))
+        self._save(updated)
+        return n_read
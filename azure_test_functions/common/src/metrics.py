@@ -0,0 +1,280 @@
+"""metrics.py
+
+Counters, gauges and timers of the calls to the Azure services.
+
+Every service module records into `METRICS`:
+    * `function_seconds{function}`: the time of `analyze`, `analyze_with_fast`,
+      `translate`, `chat`, `search` and `save`, including the retries,
+    * `upload_bytes_total{function}`: the bytes sent,
+and `EXECUTOR` records per endpoint:
+    * `calls_total{endpoint,outcome}` and `call_seconds{endpoint}` of each attempt,
+    * `retries_total{endpoint}` and `throttled_total{endpoint}`,
+    * `wait_seconds_total{endpoint,reason}`: the time slept before retries.
+The metrics are written at exit to the file given by `AZURE_TEST_METRICS_FILE`,
+as Prometheus text or, if the file name ends with `.json`, as a JSON snapshot.
+Setting `AZURE_TEST_PROFILE_DIR` profiles the stages decorated by `profiled`
+with cProfile and tracemalloc for that run.
+"""
+
+import atexit
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+PREFIX: str = "azure_test_"
+BUCKETS_SEC: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+METRICS_FILE: str | None = os.environ.get("AZURE_TEST_METRICS_FILE", None)
+PROFILE_DIR: str | None = os.environ.get("AZURE_TEST_PROFILE_DIR", None)
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: _LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Histogram:
+    """Observations of a timer bucketed by BUCKETS_SEC."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKETS_SEC) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_SEC, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the quantile `q` (0-1)."""
+        rank: float = q * self.count
+        cumulative: int = 0
+        for bound, count in zip(BUCKETS_SEC, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and timers.
+
+    Names are given without PREFIX, and labels as keyword arguments, e.g.
+    `METRICS.inc("retries_total", endpoint=url)`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[_LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[_LabelKey, float]] = {}
+        self._timers: Dict[str, Dict[_LabelKey, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        """Adds a value to a counter."""
+        key: _LabelKey = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """Sets a gauge."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        """Records a duration in a timer."""
+        key: _LabelKey = _label_key(labels)
+        with self._lock:
+            series = self._timers.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram()
+            series[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Records the duration of a block in a timer, also if it raises."""
+        st: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - st, **labels)
+
+    def timed(self, function: str) -> Callable[[F], F]:
+        """Returns a decorator recording the duration of each call in
+        `function_seconds{function}`."""
+        def decorator(func: F) -> F:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.timer("function_seconds", function=function):
+                    return func(*args, **kwargs)
+            return wrapper  # type: ignore[return-value]
+        return decorator
+
+    def reset(self) -> None:
+        """Forgets every value."""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timers.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current values as a JSON serializable dictionary.
+
+        Returns:
+            dict: `counters`, `gauges` and `timers`, each mapping a name to a list of
+            series with their labels. A timer series has the count, the sum,
+            the maximum and the p50/p99 estimated from the buckets, in seconds.
+        """
+        with self._lock:
+            return {
+                "time": time.time(),
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in sorted(self._counters.items())
+                },
+                "gauges": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in sorted(self._gauges.items())
+                },
+                "timers": {
+                    name: [
+                        {
+                            "labels": dict(key), "count": hist.count, "sum": hist.total,
+                            "max": hist.max, "p50": hist.quantile(0.5), "p99": hist.quantile(0.99)
+                        }
+                        for key, hist in series.items()
+                    ]
+                    for name, series in sorted(self._timers.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """Returns the current values in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for kind, values in [("counter", self._counters), ("gauge", self._gauges)]:
+                for name, series in sorted(values.items()):
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    lines.extend(
+                        f"{PREFIX}{name}{_format_labels(key)} {value:.10g}"
+                        for key, value in sorted(series.items())
+                    )
+            for name, timers in sorted(self._timers.items()):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, hist in sorted(timers.items()):
+                    cumulative: int = 0
+                    for bound, count in zip(BUCKETS_SEC, hist.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{PREFIX}{name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} "
+                            f"{cumulative}"
+                        )
+                    lines.append(
+                        f"{PREFIX}{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {hist.count}"
+                    )
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {hist.total:.10g}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, fpath: str) -> None:
+        """Writes the values to a file, as JSON if its name ends with `.json`,
+        or else as Prometheus text."""
+        dirpath: str = os.path.dirname(fpath)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        with open(fpath, "w", encoding="utf-8") as ff:
+            if fpath.endswith(".json"):
+                json.dump(self.snapshot(), ff, indent=4)
+            else:
+                ff.write(self.to_prometheus())
+
+
+METRICS: Metrics = Metrics()
+
+_PROFILING = threading.local()
+
+
+@contextlib.contextmanager
+def profile(stage: str, dirpath: str | None = None) -> Iterator[None]:
+    """Profiles a block with cProfile and tracemalloc if profiling is enabled.
+
+    The statistics of the calling thread are dumped to `<dirpath>/<stage>.prof`
+    (readable by `pstats` or `snakeviz`), and the peak memory allocated in the
+    block is recorded in the gauge `profile_peak_bytes{stage}`. A block nested in
+    another profiled block is not profiled on its own.
+
+    Args:
+        stage (str): The name of the stage.
+        dirpath (str, optional): The directory of the profiles.
+            Defaults to PROFILE_DIR, and nothing is profiled if both are None.
+    """
+    dirpath = dirpath or PROFILE_DIR
+    if dirpath is None or getattr(_PROFILING, "active", False):
+        yield
+        return
+    # pylint: disable=import-outside-toplevel
+    import cProfile
+    import tracemalloc
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    _PROFILING.active = True
+    started_tracing: bool = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        _PROFILING.active = False
+        profiler.dump_stats(os.path.join(dirpath, f"{stage}.prof"))
+        METRICS.set("profile_peak_bytes", peak, stage=stage)
+        print(f"profile of {stage}: {os.path.join(dirpath, f'{stage}.prof')}, "
+              f"peak {peak / 1024 / 1024:.1f} MiB allocated.")
+
+
+def profiled(stage: str) -> Callable[[F], F]:
+    """Returns a decorator profiling each call by `profile` if profiling is enabled."""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with profile(stage):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def _write_at_exit() -> None:
+    if METRICS_FILE:
+        METRICS.write(METRICS_FILE)
+
+
+atexit.register(_write_at_exit)
@@ -0,0 +1,188 @@
+"""planner.py
+
+Workload planner and scheduler of directory runs.
+
+Before a run, the pending items are measured without sending them: the
+number of images or pages (`ocr`), the characters (`translation`) or the
+seconds of audio (`speech_to_text`). The time of the run is estimated from
+the latencies of the items done in the previous runs, recorded in the
+manifest, or else from a default latency, and bounded below by the quota of
+the service. The cost is estimated from the price per unit.
+
+The items are then processed in the order given by `schedule`:
+    * `name`: in order of their names,
+    * `small`: the smallest first, which brings most results earliest,
+    * `large`: the largest first, which shortens the run of several workers
+      sharing a directory (`--lease_sec`), since no worker is left alone
+      with a large item at the end,
+and the items matching `priority` patterns before the others.
+"""
+
+from dataclasses import dataclass
+import fnmatch
+from typing import Callable, Dict, Iterable, List, Tuple
+
+ORDER_NAME: str = "name"
+ORDER_SMALL: str = "small"
+ORDER_LARGE: str = "large"
+ORDERS: List[str] = [ORDER_NAME, ORDER_SMALL, ORDER_LARGE]
+
+
+@dataclass
+class Quota:
+    """Rates and prices of a service.
+
+    Args:
+        unit (str): The unit of the workload, e.g. `characters`.
+        units_per_sec (float): The quota of the subscription in units per second.
+        price_per_unit (float): The price of a unit.
+        sec_per_unit (float): The latency per unit when nothing has been measured yet.
+        sec_per_item (float): The fixed time per item, e.g. the wait between items.
+    """
+    unit: str
+    units_per_sec: float
+    price_per_unit: float
+    sec_per_unit: float
+    sec_per_item: float = 0.0
+
+
+@dataclass
+class Plan:
+    """Estimate of a run."""
+    n_items: int
+    units: float
+    largest: Tuple[str, float] | None
+    sec_per_unit: float
+    measured: bool
+    duration_sec: float
+    quota_sec: float
+    cost: float
+    unit: str
+
+    def format(self) -> str:
+        """Returns the plan as lines to print."""
+        lines: List[str] = [
+            f"items: {self.n_items}",
+            f"{self.unit}: {self.units:,.0f}",
+        ]
+        if self.largest is not None:
+            lines.append(f"largest: {self.largest[0]} ({self.largest[1]:,.0f} {self.unit})")
+        lines += [
+            f"latency: {self.sec_per_unit:.3g} sec per unit "
+            f"({'measured in the previous runs' if self.measured else 'default'})",
+            f"estimated time: {_format_sec(max(self.duration_sec, self.quota_sec))} "
+            f"(at least {_format_sec(self.quota_sec)} under the quota)",
+            f"estimated cost: {self.cost:,.2f}",
+        ]
+        return "\n".join(lines)
+
+
+def _format_sec(sec: float) -> str:
+    hours, rest = divmod(int(sec), 3600)
+    return f"{hours}h{rest // 60:02d}m{rest % 60:02d}s"
+
+
+def measure_all(names: Iterable[str], measure: Callable[[str], float]) -> Dict[str, float]:
+    """Measures items, counting an item which cannot be read as 0 units."""
+    sizes: Dict[str, float] = {}
+    for name in names:
+        try:
+            sizes[name] = measure(name)
+        except (OSError, ValueError):
+            sizes[name] = 0.0
+    return sizes
+
+
+def plan(
+    sizes: Dict[str, float], quota: Quota,
+    history: List[Tuple[float, float]] | None = None
+) -> Plan:
+    """Estimates the time and the cost of processing items.
+
+    Args:
+        sizes (dict): The items to process mapped to their numbers of units.
+        quota (Quota): The rates and prices of the service.
+        history (list of tuple, optional): The numbers of units and the latencies
+            in seconds of the items done before.
+
+    Returns:
+        Plan: The estimate.
+    """
+    history = [(units, sec) for units, sec in history or [] if units > 0]
+    measured: bool = bool(history)
+    sec_per_unit: float = (
+        sum(sec for _, sec in history) / sum(units for units, _ in history)
+        if measured else quota.sec_per_unit
+    )
+    units: float = sum(sizes.values())
+    return Plan(
+        n_items=len(sizes),
+        units=units,
+        largest=max(sizes.items(), key=lambda item: item[1]) if sizes else None,
+        sec_per_unit=sec_per_unit,
+        measured=measured,
+        duration_sec=units * sec_per_unit + len(sizes) * quota.sec_per_item,
+        quota_sec=units / quota.units_per_sec if quota.units_per_sec > 0 else 0.0,
+        cost=units * quota.price_per_unit,
+        unit=quota.unit,
+    )
+
+
+def estimate(
+    names: List[str], measure: Callable[[str], float], quota: Quota,
+    done: List[Tuple[str, float]] | None = None
+) -> Plan:
+    """Measures the items to process and estimates the time and the cost.
+
+    Args:
+        names (list of str): The items to process.
+        measure (callable): Returns the number of units of an item.
+        quota (Quota): The rates and prices of the service.
+        done (list of tuple, optional): The items done before with their
+            latencies in seconds, e.g. from `Manifest.latencies`.
+
+    Returns:
+        Plan: The estimate.
+    """
+    done_sizes: Dict[str, float] = measure_all((name for name, _ in done or []), measure)
+    return plan(
+        measure_all(names, measure), quota,
+        [(done_sizes[name], sec) for name, sec in done or []]
+    )
+
+
+def schedule(
+    names: List[str], measure: Callable[[str], float],
+    order: str = ORDER_NAME, priority: List[str] | None = None
+) -> List[str]:
+    """Returns the items in the order to process them.
+
+    Args:
+        names (list of str): The items.
+        measure (callable): Returns the number of units of an item.
+            Only called if `order` is not ORDER_NAME.
+        order (str, optional): One of ORDERS. Defaults to ORDER_NAME.
+        priority (list of str, optional): Glob patterns of the items to process
+            first, in order of the patterns.
+
+    Returns:
+        list of str: The items.
+
+    Raises:
+        ValueError: If `order` is not one of ORDERS.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"'order' must be one of {ORDERS}.")
+    patterns: List[str] = priority or []
+
+    def rank(name: str) -> int:
+        for ii, pattern in enumerate(patterns):
+            if fnmatch.fnmatch(name.replace("\\", "/"), pattern):
+                return ii
+        return len(patterns)
+
+    if order == ORDER_NAME:
+        return sorted(names, key=lambda name: (rank(name), name))
+    sign: int = 1 if order == ORDER_SMALL else -1
+    sizes: Dict[str, float] = measure_all(names, measure)
+    return sorted(names, key=lambda name: (rank(name), sign * sizes[name], name))
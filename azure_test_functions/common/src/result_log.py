@@ -0,0 +1,318 @@
+"""result_log.py
+
+Append-only, gzip-compressed JSON Lines log of results.
+
+A log is a directory holding segments named by the sequence number of their
+first record, e.g.
+    * `results-000000000000.jsonl.gz`: concatenated gzip members, each of
+      which holds the JSON lines of one flush, and
+    * `results-000000000000.idx`: one fixed-size entry per member with the
+      first sequence number, the number of records, the offset and the size.
+A segment is a valid gzip file, so it can also be read by `zcat` or `gzip.open`.
+A writer holds an exclusive lock on `.lock` in the directory while it is
+open, so writers of other processes, e.g. concurrent CLI calls appending to
+the default log, wait for it to be closed instead of interleaving members.
+"""
+
+import gzip
+import importlib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Dict, Iterator, List, Tuple
+
+SEGMENT_PREFIX: str = "results-"
+SEGMENT_SUFFIX: str = ".jsonl.gz"
+INDEX_SUFFIX: str = ".idx"
+LOCK_FILENAME: str = ".lock"
+INDEX_ENTRY = struct.Struct("<QIQI")
+MAX_SEGMENT_BYTES: int = 64 * 1024 * 1024
+FLUSH_RECORDS: int = 1000
+FLUSH_INTERVAL_SEC: float = 1.0
+QUEUE_SIZE: int = 10000
+COMPRESS_LEVEL: int = 6
+
+
+def _segment_path(dirpath: str, first_seq: int) -> str:
+    return os.path.join(dirpath, f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}")
+
+
+def _index_path(segment_path: str) -> str:
+    return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def _lock(fd: int) -> None:
+    """Blocks until the exclusive lock of an open file is acquired."""
+    if os.name == "nt":
+        msvcrt: Any = importlib.import_module("msvcrt")
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:  # LK_LOCK gives up after 10 seconds
+                continue
+    fcntl: Any = importlib.import_module("fcntl")
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def list_segments(dirpath: str) -> List[Tuple[int, str]]:
+    """Returns the first sequence numbers and the paths of the segments in order."""
+    if not os.path.isdir(dirpath):
+        return []
+    segments: List[Tuple[int, str]] = []
+    for fname in os.listdir(dirpath):
+        if fname.startswith(SEGMENT_PREFIX) and fname.endswith(SEGMENT_SUFFIX):
+            first_seq: str = fname[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            if first_seq.isdigit():
+                segments.append((int(first_seq), os.path.join(dirpath, fname)))
+    return sorted(segments)
+
+
+def read_index(segment_path: str) -> List[Tuple[int, int, int, int]]:
+    """Returns the (first sequence number, count, offset, size) of the members of a segment."""
+    if not os.path.exists(_index_path(segment_path)):
+        return []
+    with open(_index_path(segment_path), "rb") as ff:
+        data: bytes = ff.read()
+    n_bytes: int = len(data) - len(data) % INDEX_ENTRY.size
+    return [
+        (int(first), int(count), int(offset), int(size))
+        for first, count, offset, size in INDEX_ENTRY.iter_unpack(data[:n_bytes])
+    ]
+
+
+def _read_member(segment_path: str, offset: int, size: int) -> List[str]:
+    with open(segment_path, "rb") as ff:
+        ff.seek(offset)
+        data: bytes = ff.read(size)
+    return gzip.decompress(data).decode("utf-8").splitlines()
+
+
+def read_record(dirpath: str, seq: int) -> Dict[str, Any]:
+    """Reads one record by decompressing only the member holding it.
+
+    Args:
+        dirpath (str): The directory of the log.
+        seq (int): The sequence number returned by `ResultLog.write`.
+
+    Returns:
+        dict: The record.
+
+    Raises:
+        KeyError: If the record is not in the log.
+    """
+    segments = list_segments(dirpath)
+    ii: int = bisect_right([first for first, _ in segments], seq) - 1
+    if ii < 0:
+        raise KeyError(seq)
+    segment_path: str = segments[ii][1]
+    entries = read_index(segment_path)
+    jj: int = bisect_right([entry[0] for entry in entries], seq) - 1
+    if jj < 0:
+        raise KeyError(seq)
+    first, count, offset, size = entries[jj]
+    if seq >= first + count:
+        raise KeyError(seq)
+    return dict(json.loads(_read_member(segment_path, offset, size)[seq - first]))
+
+
+def iter_records(dirpath: str, start: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yields the records from the sequence number `start` in order.
+
+    Args:
+        dirpath (str): The directory of the log.
+        start (int, optional): The first sequence number to yield. Defaults to 0.
+
+    Yields:
+        tuple: The sequence number and the record.
+    """
+    for segment_path in [path for _, path in list_segments(dirpath)]:
+        for first, count, offset, size in read_index(segment_path):
+            if first + count <= start:
+                continue
+            for ii, line in enumerate(_read_member(segment_path, offset, size)):
+                if first + ii >= start:
+                    yield first + ii, json.loads(line)
+
+
+class ResultLog:
+    """Writer of a log with a buffered background thread.
+
+    `write` only assigns a sequence number and puts the record into a queue.
+    The background thread compresses the queued records into one gzip member
+    every `flush_records` records or `flush_interval_sec` seconds, appends it
+    to the current segment and then its entry to the index, so a member
+    interrupted in the middle of a write is dropped when the log is opened again.
+    A new segment is started when the current one exceeds `max_segment_bytes`.
+    Only one writer may open a directory at once: the constructor blocks
+    until the writer of another process closes it.
+
+    Args:
+        dirpath (str): The directory of the log. It is created if it does not exist.
+        max_segment_bytes (int, optional): The size to rotate segments at.
+            Defaults to MAX_SEGMENT_BYTES.
+        flush_records (int, optional): The maximum records per member.
+            Defaults to FLUSH_RECORDS.
+        flush_interval_sec (float, optional): The maximum seconds a record waits
+            in the queue. Defaults to FLUSH_INTERVAL_SEC.
+    """
+
+    def __init__(
+        self, dirpath: str, max_segment_bytes: int = MAX_SEGMENT_BYTES,
+        flush_records: int = FLUSH_RECORDS,
+        flush_interval_sec: float = FLUSH_INTERVAL_SEC
+    ) -> None:
+        self.dirpath: str = dirpath
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self.max_segment_bytes: int = max_segment_bytes
+        self.flush_records: int = flush_records
+        self.flush_interval_sec: float = flush_interval_sec
+        self._next_seq: int = 0
+        self._segment_path: str | None = None
+        self._segment_size: int = 0
+        self._lock_fd: int = os.open(os.path.join(dirpath, LOCK_FILENAME), os.O_RDWR | os.O_CREAT)
+        try:
+            _lock(self._lock_fd)
+            self._recover()
+        except BaseException:
+            os.close(self._lock_fd)
+            raise
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[Tuple[int, str] | None] = queue.Queue(QUEUE_SIZE)
+        self._error: BaseException | None = None
+        self._closed: bool = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "ResultLog":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _recover(self) -> None:
+        """Drops the bytes of the last segment written after its last index entry."""
+        segments = list_segments(self.dirpath)
+        if not segments:
+            return
+        first_seq, segment_path = segments[-1]
+        entries = read_index(segment_path)
+        size: int = 0
+        self._next_seq = first_seq
+        if entries:
+            _, count, offset, member_size = entries[-1]
+            size = offset + member_size
+            self._next_seq = entries[-1][0] + count
+        if os.path.getsize(segment_path) > size:
+            os.truncate(segment_path, size)
+        index_path: str = _index_path(segment_path)
+        if os.path.exists(index_path):
+            os.truncate(index_path, len(entries) * INDEX_ENTRY.size)
+        self._segment_path = segment_path
+        self._segment_size = size
+
+    def write(self, record: Dict[str, Any]) -> int:
+        """Queues a record to be appended.
+
+        Blocks while the queue is full.
+
+        Args:
+            record (dict): A JSON serializable dictionary.
+
+        Returns:
+            int: The sequence number of the record.
+
+        Raises:
+            RuntimeError: If the log is closed or the background thread has failed.
+        """
+        line: str = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("the log is closed.")
+            if self._error is not None:
+                raise RuntimeError("failure in writing the log.") from self._error
+            seq: int = self._next_seq
+            self._next_seq += 1
+            self._queue.put((seq, line))
+        return seq
+
+    def close(self) -> None:
+        """Writes the queued records and stops the background thread.
+
+        Raises:
+            RuntimeError: If the background thread has failed.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        os.close(self._lock_fd)  # releases the lock
+        if self._error is not None:
+            raise RuntimeError("failure in writing the log.") from self._error
+
+    def _run(self) -> None:
+        batch: List[Tuple[int, str]] = []
+        stop: bool = False
+        while not stop:
+            deadline: float = time.monotonic() + self.flush_interval_sec
+            while len(batch) < self.flush_records:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if not batch or self._error is not None:
+                batch.clear()
+                continue
+            try:
+                self._flush(batch)
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                self._error = ex
+            batch.clear()
+
+    def _flush(self, batch: List[Tuple[int, str]]) -> None:
+        if self._segment_path is None or self._segment_size >= self.max_segment_bytes:
+            self._segment_path = _segment_path(self.dirpath, batch[0][0])
+            self._segment_size = 0
+        data: bytes = gzip.compress(
+            "".join(f"{line}\n" for _, line in batch).encode("utf-8"),
+            compresslevel=COMPRESS_LEVEL
+        )
+        with open(self._segment_path, "ab") as ff:
+            ff.write(data)
+        with open(_index_path(self._segment_path), "ab") as ff:
+            ff.write(INDEX_ENTRY.pack(batch[0][0], len(batch), self._segment_size, len(data)))
+        self._segment_size += len(data)
+
+
+def main(dirpath: str, seq: int | None = None, start: int = 0) -> None:
+    """Prints one record, or the records from `start`, as JSON lines."""
+    if seq is not None:
+        print(json.dumps(read_record(dirpath, seq), ensure_ascii=False))
+        return
+    for _, record in iter_records(dirpath, start):
+        print(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str)
+    parser.add_argument(
+        "--seq", dest="seq", type=int, default=None
+    )
+    parser.add_argument(
+        "--start", dest="start", type=int, default=0
+    )
+    args = parser.parse_args()
+    main(args.src, args.seq, args.start)
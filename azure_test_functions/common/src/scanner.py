@@ -0,0 +1,116 @@
+"""scanner.py
+
+Streaming directory scanner of the inputs of directory runs.
+
+Entries are yielded as `os.scandir` reads them, so the work on the first
+files starts before a large directory has been listed, and the file type
+and stat data cached by `os.DirEntry` save the `os.path.isfile` and
+`os.stat` calls per file.
+"""
+
+import fnmatch
+import os
+from typing import Iterable, Iterator, List, Set, Tuple
+
+IMAGE_EXTENSIONS: Set[str] = {
+    ".bmp", ".gif", ".ico", ".jpeg", ".jpg", ".mpo", ".png", ".tif", ".tiff", ".webp"
+}
+AUDIO_EXTENSIONS: Set[str] = {
+    ".aac", ".amr", ".flac", ".mp3", ".ogg", ".opus", ".spx", ".wav", ".webm", ".wma"
+}
+TEXT_EXTENSIONS: Set[str] = {".txt"}
+JSON_EXTENSIONS: Set[str] = {".json"}
+
+
+class ScanEntry:
+    """A file found by `scan`.
+
+    Args:
+        name (str): The path relative to the scanned directory.
+        entry (os.DirEntry): The entry, which caches its stat data.
+    """
+
+    __slots__ = ("name", "entry")
+
+    def __init__(self, name: str, entry: "os.DirEntry[str]") -> None:
+        self.name: str = name
+        self.entry: "os.DirEntry[str]" = entry
+
+    @property
+    def path(self) -> str:
+        """The path of the file."""
+        return self.entry.path
+
+    def stat(self) -> os.stat_result:
+        """Returns the stat data, read at most once (and free on Windows)."""
+        return self.entry.stat()
+
+    @property
+    def size(self) -> int:
+        """The size of the file in bytes."""
+        return self.stat().st_size
+
+    def __repr__(self) -> str:
+        return f"ScanEntry({self.name!r})"
+
+
+def _matches(rel: str, name: str, patterns: List[str]) -> bool:
+    return any(
+        fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(name, pattern)
+        for pattern in patterns
+    )
+
+
+def scan(
+    root: str, extensions: Iterable[str] | None = None,
+    include: List[str] | None = None, exclude: List[str] | None = None,
+    recursive: bool = False
+) -> Iterator[ScanEntry]:
+    """Yields the files in a directory lazily.
+
+    Patterns are globs matched against both the relative path, with `/` as
+    the separator, and the file name, e.g. `*.png`, `scans/2024*` or `*merged*`.
+    A directory matching `exclude` is not entered.
+
+    Args:
+        root (str): The directory to scan.
+        extensions (iterable of str, optional): The extensions to yield, e.g.
+            IMAGE_EXTENSIONS, compared in lower case. Every file if None.
+        include (list of str, optional): Yields only the files matching one of the patterns.
+        exclude (list of str, optional): Skips the files and directories
+            matching one of the patterns.
+        recursive (bool, optional): Enters the subdirectories if True.
+
+    Yields:
+        ScanEntry: A file, in the order of the directory, and the files of
+        a directory before those of its subdirectories.
+
+    Raises:
+        NotADirectoryError: If `root` is not a directory.
+    """
+    if not os.path.isdir(root):
+        raise NotADirectoryError(f"not a directory: {root}")
+    suffixes: Set[str] | None = (
+        None if extensions is None else {ext.lower() for ext in extensions}
+    )
+    stack: List[Tuple[str, str]] = [(root, "")]
+    while stack:
+        dirpath, prefix = stack.pop()
+        subdirs: List[Tuple[str, str]] = []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                rel: str = prefix + entry.name
+                if exclude and _matches(rel, entry.name, exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirs.append((entry.path, rel + "/"))
+                    continue
+                if not entry.is_file():
+                    continue
+                if suffixes is not None and os.path.splitext(entry.name)[1].lower() not in suffixes:
+                    continue
+                if include and not _matches(rel, entry.name, include):
+                    continue
+                yield ScanEntry(rel.replace("/", os.sep), entry)
+        stack.extend(reversed(subdirs))
@@ -0,0 +1,192 @@
+"""watcher.py
+
+Watch mode of directory runs.
+
+A `Watcher` polls a directory with `scan` and compares the modification
+times and the sizes of the files with a snapshot saved in the output
+directory, so a restarted watch only reports the files added, changed or
+removed while it was stopped. A file is reported once its modification time
+and size have not changed for `debounce` seconds, so a file still being
+copied is not processed half-written.
+
+Where `inotify_simple` is installed (Linux), the watcher sleeps until a file
+is written, moved or removed in a watched directory instead of waking up
+every `interval` seconds; the polling still decides what has changed.
+"""
+
+from dataclasses import dataclass, field
+import importlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+from .scanner import scan
+
+SNAPSHOT_FILENAME: str = "snapshot.json"
+INTERVAL_SEC: float = 10.0
+DEBOUNCE_SEC: float = 2.0
+
+Stat = Tuple[int, int]
+
+
+@dataclass
+class Changes:
+    """Files added, changed or removed since the last snapshot, in order of their names."""
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    @property
+    def changed(self) -> List[str]:
+        """The files added or modified."""
+        return sorted(self.added + self.modified)
+
+
+class Watcher:
+    """Poller of the files of a directory.
+
+    Args:
+        root (str): The directory to watch.
+        snapshot_path (str): The path of the snapshot, e.g. `<output_dir>/snapshot.json`.
+        extensions (iterable of str, optional): The extensions of the files to watch.
+        include (list of str, optional): Glob patterns of the files to watch (see `scan`).
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        recursive (bool, optional): Watches the subdirectories as well if True.
+        interval (float, optional): The seconds between polls. Defaults to INTERVAL_SEC.
+        debounce (float, optional): The seconds a file must stay unchanged
+            before it is reported. Defaults to DEBOUNCE_SEC.
+    """
+
+    def __init__(
+        self, root: str, snapshot_path: str, extensions: Iterable[str] | None = None,
+        include: List[str] | None = None, exclude: List[str] | None = None,
+        recursive: bool = False, interval: float = INTERVAL_SEC,
+        debounce: float = DEBOUNCE_SEC
+    ) -> None:
+        self.root: str = root
+        self.snapshot_path: str = snapshot_path
+        self.extensions: Set[str] | None = None if extensions is None else set(extensions)
+        self.include: List[str] | None = include
+        self.exclude: List[str] | None = exclude
+        self.recursive: bool = recursive
+        self.interval: float = interval
+        self.debounce: float = debounce
+        self.snapshot: Dict[str, Stat] = self._load()
+        self._candidates: Dict[str, Tuple[Stat, float]] = {}
+        self._inotify: Any = None
+        self._mask: int = 0
+        self._watched: Set[str] = set()
+        try:
+            module = importlib.import_module("inotify_simple")
+            self._inotify = module.INotify()
+            self._mask = (
+                module.flags.CLOSE_WRITE | module.flags.MOVED_TO | module.flags.MOVED_FROM
+                | module.flags.CREATE | module.flags.DELETE
+            )
+        except (ImportError, OSError):
+            self._inotify = None
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops watching with inotify."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _load(self) -> Dict[str, Stat]:
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path, "r", encoding="utf-8") as ff:
+            return {name: (int(stat[0]), int(stat[1])) for name, stat in json.load(ff).items()}
+
+    def save(self) -> None:
+        """Saves the snapshot atomically."""
+        dirpath: str = os.path.dirname(self.snapshot_path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        tmppath: str = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmppath, "w", encoding="utf-8") as ff:
+            json.dump(self.snapshot, ff)
+        os.replace(tmppath, self.snapshot_path)
+
+    def _watch_dir(self, dirpath: str) -> None:
+        if self._inotify is None or dirpath in self._watched:
+            return
+        try:
+            self._inotify.add_watch(dirpath, self._mask)
+        except OSError:  # e.g. the limit of watches is reached
+            return
+        self._watched.add(dirpath)
+
+    def poll(self) -> Changes:
+        """Lists the directory once and returns the changes settled for `debounce` seconds.
+
+        The snapshot is not updated until `commit` is called.
+        """
+        now: float = time.monotonic()
+        current: Dict[str, Stat] = {}
+        self._watch_dir(self.root)
+        for entry in scan(self.root, self.extensions, self.include, self.exclude, self.recursive):
+            stat = entry.stat()
+            current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            if self.recursive:
+                self._watch_dir(os.path.dirname(entry.path))
+        changes = Changes()
+        for name, stat_ in current.items():
+            if self.snapshot.get(name) == stat_:
+                self._candidates.pop(name, None)
+                continue
+            candidate = self._candidates.get(name)
+            if candidate is None or candidate[0] != stat_:
+                candidate = (stat_, now)
+                self._candidates[name] = candidate
+            if now - candidate[1] < self.debounce:
+                continue
+            (changes.modified if name in self.snapshot else changes.added).append(name)
+        for name in list(self._candidates):
+            if name not in current:
+                del self._candidates[name]
+        changes.added.sort()
+        changes.modified.sort()
+        changes.removed = sorted(name for name in self.snapshot if name not in current)
+        return changes
+
+    def commit(self, changes: Changes) -> None:
+        """Records the changes in the snapshot once they have been processed."""
+        for name in changes.changed:
+            candidate = self._candidates.pop(name, None)
+            if candidate is not None:
+                self.snapshot[name] = candidate[0]
+        for name in changes.removed:
+            self.snapshot.pop(name, None)
+        self.save()
+
+    def wait(self) -> None:
+        """Sleeps until the next poll, or until a file is written with inotify."""
+        timeout: float = self.debounce if self._candidates else self.interval
+        if self._inotify is None:
+            time.sleep(timeout)
+            return
+        self._inotify.read(timeout=int(timeout * 1000))
+
+    def watch(self) -> Iterator[Changes]:
+        """Yields the changes of the directory until interrupted.
+
+        The changes are recorded in the snapshot after the consumer has
+        processed them, so the changes of an interrupted batch are reported
+        again by the next watch.
+        """
+        while True:
+            changes = self.poll()
+            if changes:
+                yield changes
+                self.commit(changes)
+            self.wait()
@@ -0,0 +1,12 @@
+"""embedding"""
+
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as embedding
+
+__all__ = ["embedding"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "embedding": ".src.main"
+}, fallback=".src.main")
@@ -1,3 +1,22 @@
 """embedding"""
 
-print("hello world")
+from .src.main import main, DSTDIR_DEFAULT, MAX_WORKERS, CHUNK_CHARS
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str, nargs="+")
+    parser.add_argument(
+        "--dst", dest="dst", type=str, default=DSTDIR_DEFAULT
+    )
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=MAX_WORKERS
+    )
+    parser.add_argument(
+        "--chunk_chars", dest="chunk_chars", type=int, default=CHUNK_CHARS
+    )
+    parser.add_argument(
+        "--compact", dest="compact", action="store_true"
+    )
+    args = parser.parse_args()
+    main(args.src, args.dst, args.workers, args.chunk_chars, args.compact)
@@ -0,0 +1 @@
+"""embedding"""
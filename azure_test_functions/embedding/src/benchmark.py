@@ -0,0 +1,209 @@
+"""benchmark.py
+
+Latency, memory footprint and recall benchmark of the vector index
+with synthetic vectors.
+"""
+
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+import numpy as np
+import numpy.typing as npt
+from .index import (
+    VectorIndex, normalize,
+    BLOCK_SIZE, LAYOUT_FILENAMES, RERANK_FACTOR, TOP_K
+)
+from .store import VectorStore
+
+N_VECTORS: int = 1_000_000
+DIM: int = 1536
+N_QUERIES: int = 256
+QUERY_BATCH_SIZE: int = 32
+N_GROUND_TRUTH: int = 16
+WRITE_BATCH_SIZE: int = 65536
+NOISE_SCALE: float = 0.5
+SEED: int = 0
+
+
+def generate_store(
+    dirpath: str, n_vectors: int = N_VECTORS, dim: int = DIM, seed: int = SEED
+) -> VectorStore:
+    """Fills a store with random vectors, unless it already has `n_vectors` rows.
+
+    Args:
+        dirpath (str): The directory of the store.
+        n_vectors (int, optional): The number of vectors. Defaults to N_VECTORS.
+        dim (int, optional): The dimension of the vectors. Defaults to DIM.
+        seed (int, optional): The random seed. Defaults to SEED.
+
+    Returns:
+        VectorStore: The store.
+    """
+    store = VectorStore(dirpath, "synthetic")
+    rng = np.random.default_rng(seed)
+    while store.count < n_vectors:
+        n_rows: int = min(WRITE_BATCH_SIZE, n_vectors - store.count)
+        vectors = rng.standard_normal((n_rows, dim), dtype=np.float32)
+        store.append(
+            vectors, [{"row": store.count + ii} for ii in range(n_rows)]
+        )
+    return store
+
+
+def make_queries(
+    store: VectorStore, n_queries: int = N_QUERIES, seed: int = SEED
+) -> npt.NDArray[np.float32]:
+    """Makes queries close to randomly chosen rows of the store."""
+    rng = np.random.default_rng(seed + 1)
+    rows = np.sort(rng.choice(store.count, size=n_queries, replace=False))
+    vectors = np.asarray(store.vectors()[rows], dtype=np.float32)
+    noise = rng.standard_normal(vectors.shape, dtype=np.float32)
+    return np.asarray(vectors + NOISE_SCALE * noise, dtype=np.float32)
+
+
+def exact_top_k(
+    store: VectorStore, queries: npt.NDArray[np.float32], k: int = TOP_K,
+    block_size: int = BLOCK_SIZE
+) -> npt.NDArray[np.int64]:
+    """Computes the true top-k rows by fully sorting every similarity
+    of the full precision vectors."""
+    queries_2d = normalize(np.atleast_2d(queries))
+    matrix = store.vectors()
+    scores = np.concatenate([
+        queries_2d @ normalize(matrix[ii:ii + block_size]).T
+        for ii in range(0, store.count, block_size)
+    ], axis=1)
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+
+def recall_at_k(
+    found: npt.NDArray[np.int64], truth: npt.NDArray[np.int64]
+) -> float:
+    """Returns the fraction of the true top-k rows that are found."""
+    hits: int = sum(
+        len(set(ff.tolist()) & set(tt.tolist())) for ff, tt in zip(found, truth)
+    )
+    return hits / truth.size if truth.size else 1.0
+
+
+def benchmark_index(
+    index: VectorIndex, queries: npt.NDArray[np.float32],
+    truth: npt.NDArray[np.int64], k: int = TOP_K,
+    query_batch_size: int = QUERY_BATCH_SIZE
+) -> Dict[str, Any]:
+    """Measures the memory footprint, latency, throughput and recall of `VectorIndex.search`.
+
+    Args:
+        index (VectorIndex): The index.
+        queries (numpy.ndarray): The queries of shape (n_queries, dim).
+        truth (numpy.ndarray): The exact top-k rows of the first queries.
+        k (int, optional): The number of results per query. Defaults to TOP_K.
+        query_batch_size (int, optional): The queries per search call.
+            Defaults to QUERY_BATCH_SIZE.
+
+    Returns:
+        dict: The results.
+    """
+    latencies: List[float] = []
+    found: List[npt.NDArray[np.int64]] = []
+    st_all = time.perf_counter()
+    for ii in range(0, len(queries), query_batch_size):
+        st = time.perf_counter()
+        _, indices = index.search(queries[ii:ii + query_batch_size], k)
+        latencies.append(time.perf_counter() - st)
+        found.append(indices)
+    elapsed: float = time.perf_counter() - st_all
+    found_all = np.concatenate(found, axis=0)
+    return {
+        "layout": index.layout,
+        **index.footprint(),
+        "n_vectors": index.count,
+        "dim": index.store.dim,
+        "n_queries": len(queries),
+        "query_batch_size": query_batch_size,
+        "k": k,
+        "qps": len(queries) / elapsed,
+        "latency_p50_sec": float(np.percentile(latencies, 50)),
+        "latency_p99_sec": float(np.percentile(latencies, 99)),
+        f"recall@{k}": recall_at_k(found_all[:len(truth)], truth),
+    }
+
+
+def main(
+    dst: str | None = None, n_vectors: int = N_VECTORS, dim: int = DIM,
+    n_queries: int = N_QUERIES, k: int = TOP_K,
+    query_batch_size: int = QUERY_BATCH_SIZE, block_size: int = BLOCK_SIZE,
+    layouts: List[str] | None = None, rerank_factor: int = RERANK_FACTOR
+) -> None:
+    """Runs the benchmark of the vector index for each layout and prints the results.
+
+    The default size, 1M x 1536 vectors, takes about 6 GB on disk for the raw
+    vectors plus 6, 3 and 1.5 GB for the float32, float16 and int8 layouts.
+    The synthetic store is reused if `dst` is given.
+
+    Args:
+        dst (str, optional): The directory of the synthetic store.
+            Defaults to a temporary directory.
+        n_vectors (int, optional): The number of vectors. Defaults to N_VECTORS.
+        dim (int, optional): The dimension of the vectors. Defaults to DIM.
+        n_queries (int, optional): The number of queries. Defaults to N_QUERIES.
+        k (int, optional): The number of results per query. Defaults to TOP_K.
+        query_batch_size (int, optional): The queries per search call.
+        block_size (int, optional): The rows scored in one matrix product.
+        layouts (list of str, optional): The layouts to benchmark. Defaults to all.
+        rerank_factor (int, optional): The candidates re-ranked per result.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dirpath: str = dst or os.path.join(tmpdir, "store")
+        print(f"generate {n_vectors} x {dim} vectors in {dirpath}...")
+        st = time.perf_counter()
+        store = generate_store(dirpath, n_vectors, dim)
+        print(f"done in {time.perf_counter() - st:.1f} sec.")
+        queries = make_queries(store, n_queries)
+        truth = exact_top_k(store, queries[:N_GROUND_TRUTH], k, block_size)
+        for layout in layouts or list(LAYOUT_FILENAMES):
+            st = time.perf_counter()
+            index = VectorIndex(dirpath, block_size, layout, rerank_factor)
+            print(f"{layout} index built in {time.perf_counter() - st:.1f} sec.")
+            results = benchmark_index(index, queries, truth, k, query_batch_size)
+            for key, value in results.items():
+                print(f"    {key}: {value}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dst", dest="dst", type=str, default=None
+    )
+    parser.add_argument(
+        "--n", dest="n", type=int, default=N_VECTORS
+    )
+    parser.add_argument(
+        "--dim", dest="dim", type=int, default=DIM
+    )
+    parser.add_argument(
+        "--queries", dest="queries", type=int, default=N_QUERIES
+    )
+    parser.add_argument(
+        "--k", dest="k", type=int, default=TOP_K
+    )
+    parser.add_argument(
+        "--batch", dest="batch", type=int, default=QUERY_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--block_size", dest="block_size", type=int, default=BLOCK_SIZE
+    )
+    parser.add_argument(
+        "--layouts", dest="layouts", nargs="+", default=None,
+        choices=list(LAYOUT_FILENAMES)
+    )
+    parser.add_argument(
+        "--rerank_factor", dest="rerank_factor", type=int, default=RERANK_FACTOR
+    )
+    args = parser.parse_args()
+    main(
+        args.dst, args.n, args.dim, args.queries, args.k,
+        args.batch, args.block_size, args.layouts, args.rerank_factor
+    )
@@ -0,0 +1,176 @@
+"""cache.py
+
+Content-hash deduplication cache of a vector store.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+import numpy as np
+from .store import VectorStore
+
+CACHE_FILENAME: str = "cache.sqlite3"
+
+
+def chunk_hash(text: str) -> str:
+    """Returns the SHA-256 hex digest of a chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent map from chunk hashes to rows of a `VectorStore`.
+
+    The map is keyed by the model and the deployment, so a chunk is embedded
+    again only if another model or deployment is used. The hashes of the
+    chunks of each file are also kept to find the files changed since the
+    previous run and the rows no longer referenced by any file.
+    The cache may be used by several threads if their calls are serialized.
+
+    Args:
+        dirpath (str): The directory of the vector store.
+        model (str): The name of the embedding model.
+        deployment (str): The endpoint of the deployment.
+    """
+
+    def __init__(self, dirpath: str, model: str, deployment: str) -> None:
+        self.model: str = model
+        self.deployment: str = deployment
+        self.conn: sqlite3.Connection = sqlite3.connect(
+            os.path.join(dirpath, CACHE_FILENAME), check_same_thread=False
+        )
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                model TEXT NOT NULL, deployment TEXT NOT NULL,
+                hash TEXT NOT NULL, row INTEGER NOT NULL,
+                PRIMARY KEY (model, deployment, hash)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                model TEXT NOT NULL, deployment TEXT NOT NULL,
+                path TEXT NOT NULL, hashes TEXT NOT NULL,
+                PRIMARY KEY (model, deployment, path)
+            );
+            """
+        )
+
+    def close(self) -> None:
+        """Closes the database."""
+        self.conn.close()
+
+    def lookup(self, hashes: Iterable[str]) -> Dict[str, int]:
+        """Returns the rows of the hashes already embedded.
+
+        Args:
+            hashes (iterable of str): Chunk hashes.
+
+        Returns:
+            dict: The rows of the hashes found in the cache.
+        """
+        found: Dict[str, int] = {}
+        unique: List[str] = list(set(hashes))
+        for ii in range(0, len(unique), 500):
+            part = unique[ii:ii + 500]
+            cursor = self.conn.execute(
+                "SELECT hash, row FROM chunks WHERE model = ? AND deployment = ? "
+                f"AND hash IN ({','.join('?' * len(part))})",
+                [self.model, self.deployment, *part]
+            )
+            found.update({str(hh): int(row) for hh, row in cursor})
+        return found
+
+    def add(self, rows: Dict[str, int]) -> None:
+        """Records the rows of newly embedded hashes."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [(self.model, self.deployment, hh, row) for hh, row in rows.items()]
+            )
+
+    def file_hashes(self, fpath: str) -> List[str] | None:
+        """Returns the chunk hashes of a file at the previous run, or None if it is new."""
+        row = self.conn.execute(
+            "SELECT hashes FROM files WHERE model = ? AND deployment = ? AND path = ?",
+            (self.model, self.deployment, os.path.abspath(fpath))
+        ).fetchone()
+        return None if row is None else list(json.loads(row[0]))
+
+    def set_file_hashes(self, fpath: str, hashes: List[str]) -> None:
+        """Records the chunk hashes of a file."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (self.model, self.deployment, os.path.abspath(fpath), json.dumps(hashes))
+            )
+
+    def prune_missing_files(self) -> int:
+        """Forgets the files which no longer exist.
+
+        Returns:
+            int: The number of files forgotten.
+        """
+        paths: List[str] = [
+            str(path) for (path,) in self.conn.execute(
+                "SELECT path FROM files WHERE model = ? AND deployment = ?",
+                (self.model, self.deployment)
+            )
+            if not os.path.exists(str(path))
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM files WHERE model = ? AND deployment = ? AND path = ?",
+                [(self.model, self.deployment, path) for path in paths]
+            )
+        return len(paths)
+
+    def referenced_rows(self) -> Set[int]:
+        """Returns the rows referenced by the chunks of any known file.
+
+        Files of every model and deployment are considered,
+        because they share the rows of the store.
+        """
+        hashes: Set[Tuple[str, str, str]] = set()
+        for model, deployment, value in self.conn.execute(
+            "SELECT model, deployment, hashes FROM files"
+        ):
+            hashes.update((model, deployment, hh) for hh in json.loads(value))
+        return {
+            int(row) for model, deployment, hh, row in self.conn.execute(
+                "SELECT model, deployment, hash, row FROM chunks"
+            )
+            if (model, deployment, hh) in hashes
+        }
+
+    def compact(self, store: VectorStore) -> int:
+        """Removes the rows no longer referenced by any file from the store.
+
+        Args:
+            store (VectorStore): The vector store the cache belongs to.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        self.prune_missing_files()
+        keep = np.asarray(sorted(
+            row for row in self.referenced_rows() if row < store.count
+        ), dtype=np.int64)
+        n_removed: int = store.count - len(keep)
+        if n_removed == 0:
+            return 0
+        store.compact(keep)
+        new_rows: Dict[int, int] = {int(old): new for new, old in enumerate(keep)}
+        with self.conn:
+            entries = self.conn.execute(
+                "SELECT model, deployment, hash, row FROM chunks"
+            ).fetchall()
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                [
+                    (model, deployment, hh, new_rows[int(row)])
+                    for model, deployment, hh, row in entries
+                    if int(row) in new_rows
+                ]
+            )
+        return n_removed
@@ -0,0 +1,338 @@
+"""index.py
+
+Memory-mapped cosine similarity index over a vector store.
+"""
+
+from contextlib import ExitStack
+import json
+import os
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import numpy.typing as npt
+from .store import VectorStore, DTYPE
+
+NORMALIZED_FILENAME: str = "normalized.f32"
+INDEX_INFO_FILENAME: str = "index.json"
+SCALES_FILENAME: str = "scales.f32"
+LAYOUT_FILENAMES: Dict[str, str] = {
+    "float32": NORMALIZED_FILENAME,
+    "float16": "normalized.f16",
+    "int8": "normalized.i8",
+}
+LAYOUT_COUNT_KEYS: Dict[str, str] = {
+    "float32": "count",
+    "float16": "count_float16",
+    "int8": "count_int8",
+}
+LAYOUT_DEFAULT: str = "float32"
+INT8_MAX: float = 127.0
+BLOCK_SIZE: int = 65536
+CONVERT_BLOCK_BYTES: int = 16 * 1024 * 1024
+TOP_K: int = 10
+RERANK_FACTOR: int = 4
+EPSILON: float = 1e-12
+
+
+def normalize(vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    """Scales vectors to unit length row by row.
+
+    Args:
+        vectors (numpy.ndarray): A 2-D array.
+
+    Returns:
+        numpy.ndarray: The normalized float32 array.
+    """
+    vectors = np.asarray(vectors, dtype=DTYPE)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.asarray(vectors / np.maximum(norms, EPSILON), dtype=DTYPE)
+
+
+def quantize_int8(
+    vectors: npt.NDArray[np.float32]
+) -> Tuple[npt.NDArray[np.int8], npt.NDArray[np.float32]]:
+    """Quantizes vectors to int8 with one scale factor per vector.
+
+    Args:
+        vectors (numpy.ndarray): A 2-D float array.
+
+    Returns:
+        tuple: The int8 array and the float32 scales such that
+        `vectors ~= quantized * scales[:, None]`.
+    """
+    scales = np.max(np.abs(vectors), axis=1) / INT8_MAX
+    scales = np.maximum(scales, EPSILON).astype(DTYPE)
+    quantized = np.rint(vectors / scales[:, None]).clip(-INT8_MAX, INT8_MAX)
+    return quantized.astype(np.int8), scales
+
+
+def merge_top_k(
+    scores: npt.NDArray[np.float32], indices: npt.NDArray[np.int64], k: int
+) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+    """Keeps the `k` best candidates of each row, unordered.
+
+    Args:
+        scores (numpy.ndarray): Candidate scores of shape (n_queries, n_candidates).
+        indices (numpy.ndarray): Row indices of the candidates, of the same shape.
+        k (int): The number of candidates to keep.
+
+    Returns:
+        tuple: The scores and the indices of shape (n_queries, min(k, n_candidates)).
+    """
+    if scores.shape[1] <= k:
+        return scores, indices
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return (
+        np.take_along_axis(scores, part, axis=1),
+        np.take_along_axis(indices, part, axis=1)
+    )
+
+
+def sort_top_k(
+    scores: npt.NDArray[np.float32], indices: npt.NDArray[np.int64]
+) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+    """Sorts candidates of each row by descending score."""
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(scores, order, axis=1),
+        np.take_along_axis(indices, order, axis=1)
+    )
+
+
+class VectorIndex:
+    """Cosine top-k search over the vectors of a `VectorStore`.
+
+    The vectors are normalized once into a file of the chosen layout next to
+    the store:
+        * float32: `normalized.f32`, searched exactly.
+        * float16: `normalized.f16`, half the size of float32.
+        * int8: `normalized.i8` with per-vector scale factors in `scales.f32`,
+          a quarter of the size of float32.
+    Quantized layouts are searched for `rerank_factor * k` candidates first,
+    and the candidates are re-ranked with the full precision vectors read from
+    the memory map of the store, so only the candidate rows are paged in.
+    Rows appended to the store afterwards are normalized and appended to the
+    file by `update`, so the existing rows are never rewritten. The files are
+    rebuilt only when the store is compacted.
+    Searches read the memory-mapped file block by block, which keeps the
+    resident memory bounded by `block_size` rows regardless of the store size.
+    The blocks of quantized layouts are converted to float32 for the matrix
+    product, so they are further limited to CONVERT_BLOCK_BYTES of float32.
+
+    Args:
+        dirpath (str): The directory of the vector store.
+        block_size (int, optional): The rows scored in one matrix product.
+            Defaults to BLOCK_SIZE.
+        layout (str, optional): One of LAYOUT_FILENAMES. Defaults to LAYOUT_DEFAULT.
+        rerank_factor (int, optional): The candidates re-ranked per result
+            for quantized layouts. Defaults to RERANK_FACTOR.
+
+    Raises:
+        ValueError: If `layout` is unknown.
+    """
+
+    def __init__(
+        self, dirpath: str, block_size: int = BLOCK_SIZE,
+        layout: str = LAYOUT_DEFAULT, rerank_factor: int = RERANK_FACTOR
+    ) -> None:
+        if layout not in LAYOUT_FILENAMES:
+            raise ValueError(f"'layout' must be one of {list(LAYOUT_FILENAMES)}.")
+        self.store: VectorStore = VectorStore(dirpath)
+        self.block_size: int = block_size
+        self.layout: str = layout
+        self.rerank_factor: int = rerank_factor
+        self.info: Dict[str, Any] = {}
+        if os.path.exists(self.store.path(INDEX_INFO_FILENAME)):
+            with open(self.store.path(INDEX_INFO_FILENAME), "r", encoding="utf-8") as ff:
+                self.info.update(json.load(ff))
+        self.update()
+
+    @property
+    def count(self) -> int:
+        """The number of indexed rows."""
+        return int(self.info.get(LAYOUT_COUNT_KEYS[self.layout], 0))
+
+    @property
+    def dtype(self) -> npt.DTypeLike:
+        """The dtype of the layout."""
+        return np.dtype(self.layout)
+
+    def _save_info(self) -> None:
+        fpath: str = self.store.path(INDEX_INFO_FILENAME)
+        with open(f"{fpath}.tmp", "w", encoding="utf-8") as ff:
+            json.dump(self.info, ff, indent=4)
+        os.replace(f"{fpath}.tmp", fpath)
+
+    def _truncate(self, fname: str, n_bytes: int) -> None:
+        fpath: str = self.store.path(fname)
+        if os.path.exists(fpath) and os.path.getsize(fpath) > n_bytes:
+            os.truncate(fpath, n_bytes)
+
+    def update(self) -> int:
+        """Normalizes the rows appended to the store since the last update.
+
+        Returns:
+            int: The number of rows newly indexed.
+        """
+        if int(self.info.get("generation", 0)) != self.store.generation:
+            self.info = {"generation": self.store.generation}
+        fname: str = LAYOUT_FILENAMES[self.layout]
+        self._truncate(
+            fname, self.count * self.store.dim * np.dtype(self.dtype).itemsize
+        )
+        if self.layout == "int8":
+            self._truncate(SCALES_FILENAME, self.count * np.dtype(DTYPE).itemsize)
+        start: int = self.count
+        if start >= self.store.count:
+            return 0
+        vectors = self.store.vectors()
+        with ExitStack() as stack:
+            ff = stack.enter_context(open(self.store.path(fname), "ab"))
+            if self.layout == "int8":
+                ff_scales = stack.enter_context(
+                    open(self.store.path(SCALES_FILENAME), "ab")
+                )
+            for ii in range(start, self.store.count, self.block_size):
+                block = normalize(vectors[ii:ii + self.block_size])
+                if self.layout == "int8":
+                    quantized, scales = quantize_int8(block)
+                    ff.write(quantized.tobytes())
+                    ff_scales.write(scales.tobytes())
+                else:
+                    ff.write(block.astype(self.dtype).tobytes())
+        self.info[LAYOUT_COUNT_KEYS[self.layout]] = self.store.count
+        self._save_info()
+        return self.store.count - start
+
+    def append(
+        self, vectors: npt.NDArray[np.float32], metadata: List[Dict[str, Any]]
+    ) -> None:
+        """Appends rows to the store and indexes them.
+
+        Args:
+            vectors (numpy.ndarray): A 2-D array of shape (n, dim).
+            metadata (list of dict): A list of n dictionaries describing the rows.
+        """
+        self.store.append(vectors, metadata)
+        self.update()
+
+    def normalized(self) -> npt.NDArray[Any]:
+        """Returns the read-only memory map of the normalized vectors in the layout."""
+        if self.count == 0:
+            return np.zeros((0, self.store.dim), dtype=self.dtype)
+        return np.memmap(
+            self.store.path(LAYOUT_FILENAMES[self.layout]), dtype=self.dtype,
+            mode="r", shape=(self.count, self.store.dim)
+        )
+
+    def scales(self) -> npt.NDArray[np.float32]:
+        """Returns the memory map of the int8 scale factors."""
+        if self.count == 0 or self.layout != "int8":
+            return np.ones((self.count,), dtype=DTYPE)
+        return np.memmap(
+            self.store.path(SCALES_FILENAME), dtype=DTYPE, mode="r",
+            shape=(self.count,)
+        )
+
+    def footprint(self) -> Dict[str, int]:
+        """Reports the bytes of the files the index reads.
+
+        Returns:
+            dict: 'search_bytes' is scanned by every search and should fit in
+            the memory, while 'rerank_bytes' is only paged in for candidates.
+        """
+        n_search: int = self.count * self.store.dim * np.dtype(self.dtype).itemsize
+        if self.layout == "int8":
+            n_search += self.count * np.dtype(DTYPE).itemsize
+        n_rerank: int = 0
+        if self.layout != "float32":
+            n_rerank = self.store.count * self.store.dim * np.dtype(DTYPE).itemsize
+        return {"search_bytes": n_search, "rerank_bytes": n_rerank}
+
+    def _scan(
+        self, queries_2d: npt.NDArray[np.float32], k: int
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+        """Scores all the rows in blocks and keeps the `k` best of each query."""
+        n_queries: int = queries_2d.shape[0]
+        best_scores: npt.NDArray[np.float32] = np.empty((n_queries, 0), dtype=DTYPE)
+        best_indices: npt.NDArray[np.int64] = np.empty((n_queries, 0), dtype=np.int64)
+        matrix = self.normalized()
+        scales = self.scales()
+        block_size: int = self.block_size
+        if self.layout != "float32":
+            row_bytes: int = max(1, self.store.dim) * np.dtype(DTYPE).itemsize
+            block_size = max(1, min(block_size, CONVERT_BLOCK_BYTES // row_bytes))
+        for start in range(0, self.count, block_size):
+            block = np.asarray(matrix[start:start + block_size], dtype=DTYPE)
+            scores = queries_2d @ block.T
+            if self.layout == "int8":
+                scores *= np.asarray(scales[start:start + block_size])
+            indices = np.broadcast_to(
+                np.arange(start, start + block.shape[0], dtype=np.int64),
+                scores.shape
+            )
+            scores, indices = merge_top_k(scores, indices, k)
+            best_scores, best_indices = merge_top_k(
+                np.concatenate([best_scores, scores], axis=1),
+                np.concatenate([best_indices, indices], axis=1), k
+            )
+        return best_scores, best_indices
+
+    def _rerank(
+        self, queries_2d: npt.NDArray[np.float32],
+        candidates: npt.NDArray[np.int64], k: int
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+        """Scores candidates with the full precision vectors of the store."""
+        rows, inverse = np.unique(candidates, return_inverse=True)
+        full = normalize(np.asarray(self.store.vectors()[rows]))
+        vectors = full[inverse.reshape(candidates.shape)]
+        scores = np.einsum("qd,qcd->qc", queries_2d, vectors).astype(DTYPE)
+        return merge_top_k(scores, candidates, k)
+
+    def search(
+        self, queries: npt.NDArray[np.float32], k: int = TOP_K
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+        """Finds the `k` most similar rows of each query by cosine similarity.
+
+        Each block of rows is scored against all the queries with one matrix
+        product, and only the best candidates of the block are kept with
+        `argpartition` before they are merged into the running results.
+        Candidates of quantized layouts are re-ranked in full precision.
+
+        Args:
+            queries (numpy.ndarray): A query of shape (dim,) or queries of shape (n_queries, dim).
+            k (int, optional): The number of results per query. Defaults to TOP_K.
+
+        Returns:
+            tuple: The similarities and the row indices, both of shape
+            (n_queries, min(k, count)), sorted by descending similarity.
+        """
+        queries_2d = normalize(np.atleast_2d(queries))
+        if self.layout == "float32":
+            return sort_top_k(*self._scan(queries_2d, k))
+        _, candidates = self._scan(queries_2d, k * self.rerank_factor)
+        return sort_top_k(*self._rerank(queries_2d, candidates, k))
+
+    def search_metadata(
+        self, queries: npt.NDArray[np.float32], k: int = TOP_K
+    ) -> List[List[Dict[str, Any]]]:
+        """Finds the `k` most similar rows of each query and returns their metadata.
+
+        Args:
+            queries (numpy.ndarray): A query of shape (dim,) or queries of shape (n_queries, dim).
+            k (int, optional): The number of results per query. Defaults to TOP_K.
+
+        Returns:
+            list of list of dict: The metadata of the results with a key 'score' added.
+        """
+        scores, indices = self.search(queries, k)
+        wanted = set(int(ii) for ii in indices.ravel())
+        metadata: Dict[int, Dict[str, Any]] = {
+            ii: row for ii, row in enumerate(self.store.iter_metadata()) if ii in wanted
+        }
+        return [
+            [
+                dict(metadata[int(ii)], score=float(score))
+                for score, ii in zip(scores_q, indices_q)
+            ]
+            for scores_q, indices_q in zip(scores, indices)
+        ]
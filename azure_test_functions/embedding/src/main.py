@@ -1,12 +1,31 @@
 """embedding"""
 
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
 import os
-# from openai import AzureOpenAI
+from typing import Any, Deque, Dict, Iterator, List, Set, Tuple
+import warnings
+import numpy as np
+import numpy.typing as npt
+import requests
+from ...common.src.executor import EXECUTOR
+from ...common.src.metrics import METRICS, profiled
+from ...common.src.scanner import scan
+from .cache import EmbeddingCache, chunk_hash
+from .store import VectorStore
 
 TIMEOUT_SEC: float = 30.0
 WAIT_TIME_SEC: float = 3.0
 DSTDIR_DEFAULT: str = r'C:\home\local\test\data\embedding'
 DATETIME_FORMAT: str = '%Y%m%d%H%M%S'
+CHUNK_CHARS: int = 2000
+CHUNK_OVERLAP_CHARS: int = 200
+MAX_BATCH_SIZE: int = 2048
+MAX_BATCH_CHARS: int = 400000
+MAX_WORKERS: int = 4
+TEXT_EXTENSION: str = ".txt"
+EXCLUDE_SUFFIX: str = "merged"
 
 ENDPOINT_KEY: str | None = os.environ.get("AZURE_OPENAI_KEY", None)
 ENDPOINT_BASE: str | None = os.environ.get("AZURE_OPENAI_ENDPOINT", None)
@@ -16,3 +35,278 @@ EMBEDDING_ENDPOINT: str | None = None
 if ENDPOINT_BASE is not None:
     EMBEDDING_ENDPOINT = f"{ENDPOINT_BASE.rstrip('/')}/openai/deployments/{MODEL}/embeddings?api-version={API_VERSION}"
 LOCATION: str | None = os.environ.get("AZURE_OPENAI_EMBEDDING_LOCATION", None)
+
+
+def chunk_text(
+    text: str, chunk_chars: int = CHUNK_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS
+) -> List[Tuple[int, int]]:
+    """Splits a text into overlapping chunks, preferring line breaks as boundaries.
+
+    Args:
+        text (str): The text to split.
+        chunk_chars (int, optional): The maximum characters of a chunk. Defaults to CHUNK_CHARS.
+        overlap_chars (int, optional): The characters shared by consecutive chunks.
+            Defaults to CHUNK_OVERLAP_CHARS.
+
+    Returns:
+        list of tuple: The (start, end) character offsets of the chunks.
+
+    Raises:
+        ValueError: If `overlap_chars` is not smaller than `chunk_chars`.
+    """
+    if overlap_chars >= chunk_chars:
+        raise ValueError("'overlap_chars' must be smaller than 'chunk_chars'.")
+    spans: List[Tuple[int, int]] = []
+    start: int = 0
+    while start < len(text):
+        end: int = min(start + chunk_chars, len(text))
+        if end < len(text):
+            newline: int = text.rfind("\n", start + overlap_chars + 1, end)
+            if newline > 0:
+                end = newline + 1
+        if text[start:end].strip():
+            spans.append((start, end))
+        if end == len(text):
+            break
+        start = end - overlap_chars
+    return spans
+
+
+def iter_text_files(srcs: List[str]) -> Iterator[str]:
+    """Yields text files given directly or found in directories.
+
+    Directories are expected to be outputs of `ocr_merge_texts`, `translation`
+    or `speech_to_text`. Aggregated files such as `translated_merged.txt`
+    are skipped because their contents are already in the other files.
+    The files of a directory are yielded as they are listed (see `scan`), not
+    sorted, so the first batch is sent before a large directory is listed.
+
+    Args:
+        srcs (list of str): File or directory paths.
+
+    Yields:
+        str: The path of a text file.
+    """
+    for src in srcs:
+        if os.path.isfile(src):
+            yield src
+            continue
+        if not os.path.isdir(src):
+            warnings.warn(f"not a file or directory: {src}")
+            continue
+        for entry in scan(src, [TEXT_EXTENSION], exclude=[f"*{EXCLUDE_SUFFIX}*"]):
+            yield entry.path
+
+
+def iter_batches(
+    chunks: Iterator[Tuple[str, Dict[str, Any]]],
+    max_batch_size: int = MAX_BATCH_SIZE, max_batch_chars: int = MAX_BATCH_CHARS
+) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+    """Groups chunks into request-sized batches.
+
+    Args:
+        chunks (iterator of tuple): Pairs of a text and its metadata.
+        max_batch_size (int, optional): The maximum inputs per request.
+            Defaults to MAX_BATCH_SIZE.
+        max_batch_chars (int, optional): The maximum characters per request.
+            Defaults to MAX_BATCH_CHARS.
+
+    Yields:
+        tuple: A list of texts and a list of their metadata.
+    """
+    texts: List[str] = []
+    metadata: List[Dict[str, Any]] = []
+    n_chars: int = 0
+    for text, meta in chunks:
+        if texts and (len(texts) >= max_batch_size or n_chars + len(text) > max_batch_chars):
+            yield texts, metadata
+            texts, metadata, n_chars = [], [], 0
+        texts.append(text)
+        metadata.append(meta)
+        n_chars += len(text)
+    if texts:
+        yield texts, metadata
+
+
+@functools.lru_cache(maxsize=1)
+def session() -> requests.Session:
+    """Returns the session of the embedding API, created once per process
+    so that its connections are reused by the calls of `embed`."""
+    return requests.Session()
+
+
+@METRICS.timed("embedding.embed")
+def embed(texts: List[str]) -> npt.NDArray[np.float32]:
+    """Generates embeddings of texts with one request to the Azure OpenAI Service.
+
+    The request is sent through `EXECUTOR`, which retries throttled and failed requests.
+
+    Args:
+        texts (list of str): The texts to embed. At most MAX_BATCH_SIZE.
+
+    Returns:
+        numpy.ndarray: A float32 array of shape (len(texts), dim).
+
+    Raises:
+        ValueError: If the endpoint is not configured.
+        requests.exceptions.HTTPError: If the API request returns an error status code.
+    """
+    if EMBEDDING_ENDPOINT is None:
+        raise ValueError("No endpoint for Azure OpenAI embedding allocated.")
+    headers = {"api-key": ENDPOINT_KEY or ""}
+    endpoint: str = EMBEDDING_ENDPOINT
+    METRICS.inc(
+        "upload_bytes_total", sum(len(text.encode("utf-8")) for text in texts),
+        function="embedding.embed"
+    )
+
+    def post() -> requests.Response:
+        response = session().post(
+            endpoint, headers=headers,
+            json={"input": texts}, timeout=TIMEOUT_SEC
+        )
+        response.raise_for_status()
+        return response
+
+    response = EXECUTOR.call(ENDPOINT_BASE or "", post)
+    data: List[Dict[str, Any]] = sorted(
+        response.json()["data"], key=lambda item: int(item["index"])
+    )
+    return np.asarray([item["embedding"] for item in data], dtype=np.float32)
+
+
+def _iter_new_chunks(
+    fpaths: Iterator[str], chunk_chars: int, cache: EmbeddingCache,
+    file_hashes: Dict[str, List[str]]
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yields the chunks not embedded yet.
+
+    Files whose chunk hashes are the same as at the previous run are skipped
+    without looking up their chunks. The chunk hashes of the other files are
+    put into `file_hashes` to be recorded after their chunks are stored.
+    """
+    seen: Set[str] = set()
+    for fpath in fpaths:
+        with open(fpath, "r", encoding="utf-8") as ff:
+            text: str = ff.read()
+        spans: List[Tuple[int, int]] = chunk_text(text, chunk_chars)
+        hashes: List[str] = [chunk_hash(text[start:end]) for start, end in spans]
+        if cache.file_hashes(fpath) == hashes:
+            continue
+        file_hashes[fpath] = hashes
+        known: Dict[str, int] = cache.lookup(hashes)
+        for ii, ((start, end), hh) in enumerate(zip(spans, hashes)):
+            if hh in known or hh in seen:
+                continue
+            seen.add(hh)
+            yield text[start:end], {
+                "hash": hh, "source": fpath, "chunk": ii, "start": start, "end": end
+            }
+
+
+@profiled("embedding.embed_from_paths")
+def embed_from_paths(
+    srcs: List[str], dst: str = DSTDIR_DEFAULT,
+    max_workers: int = MAX_WORKERS, chunk_chars: int = CHUNK_CHARS,
+    compact: bool = False
+) -> VectorStore:
+    """Embeds text files and appends the vectors to a store.
+
+    Chunks are identified by their content hashes, and only the chunks not
+    embedded yet by the same model and deployment are sent, so repeated texts
+    are embedded once and re-running after adding or editing files only
+    embeds the new chunks.
+    Requests are sent by up to `max_workers` threads, and batches are
+    appended to the store in order as soon as the earlier ones are done,
+    so at most `2 * max_workers` batches are held in memory.
+
+    Args:
+        srcs (list of str): Text files or directories containing text files.
+        dst (str, optional): The directory of the vector store. Defaults to DSTDIR_DEFAULT.
+        max_workers (int, optional): The number of concurrent requests. Defaults to MAX_WORKERS.
+        chunk_chars (int, optional): The maximum characters of a chunk. Defaults to CHUNK_CHARS.
+        compact (bool, optional): Removes the rows no longer referenced by
+            any file from the store if True.
+
+    Returns:
+        VectorStore: The store the vectors are appended to.
+    """
+    store = VectorStore(dst, MODEL)
+    cache = EmbeddingCache(dst, MODEL or "", ENDPOINT_BASE or "")
+    file_hashes: Dict[str, List[str]] = {}
+    pending: Deque[Tuple[Future[npt.NDArray[np.float32]], List[Dict[str, Any]]]] = deque()
+    n_rows: int = 0
+
+    def flush_one() -> None:
+        nonlocal n_rows
+        future, metadata = pending.popleft()
+        start: int = store.count
+        store.append(future.result(), metadata)
+        cache.add({meta["hash"]: start + ii for ii, meta in enumerate(metadata)})
+        n_rows += len(metadata)
+        print(f"{n_rows} chunks embedded.")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batches = iter_batches(_iter_new_chunks(
+                iter_text_files(srcs), chunk_chars, cache, file_hashes
+            ))
+            for texts, metadata in batches:
+                pending.append((executor.submit(embed, texts), metadata))
+                while len(pending) >= 2 * max_workers or (pending and pending[0][0].done()):
+                    flush_one()
+            while pending:
+                flush_one()
+        for fpath, hashes in file_hashes.items():
+            cache.set_file_hashes(fpath, hashes)
+        print(f"{len(file_hashes)} new or changed files.")
+        if compact:
+            print(f"{cache.compact(store)} orphaned rows removed.")
+    finally:
+        cache.close()
+    return store
+
+
+def main(
+    srcs: List[str], dst: str = DSTDIR_DEFAULT,
+    max_workers: int = MAX_WORKERS, chunk_chars: int = CHUNK_CHARS,
+    compact: bool = False
+) -> None:
+    """Embeds text files, e.g. outputs of `ocr_merge_texts`, `translation` and
+    `speech_to_text`, into a vector store.
+
+    Args:
+        srcs (list of str): Text files or directories containing text files.
+        dst (str, optional): The directory of the vector store. Defaults to DSTDIR_DEFAULT.
+        max_workers (int, optional): The number of concurrent requests. Defaults to MAX_WORKERS.
+        chunk_chars (int, optional): The maximum characters of a chunk. Defaults to CHUNK_CHARS.
+        compact (bool, optional): Removes the rows no longer referenced by
+            any file from the store if True.
+    """
+    if not ENDPOINT_KEY:
+        warnings.warn("No key for Azure OpenAI embedding allocated.")
+        return
+    print("embed...")
+    store = embed_from_paths(srcs, dst, max_workers, chunk_chars, compact)
+    print(f"done. {store.count} vectors of dimension {store.dim} in {dst}.")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str, nargs="+")
+    parser.add_argument(
+        "--dst", dest="dst", type=str, default=DSTDIR_DEFAULT
+    )
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=MAX_WORKERS
+    )
+    parser.add_argument(
+        "--chunk_chars", dest="chunk_chars", type=int, default=CHUNK_CHARS
+    )
+    parser.add_argument(
+        "--compact", dest="compact", action="store_true"
+    )
+    args = parser.parse_args()
+    main(args.src, args.dst, args.workers, args.chunk_chars, args.compact)
@@ -0,0 +1,176 @@
+"""store.py
+
+Append-only store of embedding vectors.
+
+A store is a directory holding
+    * `vectors.f32`: a contiguous row-major float32 matrix without a header,
+    * `metadata.jsonl`: one JSON line per row of the matrix, and
+    * `store.json`: the number of rows, the dimension, the model and
+      the generation, which is incremented when rows are removed.
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterator, List
+import numpy as np
+import numpy.typing as npt
+
+VECTORS_FILENAME: str = "vectors.f32"
+METADATA_FILENAME: str = "metadata.jsonl"
+INFO_FILENAME: str = "store.json"
+DTYPE: str = "float32"
+COPY_BLOCK_BYTES: int = 16 * 1024 * 1024
+
+
+def _dump_json(fpath: str, value: Dict[str, Any]) -> None:
+    tmppath: str = f"{fpath}.tmp"
+    with open(tmppath, "w", encoding="utf-8") as ff:
+        json.dump(value, ff, indent=4)
+    os.replace(tmppath, fpath)
+
+
+class VectorStore:
+    """Append-only float32 matrix with a side metadata table.
+
+    Rows are appended to the end of `vectors.f32` and `metadata.jsonl`,
+    and `store.json` is replaced only after both are written, so a store
+    interrupted in the middle of an append keeps its previous contents.
+
+    Args:
+        dirpath (str): The directory of the store. It is created if it does not exist.
+        model (str, optional): The model the vectors are generated by.
+    """
+
+    def __init__(self, dirpath: str, model: str | None = None) -> None:
+        self.dirpath: str = dirpath
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self.info: Dict[str, Any] = {
+            "count": 0, "dim": 0, "dtype": DTYPE, "model": model, "generation": 0
+        }
+        if os.path.exists(self.path(INFO_FILENAME)):
+            with open(self.path(INFO_FILENAME), "r", encoding="utf-8") as ff:
+                self.info.update(json.load(ff))
+        self._truncate_uncommitted()
+
+    def path(self, fname: str) -> str:
+        """Returns the path of a file in the store."""
+        return os.path.join(self.dirpath, fname)
+
+    @property
+    def count(self) -> int:
+        """The number of rows."""
+        return int(self.info["count"])
+
+    @property
+    def generation(self) -> int:
+        """The number of times rows have been removed by `compact`."""
+        return int(self.info.get("generation", 0))
+
+    @property
+    def dim(self) -> int:
+        """The dimension of the vectors, or 0 if the store is empty."""
+        return int(self.info["dim"])
+
+    def _truncate_uncommitted(self) -> None:
+        """Drops rows written after the last update of `store.json`."""
+        fpath: str = self.path(VECTORS_FILENAME)
+        n_bytes: int = self.count * self.dim * np.dtype(DTYPE).itemsize
+        if os.path.exists(fpath) and os.path.getsize(fpath) > n_bytes:
+            os.truncate(fpath, n_bytes)
+        fpath = self.path(METADATA_FILENAME)
+        if not os.path.exists(fpath):
+            return
+        with open(fpath, "rb+") as ff:
+            for _ in range(self.count):
+                if not ff.readline():
+                    break
+            ff.truncate()
+
+    def append(
+        self, vectors: npt.NDArray[np.float32], metadata: List[Dict[str, Any]]
+    ) -> None:
+        """Appends rows to the store.
+
+        Args:
+            vectors (numpy.ndarray): A 2-D array of shape (n, dim).
+            metadata (list of dict): A list of n dictionaries describing the rows.
+
+        Raises:
+            ValueError: If the shapes do not match.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=DTYPE)
+        if vectors.ndim != 2 or vectors.shape[0] != len(metadata):
+            raise ValueError("'vectors' must have one row per metadata.")
+        if self.dim and vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"dimension mismatch: {vectors.shape[1]} != {self.dim}"
+            )
+        if len(metadata) == 0:
+            return
+        with open(self.path(VECTORS_FILENAME), "ab") as ff:
+            ff.write(vectors.tobytes())
+        with open(self.path(METADATA_FILENAME), "a", encoding="utf-8") as ff:
+            for row in metadata:
+                ff.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.info["dim"] = int(vectors.shape[1])
+        self.info["count"] = self.count + len(metadata)
+        _dump_json(self.path(INFO_FILENAME), self.info)
+
+    def vectors(self) -> npt.NDArray[np.float32]:
+        """Returns the read-only memory map of the matrix.
+
+        Returns:
+            numpy.ndarray: An array of shape (count, dim).
+        """
+        if self.count == 0:
+            return np.zeros((0, self.dim), dtype=DTYPE)
+        return np.memmap(
+            self.path(VECTORS_FILENAME), dtype=DTYPE, mode="r",
+            shape=(self.count, self.dim)
+        )
+
+    def iter_metadata(self) -> Iterator[Dict[str, Any]]:
+        """Yields the metadata of the rows in order."""
+        if self.count == 0:
+            return
+        with open(self.path(METADATA_FILENAME), "r", encoding="utf-8") as ff:
+            for _, line in zip(range(self.count), ff):
+                yield json.loads(line)
+
+    def metadata(self) -> List[Dict[str, Any]]:
+        """Returns the metadata of all the rows."""
+        return list(self.iter_metadata())
+
+    def compact(self, keep: npt.NDArray[np.int64]) -> None:
+        """Rewrites the store keeping only the given rows.
+
+        The kept rows are renumbered in order, i.e. the row `keep[ii]`
+        becomes the row `ii`, and the generation is incremented so that
+        indexes built on the previous rows are rebuilt. The rows are copied
+        in blocks of at most COPY_BLOCK_BYTES.
+
+        Args:
+            keep (numpy.ndarray): The sorted indices of the rows to keep.
+        """
+        keep = np.asarray(keep, dtype=np.int64)
+        vectors = self.vectors()
+        block_size: int = max(
+            COPY_BLOCK_BYTES // max(self.dim * np.dtype(DTYPE).itemsize, 1), 1
+        )
+        with open(self.path(f"{VECTORS_FILENAME}.tmp"), "wb") as ff:
+            for ii in range(0, len(keep), block_size):
+                ff.write(np.asarray(
+                    vectors[keep[ii:ii + block_size]], dtype=DTYPE
+                ).tobytes())
+        del vectors
+        keep_set = set(keep.tolist())
+        with open(self.path(f"{METADATA_FILENAME}.tmp"), "w", encoding="utf-8") as ff:
+            for ii, row in enumerate(self.iter_metadata()):
+                if ii in keep_set:
+                    ff.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(self.path(f"{VECTORS_FILENAME}.tmp"), self.path(VECTORS_FILENAME))
+        os.replace(self.path(f"{METADATA_FILENAME}.tmp"), self.path(METADATA_FILENAME))
+        self.info["count"] = len(keep)
+        self.info["generation"] = self.generation + 1
+        _dump_json(self.path(INFO_FILENAME), self.info)
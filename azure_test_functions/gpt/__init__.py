@@ -1,3 +1,16 @@
 """gpt"""
 
-from .src import main as gpt
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as gpt
+    from .src import session as gpt_session
+    from .src import summarize as gpt_summarize
+
+__all__ = ["gpt", "gpt_session", "gpt_summarize"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "gpt": ".src.main",
+    "gpt_session": ".src.session",
+    "gpt_summarize": ".src.summarize"
+}, fallback=".src.main")
@@ -1,6 +1,6 @@
 """gpt"""
 
-from .src.main import main, MAX_TOKENS
+from .src.main import main, MAX_TOKENS, OUTPUT_MODES
 
 if __name__ == "__main__":
     import argparse
@@ -10,7 +10,11 @@ if __name__ == "__main__":
         "--dst", dest="dst", type=str, default=""
     )
     parser.add_argument(
-        "--max_tokens", dest="max_tokens", type=str, default=MAX_TOKENS
+        "--max_tokens", dest="max_tokens", type=int, default=MAX_TOKENS
+    )
+    parser.add_argument(
+        "--output_mode", dest="output_mode", type=str, default="file",
+        choices=OUTPUT_MODES
     )
     args = parser.parse_args()
-    main(args.query, args.dst, args.max_tokens)
+    main(args.query, args.dst, args.max_tokens, args.output_mode)
@@ -3,25 +3,42 @@
 GPT test
 """
 
+from __future__ import annotations
 from datetime import datetime
+import functools
 import os
+from typing import TYPE_CHECKING, List, Mapping
 import warnings
-from openai import AzureOpenAI
-from openai.types.chat import ChatCompletionMessageParam, ChatCompletion
+from ...common.src.executor import EXECUTOR, retry_after_sec
+from ...common.src.metrics import METRICS
+from ...common.src.result_log import ResultLog
+from .rate_limiter import RateLimiter, estimate_prompt_tokens
+
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
+    from openai.types.chat import ChatCompletionMessageParam, ChatCompletion
 
 MAX_TOKENS: int = 50
+MAX_RETRIES: int = 5
 TIMEOUT_SEC: float = 30.0
 WAIT_TIME_SEC: float = 3.0
 DEFAULT_OUTPUT_DIRPATH: str = r'C:\home\local\test\data\gpt'
 DATETIME_FORMAT: str = '%Y%m%d%H%M%S'
+LOG_DIRNAME: str = "log"
+OUTPUT_MODES: List[str] = ["file", "log"]
 
 ENDPOINT_KEY: str | None = os.getenv("AZURE_OPENAI_KEY")
 ENDPOINT_BASE: str = os.environ.get("AZURE_OPENAI_ENDPOINT", "")
 MODEL: str = os.environ.get("AZURE_OPENAI_CHAT_MODEL", "")
 API_VERSION: str | None = os.getenv("AZURE_OPENAI_CHAT_API_VERSION")
 # LOCATION: str | None = os.getenv("AZURE_OPENAI_LOCATION")
+TOKENS_PER_MINUTE: int = int(os.environ.get("AZURE_OPENAI_CHAT_TPM", "0"))
+REQUESTS_PER_MINUTE: int = int(os.environ.get("AZURE_OPENAI_CHAT_RPM", "0"))
+
+LIMITER: RateLimiter = RateLimiter(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
 
 
+@METRICS.timed("gpt.save")
 def save(fpath: str, value: str) -> None:
     """Saves a string to a specified file.
 
@@ -37,6 +54,93 @@ def save(fpath: str, value: str) -> None:
         ff.write(value)
 
 
+def _header_int(headers: Mapping[str, str], key: str) -> int | None:
+    value = headers.get(key)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def client() -> AzureOpenAI:
+    """Returns the client of the Azure OpenAI Service.
+
+    The client is created once per process, so the SDK is imported and
+    the connection is opened only by the first call of `chat_messages`.
+    """
+    from openai import AzureOpenAI  # pylint: disable=import-outside-toplevel
+    return AzureOpenAI(
+        api_key=ENDPOINT_KEY,
+        api_version=API_VERSION,
+        azure_endpoint=ENDPOINT_BASE,
+        max_retries=0
+    )
+
+
+@METRICS.timed("gpt.chat_messages")
+def chat_messages(
+    messages: List[ChatCompletionMessageParam], max_tokens: int = MAX_TOKENS
+) -> ChatCompletion:
+    """Sends messages to the Azure OpenAI Chat Completions API under `LIMITER`.
+
+    The estimated prompt tokens plus `max_tokens` are reserved before the call
+    and corrected from the `usage` field of the response. A 429 response pauses
+    every caller sharing `LIMITER` for the time given by `retry-after-ms`.
+    The call is sent through `EXECUTOR`, which retries throttled and failed
+    calls up to `MAX_RETRIES` times.
+
+    Args:
+        messages (list of dict): The chat messages to send.
+        max_tokens (int, optional): The maximum number of tokens to generate
+                                    in the response. Defaults to MAX_TOKENS.
+
+    Returns:
+        ChatCompletion: The response of the service.
+
+    Raises:
+        openai.RateLimitError: If the service is still throttling after the retries.
+        Exception: If there is an error communicating with the Azure OpenAI service.
+    """
+    from openai import RateLimitError  # pylint: disable=import-outside-toplevel
+    prompt_tokens: int = estimate_prompt_tokens(messages)
+    METRICS.inc(
+        "upload_bytes_total",
+        sum(len(str(message.get("content") or "").encode("utf-8")) for message in messages),
+        function="gpt.chat_messages"
+    )
+
+    def attempt() -> ChatCompletion:
+        reservation = LIMITER.reserve(prompt_tokens + max_tokens)
+        try:
+            raw = client().chat.completions.with_raw_response.create(
+                messages=messages, model=MODEL, max_tokens=max_tokens
+            )
+        except RateLimitError as ex:
+            LIMITER.cancel(reservation)
+            wait: float | None = retry_after_sec(ex.response.headers)
+            LIMITER.pause(wait if wait is not None else WAIT_TIME_SEC)
+            raise
+        except BaseException:
+            LIMITER.cancel(reservation)
+            raise
+        response: ChatCompletion = raw.parse()
+        LIMITER.settle(
+            reservation,
+            response.usage.total_tokens if response.usage is not None else None
+        )
+        LIMITER.observe_remaining(
+            _header_int(raw.headers, "x-ratelimit-remaining-tokens"),
+            _header_int(raw.headers, "x-ratelimit-remaining-requests")
+        )
+        return response
+
+    return EXECUTOR.call(ENDPOINT_BASE, attempt, MAX_RETRIES)
+
+
+@METRICS.timed("gpt.chat")
 def chat(query: str, max_tokens: int = MAX_TOKENS) -> str | None:
     """Sends a message to the Azure OpenAI Chat Completions API
     and returns the generated response.
@@ -57,28 +161,31 @@ def chat(query: str, max_tokens: int = MAX_TOKENS) -> str | None:
     It constructs a message object with the role 'user' and the given content,
     and then sends it to the API.
     The `max_tokens` parameter controls the length of the generated response.
+    The call is throttled by `LIMITER` (see `chat_messages`), so `chat` can be
+    called from many threads at once.
     """
     message: ChatCompletionMessageParam = {'role': 'user', 'content': query}
-    client: AzureOpenAI = AzureOpenAI(
-        api_key=ENDPOINT_KEY,
-        api_version=API_VERSION,
-        azure_endpoint=ENDPOINT_BASE
-    )
-    response: ChatCompletion = client.chat.completions.create(
-        messages=[message], model=MODEL, max_tokens=max_tokens
-    )
+    response: ChatCompletion = chat_messages([message], max_tokens)
     return response.choices[0].message.content
 
 
-def main(message: str, dst: str = "", max_tokens: int = MAX_TOKENS) -> None:
+def main(
+    message: str, dst: str = "", max_tokens: int = MAX_TOKENS,
+    output_mode: str = "file"
+) -> None:
     """main"""
     print("chat test starts.")
     content = chat(message, max_tokens)
     if content is None:
         warnings.warn("No content returned. finish.")
         return
+    now: str = datetime.now().strftime(DATETIME_FORMAT)
+    if output_mode == "log":
+        with ResultLog(dst or os.path.join(DEFAULT_OUTPUT_DIRPATH, LOG_DIRNAME)) as log:
+            log.write({"datetime": now, "query": message, "content": content})
+        print("finished.")
+        return
     if not dst:
-        now: str = datetime.now().strftime(DATETIME_FORMAT)
         dst = os.path.join(DEFAULT_OUTPUT_DIRPATH, f"{now}_result.txt")
     if not os.path.exists(os.path.dirname(dst)):
         os.makedirs(os.path.dirname(dst))
@@ -94,7 +201,11 @@ if __name__ == "__main__":
         "--dst", dest="dst", type=str, default=""
     )
     parser.add_argument(
-        "--max_tokens", dest="max_tokens", type=str, default=MAX_TOKENS
+        "--max_tokens", dest="max_tokens", type=int, default=MAX_TOKENS
+    )
+    parser.add_argument(
+        "--output_mode", dest="output_mode", type=str, default="file",
+        choices=OUTPUT_MODES
     )
     args = parser.parse_args()
-    main(args.query, args.dst, args.max_tokens)
+    main(args.query, args.dst, args.max_tokens, args.output_mode)
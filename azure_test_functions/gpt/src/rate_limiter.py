@@ -0,0 +1,247 @@
+"""rate_limiter.py
+
+Token- and request-budget rate limiter for Azure OpenAI deployments.
+"""
+
+from dataclasses import dataclass
+import math
+import threading
+import time
+from typing import Any, Callable, Iterable, Mapping
+
+MESSAGE_OVERHEAD_TOKENS: int = 4
+REPLY_PRIMING_TOKENS: int = 3
+ASCII_CHARS_PER_TOKEN: float = 4.0
+HEADROOM_DEFAULT: float = 0.9
+BURST_SEC_DEFAULT: float = 10.0
+
+_ENCODER: Callable[[str], int] | None = None
+_ENCODER_LOADED: bool = False
+
+
+def _load_encoder() -> Callable[[str], int] | None:
+    """Loads a `tiktoken` encoder if the package is installed.
+
+    Returns:
+        callable or None: A function counting the tokens of a string,
+        or None if `tiktoken` or its encoding data is not available.
+    """
+    global _ENCODER, _ENCODER_LOADED  # pylint: disable=global-statement
+    if _ENCODER_LOADED:
+        return _ENCODER
+    _ENCODER_LOADED = True
+    try:
+        import tiktoken  # type: ignore[import-not-found, unused-ignore]  # pylint: disable=import-outside-toplevel
+        encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:  # pylint: disable=broad-exception-caught
+        return None
+
+    def count(text: str) -> int:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    _ENCODER = count
+    return _ENCODER
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text without calling the service.
+
+    `tiktoken` is used if it is installed. Otherwise, a heuristic is used:
+    ASCII characters count as a quarter token each and the other characters
+    (e.g. Japanese) count as one token each, which slightly overestimates
+    the usual tokenizers.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    encoder = _load_encoder()
+    if encoder is not None:
+        return encoder(text)
+    n_ascii: int = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(n_ascii / ASCII_CHARS_PER_TOKEN) + len(text) - n_ascii
+
+
+def estimate_prompt_tokens(messages: Iterable[Mapping[str, Any]]) -> int:
+    """Estimates the number of prompt tokens of chat messages.
+
+    Args:
+        messages (iterable of dict): Chat messages with 'role' and 'content'.
+
+    Returns:
+        int: The estimated number of prompt tokens.
+    """
+    n_tokens: int = REPLY_PRIMING_TOKENS
+    for message in messages:
+        n_tokens += MESSAGE_OVERHEAD_TOKENS
+        for value in message.values():
+            if isinstance(value, str):
+                n_tokens += estimate_text_tokens(value)
+    return n_tokens
+
+
+@dataclass
+class Reservation:
+    """Budget reserved for one request."""
+    tokens: int
+    settled: bool = False
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `limit` per minute."""
+
+    def __init__(self, limit: float, burst_sec: float) -> None:
+        self.rate: float = limit / 60.0
+        self.capacity: float = max(self.rate * burst_sec, 1.0)
+        self.level: float = self.capacity
+        self.updated: float = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait_sec(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """Thread-safe limiter for tokens-per-minute and requests-per-minute quotas.
+
+    Each call reserves its estimated prompt tokens plus `max_tokens` before
+    it is sent, and the reservation is corrected from the `usage` field of the
+    response afterwards. Both budgets are refilled continuously and allow
+    bursts of only `burst_sec` seconds worth of quota, because the service
+    evaluates the limits over short windows rather than over a whole minute.
+
+    Args:
+        tokens_per_minute (int): The TPM quota of the deployment. 0 disables the limit.
+        requests_per_minute (int): The RPM quota of the deployment. 0 disables the limit.
+        headroom (float, optional): The fraction of the quotas to use.
+            Defaults to HEADROOM_DEFAULT.
+        burst_sec (float, optional): The seconds of quota allowed in a burst.
+            Defaults to BURST_SEC_DEFAULT.
+    """
+
+    def __init__(
+        self, tokens_per_minute: int = 0, requests_per_minute: int = 0,
+        headroom: float = HEADROOM_DEFAULT, burst_sec: float = BURST_SEC_DEFAULT
+    ) -> None:
+        self._cond = threading.Condition()
+        self._tokens: _Bucket | None = None
+        self._requests: _Bucket | None = None
+        if tokens_per_minute > 0:
+            self._tokens = _Bucket(tokens_per_minute * headroom, burst_sec)
+        if requests_per_minute > 0:
+            self._requests = _Bucket(requests_per_minute * headroom, burst_sec)
+        self._paused_until: float = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """True if any of the limits is set."""
+        return self._tokens is not None or self._requests is not None
+
+    def _wait_sec(self, tokens: int, now: float) -> float:
+        wait: float = self._paused_until - now
+        for bucket, amount in ((self._tokens, tokens), (self._requests, 1)):
+            if bucket is None:
+                continue
+            bucket.refill(now)
+            wait = max(wait, bucket.wait_sec(amount))
+        return wait
+
+    def reserve(self, tokens: int) -> Reservation:
+        """Blocks until both budgets allow a request and reserves them.
+
+        Args:
+            tokens (int): The tokens to reserve, i.e. the estimated prompt
+                tokens plus `max_tokens`.
+
+        Returns:
+            Reservation: The reserved budget to settle after the request.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_sec(tokens, now)
+                if wait <= 0.0:
+                    break
+                self._cond.wait(wait)
+            if self._tokens is not None:
+                self._tokens.level -= tokens
+            if self._requests is not None:
+                self._requests.level -= 1
+        return Reservation(tokens)
+
+    def settle(self, reservation: Reservation, used_tokens: int | None) -> None:
+        """Corrects a reservation with the tokens the service actually counted.
+
+        Args:
+            reservation (Reservation): The reservation returned by `reserve`.
+            used_tokens (int or None): `usage.total_tokens` of the response.
+                The reservation is kept as it is if None.
+        """
+        with self._cond:
+            if reservation.settled:
+                return
+            reservation.settled = True
+            if self._tokens is None or used_tokens is None:
+                return
+            self._tokens.level = min(
+                self._tokens.capacity,
+                self._tokens.level + reservation.tokens - used_tokens
+            )
+            self._cond.notify_all()
+
+    def cancel(self, reservation: Reservation) -> None:
+        """Returns the tokens of a request rejected before being processed.
+
+        The request itself is still counted against the request budget.
+
+        Args:
+            reservation (Reservation): The reservation returned by `reserve`.
+        """
+        self.settle(reservation, 0)
+
+    def pause(self, seconds: float | None) -> None:
+        """Stops all reservations for a while, e.g. after a 429 response.
+
+        Args:
+            seconds (float or None): The seconds to wait, typically taken from
+                `retry-after-ms`. Nothing is done if None.
+        """
+        if not seconds:
+            return
+        with self._cond:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + seconds
+            )
+
+    def observe_remaining(
+        self, remaining_tokens: int | None, remaining_requests: int | None
+    ) -> None:
+        """Lowers the local budgets to the remaining quota reported by the service.
+
+        Other clients sharing the deployment consume the same quota,
+        so `x-ratelimit-remaining-*` headers are used to catch up with them.
+
+        Args:
+            remaining_tokens (int or None): `x-ratelimit-remaining-tokens`.
+            remaining_requests (int or None): `x-ratelimit-remaining-requests`.
+        """
+        with self._cond:
+            now = time.monotonic()
+            for bucket, remaining in (
+                (self._tokens, remaining_tokens),
+                (self._requests, remaining_requests)
+            ):
+                if bucket is None or remaining is None:
+                    continue
+                bucket.refill(now)
+                bucket.level = min(bucket.level, float(remaining))
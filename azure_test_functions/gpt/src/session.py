@@ -0,0 +1,285 @@
+"""session.py
+
+Multi-turn chat sessions on top of `chat_messages`.
+
+A `ChatSession` keeps the history of a conversation and sends it with each
+new message, laid out as
+
+    [system prompt] [summary of the compacted turns] [turns...] [new message]
+
+The turns are only appended to, so between two compactions the prompt of a
+turn starts with the whole prompt of the previous turn, and the service can
+reuse its cached prefix (Azure OpenAI caches prompts from 1,024 tokens),
+which cuts the latency and the price of the prompt tokens.
+
+The prompt is kept under `budget_tokens`:
+    * once the history reaches `SUMMARIZE_RATIO` of the budget, the oldest
+      turns but the last `keep_turns` are summarized in a background thread,
+      and the summary replaces them at the next message after it is ready,
+    * if the next message would exceed the budget, the summary is waited for,
+      and the oldest turns are dropped down to `SUMMARIZE_RATIO` of the budget
+      if it is still exceeded or with `compaction="truncate"`,
+    * if the summarization fails, the turns are kept until the budget is
+      exceeded, and the summary is tried again after `keep_turns` more turns.
+Compacting many turns at once, rather than one turn per message, keeps the
+prefix unchanged for as many turns as possible.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+import warnings
+from ...common.src.metrics import METRICS
+from .main import MAX_TOKENS, chat, chat_messages
+from .rate_limiter import REPLY_PRIMING_TOKENS, estimate_prompt_tokens
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+
+PROMPT_BUDGET_TOKENS: int = 8000
+SUMMARIZE_RATIO: float = 0.75
+KEEP_TURNS: int = 4
+SUMMARY_MAX_TOKENS: int = 500
+COMPACTION_SUMMARIZE: str = "summarize"
+COMPACTION_TRUNCATE: str = "truncate"
+COMPACTIONS: List[str] = [COMPACTION_SUMMARIZE, COMPACTION_TRUNCATE]
+SUMMARY_PROMPT: str = (
+    "Summarize the following conversation between a user and an assistant "
+    "so that the assistant can continue it. Keep facts, names, numbers, "
+    "decisions and open questions.\n\n"
+)
+SUMMARY_HEADER: str = "Summary of the earlier conversation:\n"
+
+
+def _message_tokens(message: ChatCompletionMessageParam) -> int:
+    return estimate_prompt_tokens([message]) - REPLY_PRIMING_TOKENS
+
+
+class ChatSession:
+    """A conversation with the Azure OpenAI Chat Completions API.
+
+    The token counts of the messages are estimated once when they are added,
+    so the budget is checked without estimating the whole history again.
+
+    Args:
+        system (str, optional): The system prompt, sent first in every prompt.
+        budget_tokens (int, optional): The maximum estimated tokens of a prompt.
+            Defaults to PROMPT_BUDGET_TOKENS.
+        max_tokens (int, optional): The maximum tokens of a reply. Defaults to MAX_TOKENS.
+        keep_turns (int, optional): The number of the latest turns never summarized.
+            Defaults to KEEP_TURNS.
+        compaction (str, optional): `summarize` to summarize the old turns, or
+            `truncate` to drop them. Defaults to `summarize`.
+        summary_max_tokens (int, optional): The maximum tokens of the summary.
+            Defaults to SUMMARY_MAX_TOKENS.
+
+    Raises:
+        ValueError: If `compaction` is not one of COMPACTIONS.
+    """
+
+    def __init__(
+        self, system: str | None = None, budget_tokens: int = PROMPT_BUDGET_TOKENS,
+        max_tokens: int = MAX_TOKENS, keep_turns: int = KEEP_TURNS,
+        compaction: str = COMPACTION_SUMMARIZE, summary_max_tokens: int = SUMMARY_MAX_TOKENS
+    ) -> None:
+        if compaction not in COMPACTIONS:
+            raise ValueError(f"'compaction' must be one of {COMPACTIONS}.")
+        self.system: str | None = system
+        self.budget_tokens: int = budget_tokens
+        self.max_tokens: int = max_tokens
+        self.keep_turns: int = keep_turns
+        self.compaction: str = compaction
+        self.summary_max_tokens: int = summary_max_tokens
+        self.summary: str | None = None
+        self.last_prompt_tokens: int | None = None
+        self.stats: Dict[str, int] = {
+            "turns": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+            "summarized_turns": 0, "dropped_turns": 0
+        }
+        self._turns: List[Tuple[List[ChatCompletionMessageParam], int]] = []
+        self._turn_tokens: int = 0
+        self._prefix: List[ChatCompletionMessageParam] = []
+        self._prefix_tokens: int = 0
+        self._summarizing: Tuple[int, "Future[str | None]"] | None = None
+        self._summary_retry_turn: int = 0
+        self._executor: ThreadPoolExecutor | None = None
+        self._update_prefix()
+
+    def __enter__(self) -> "ChatSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops the summarization in the background, if any."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._summarizing = None
+
+    @property
+    def prompt_tokens(self) -> int:
+        """The estimated tokens of the history sent with the next message."""
+        return REPLY_PRIMING_TOKENS + self._prefix_tokens + self._turn_tokens
+
+    def messages(self) -> List[ChatCompletionMessageParam]:
+        """Returns the history sent before the next message."""
+        return self._prefix + [message for turn, _ in self._turns for message in turn]
+
+    def send(self, content: str, max_tokens: int | None = None) -> str | None:
+        """Sends a message with the history and returns the reply.
+
+        Args:
+            content (str): The message of the user.
+            max_tokens (int, optional): The maximum tokens of the reply.
+                Defaults to the `max_tokens` of the session.
+
+        Returns:
+            str: The reply, or None if no content is returned, in which case
+            the message is not added to the history.
+
+        Raises:
+            Exception: If there is an error communicating with the Azure OpenAI service.
+        """
+        message: ChatCompletionMessageParam = {"role": "user", "content": content}
+        message_tokens: int = _message_tokens(message)
+        self._compact(message_tokens)
+        response: ChatCompletion = chat_messages(
+            self.messages() + [message], self.max_tokens if max_tokens is None else max_tokens
+        )
+        self._record(response)
+        reply: str | None = response.choices[0].message.content
+        if reply is None:
+            return None
+        answer: ChatCompletionMessageParam = {"role": "assistant", "content": reply}
+        tokens: int = message_tokens + _message_tokens(answer)
+        self._turns.append(([message, answer], tokens))
+        self._turn_tokens += tokens
+        self.stats["turns"] += 1
+        self._start_summary()
+        return reply
+
+    def _update_prefix(self) -> None:
+        self._prefix = []
+        if self.system:
+            self._prefix.append({"role": "system", "content": self.system})
+        if self.summary:
+            self._prefix.append({"role": "system", "content": SUMMARY_HEADER + self.summary})
+        self._prefix_tokens = sum(_message_tokens(message) for message in self._prefix)
+
+    def _drop(self, n_turns: int) -> None:
+        self._turn_tokens -= sum(tokens for _, tokens in self._turns[:n_turns])
+        del self._turns[:n_turns]
+
+    def _compact(self, message_tokens: int) -> None:
+        self._apply_summary(wait=False)
+        if self.prompt_tokens + message_tokens <= self.budget_tokens:
+            return
+        self._apply_summary(wait=True)
+        tokens: int = self.prompt_tokens + message_tokens
+        n_dropped: int = 0
+        while n_dropped < len(self._turns) and tokens > self.budget_tokens * SUMMARIZE_RATIO:
+            tokens -= self._turns[n_dropped][1]
+            n_dropped += 1
+        self._drop(n_dropped)
+        self.stats["dropped_turns"] += n_dropped
+
+    def _start_summary(self) -> None:
+        if self.compaction != COMPACTION_SUMMARIZE or self._summarizing is not None:
+            return
+        if self.stats["turns"] < self._summary_retry_turn:
+            return
+        if self.prompt_tokens < self.budget_tokens * SUMMARIZE_RATIO:
+            return
+        n_turns: int = len(self._turns) - self.keep_turns
+        if n_turns <= 0:
+            return
+        transcript: str = "\n\n".join(
+            f"{message['role']}: {message.get('content')}"
+            for turn, _ in self._turns[:n_turns] for message in turn
+        )
+        if self.summary:
+            transcript = f"{SUMMARY_HEADER}{self.summary}\n\n{transcript}"
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._summarizing = (
+            n_turns,
+            self._executor.submit(chat, SUMMARY_PROMPT + transcript, self.summary_max_tokens)
+        )
+
+    def _apply_summary(self, wait: bool) -> None:
+        if self._summarizing is None:
+            return
+        n_turns, future = self._summarizing
+        if not wait and not future.done():
+            return
+        self._summarizing = None
+        try:
+            summary: str | None = future.result()
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            self._summary_retry_turn = self.stats["turns"] + max(self.keep_turns, 1)
+            warnings.warn(
+                f"failure in summarization: {ex!r}. keep the old turns "
+                f"and retry after turn {self._summary_retry_turn}."
+            )
+            return
+        if not summary:
+            self._summary_retry_turn = self.stats["turns"] + max(self.keep_turns, 1)
+            return
+        self.summary = summary
+        self._update_prefix()
+        self._drop(n_turns)
+        self.stats["summarized_turns"] += n_turns
+
+    def _record(self, response: ChatCompletion) -> None:
+        usage = response.usage
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens: int = getattr(details, "cached_tokens", None) or 0
+        self.last_prompt_tokens = usage.prompt_tokens
+        self.stats["prompt_tokens"] += usage.prompt_tokens
+        self.stats["cached_tokens"] += cached_tokens
+        self.stats["completion_tokens"] += usage.completion_tokens
+        METRICS.inc("prompt_tokens_total", usage.prompt_tokens, function="gpt.session")
+        METRICS.inc("cached_prompt_tokens_total", cached_tokens, function="gpt.session")
+
+
+def main(
+    system: str | None = None, budget_tokens: int = PROMPT_BUDGET_TOKENS,
+    max_tokens: int = MAX_TOKENS, compaction: str = COMPACTION_SUMMARIZE
+) -> None:
+    """Chats in a session with the messages read from the standard input
+    until an empty line or the end of the input."""
+    with ChatSession(system, budget_tokens, max_tokens, compaction=compaction) as session:
+        while True:
+            try:
+                query: str = input("> ")
+            except EOFError:
+                break
+            if not query.strip():
+                break
+            reply: str | None = session.send(query)
+            print(reply if reply is not None else "(no content returned)")
+        print(", ".join(f"{key}: {value}" for key, value in session.stats.items()))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--system", dest="system", type=str, default=None
+    )
+    parser.add_argument(
+        "--budget_tokens", dest="budget_tokens", type=int, default=PROMPT_BUDGET_TOKENS
+    )
+    parser.add_argument(
+        "--max_tokens", dest="max_tokens", type=int, default=MAX_TOKENS
+    )
+    parser.add_argument(
+        "--compaction", dest="compaction", type=str, default=COMPACTION_SUMMARIZE,
+        choices=COMPACTIONS
+    )
+    args = parser.parse_args()
+    main(args.system, args.budget_tokens, args.max_tokens, args.compaction)
@@ -0,0 +1,291 @@
+"""summarize.py
+
+Map-reduce summarization of long texts, e.g. merged transcripts and OCR texts.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import re
+from typing import List
+from .main import chat, save, MODEL
+from .rate_limiter import estimate_text_tokens
+
+CHUNK_TOKENS: int = 3000
+MIN_CHUNK_TOKENS: int = 1000
+BOUNDARY_DIVISOR: int = 4
+SUMMARY_MAX_TOKENS: int = 500
+MAX_WORKERS: int = 4
+DEFAULT_OUTPUT_DIRNAME: str = "summarized"
+DEFAULT_CACHE_DIRNAME: str = ".summary_cache"
+MAP_PROMPT: str = (
+    "Summarize the following part of a long document. "
+    "Keep names, numbers and conclusions.\n\n"
+)
+REDUCE_PROMPT: str = (
+    "The following texts are summaries of consecutive parts of a long document. "
+    "Combine them into a single coherent summary.\n\n"
+)
+PARTIAL_SEPARATOR: str = "\n\n"
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _split_oversized(text: str, max_tokens: int) -> List[str]:
+    """Splits a paragraph longer than `max_tokens` into lines or fixed windows."""
+    if estimate_text_tokens(text) <= max_tokens:
+        return [text]
+    lines: List[str] = [line for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        units: List[str] = []
+        for line in lines:
+            units.extend(_split_oversized(line, max_tokens))
+        return units
+    sentences: List[str] = [
+        ss for ss in re.split(r"(?<=[.!?。！？])\s*", text) if ss
+    ]
+    if len(sentences) > 1:
+        pieces: List[str] = []
+        for sentence in sentences:
+            pieces.extend(_split_oversized(sentence, max_tokens))
+        return split_into_chunks(pieces, max_tokens, max_tokens // 2, " ")
+    n_tokens: int = estimate_text_tokens(text)
+    width: int = max(len(text) * max_tokens // n_tokens, 1)
+    return [text[ii:ii + width] for ii in range(0, len(text), width)]
+
+
+def split_into_chunks(
+    units: List[str], max_tokens: int = CHUNK_TOKENS,
+    min_tokens: int = MIN_CHUNK_TOKENS, separator: str = PARTIAL_SEPARATOR
+) -> List[str]:
+    """Packs consecutive units (paragraphs or partial summaries) into token-bounded chunks.
+
+    A chunk is closed after a unit whose hash is divisible by `BOUNDARY_DIVISOR`
+    once it holds `min_tokens`, or before it would exceed `max_tokens`.
+    Because the boundaries depend on the contents of the units rather than on
+    their positions, an edit in one place changes only the chunks around it
+    and the other chunks are found in the cache on the next run.
+
+    Args:
+        units (list of str): The units to pack, in order.
+        max_tokens (int, optional): The maximum tokens of a chunk. Defaults to CHUNK_TOKENS.
+        min_tokens (int, optional): The minimum tokens of a chunk closed at
+            a content-defined boundary. Defaults to MIN_CHUNK_TOKENS.
+        separator (str, optional): The string to join units with.
+            Defaults to PARTIAL_SEPARATOR.
+
+    Returns:
+        list of str: The chunks.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens: int = 0
+    for unit in units:
+        unit_tokens: int = estimate_text_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+        if current_tokens >= min_tokens and int(_hash(unit)[:8], 16) % BOUNDARY_DIVISOR == 0:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_text(text: str, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """Splits a text into token-bounded chunks at paragraph boundaries.
+
+    Args:
+        text (str): The text to split.
+        max_tokens (int, optional): The maximum tokens of a chunk. Defaults to CHUNK_TOKENS.
+
+    Returns:
+        list of str: The chunks.
+    """
+    units: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if paragraph.strip():
+            units.extend(_split_oversized(paragraph.strip(), max_tokens))
+    return split_into_chunks(units, max_tokens, min(MIN_CHUNK_TOKENS, max_tokens // 2))
+
+
+class SummaryCache:
+    """On-disk cache of summaries keyed by the model, the prompt and the input text.
+
+    Args:
+        dirpath (str or None): The directory to store the summaries in.
+            Nothing is cached if None.
+    """
+
+    def __init__(self, dirpath: str | None) -> None:
+        self.dirpath: str | None = dirpath
+        if dirpath is not None and not os.path.exists(dirpath):
+            os.makedirs(dirpath, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        assert self.dirpath is not None
+        return os.path.join(self.dirpath, f"{key}.txt")
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached summary, or None if it is not cached."""
+        if self.dirpath is None or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), "r", encoding="utf-8") as ff:
+            return ff.read()
+
+    def put(self, key: str, value: str) -> None:
+        """Stores a summary atomically."""
+        if self.dirpath is None:
+            return
+        tmppath: str = f"{self._path(key)}.{os.getpid()}.tmp"
+        save(tmppath, value)
+        os.replace(tmppath, self._path(key))
+
+
+def summarize_chunk(
+    prompt: str, text: str, max_tokens: int = SUMMARY_MAX_TOKENS,
+    cache: SummaryCache | None = None
+) -> str:
+    """Summarizes one chunk with `chat`, or returns its cached summary.
+
+    Args:
+        prompt (str): The instruction put before the text.
+        text (str): The text to summarize.
+        max_tokens (int, optional): The maximum tokens of the summary.
+            Defaults to SUMMARY_MAX_TOKENS.
+        cache (SummaryCache, optional): The cache of summaries.
+
+    Returns:
+        str: The summary.
+
+    Raises:
+        ValueError: If no content is returned.
+    """
+    key: str = _hash(f"{MODEL}\0{max_tokens}\0{prompt}\0{text}")
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    summary = chat(f"{prompt}{text}", max_tokens)
+    if summary is None:
+        raise ValueError("failure in summarization.")
+    if cache is not None:
+        cache.put(key, summary)
+    return summary
+
+
+def summarize(
+    text: str, max_tokens: int = SUMMARY_MAX_TOKENS,
+    chunk_tokens: int = CHUNK_TOKENS, max_workers: int = MAX_WORKERS,
+    cache_dir: str | None = None
+) -> str:
+    """Summarizes a long text by map-reduce.
+
+    The text is split into chunks of at most `chunk_tokens` tokens and
+    the chunks are summarized concurrently (map). The partial summaries are
+    packed into chunks again and summarized until only one remains (reduce).
+    Every intermediate summary is cached in `cache_dir`, so re-running after
+    a small edit only sends the changed chunks and the reductions above them.
+
+    Args:
+        text (str): The text to summarize.
+        max_tokens (int, optional): The maximum tokens of each summary.
+            Defaults to SUMMARY_MAX_TOKENS.
+        chunk_tokens (int, optional): The maximum tokens of each chunk.
+            Defaults to CHUNK_TOKENS.
+        max_workers (int, optional): The number of concurrent calls. Defaults to MAX_WORKERS.
+        cache_dir (str, optional): The directory to cache summaries in.
+
+    Returns:
+        str: The summary.
+
+    Raises:
+        ValueError: If `chunk_tokens` is not larger than twice `max_tokens`.
+    """
+    if chunk_tokens <= 2 * max_tokens:
+        raise ValueError("'chunk_tokens' must be larger than twice 'max_tokens'.")
+    cache = SummaryCache(cache_dir)
+
+    def run(prompt: str, chunks: List[str], executor: ThreadPoolExecutor) -> List[str]:
+        def func(chunk: str) -> str:
+            return summarize_chunk(prompt, chunk, max_tokens, cache)
+        return list(executor.map(func, chunks))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunks: List[str] = split_text(text, chunk_tokens)
+        print(f"# of chunks: {len(chunks)}")
+        partials: List[str] = run(MAP_PROMPT, chunks, executor)
+        while len(partials) > 1:
+            groups: List[str] = split_into_chunks(
+                partials, chunk_tokens, chunk_tokens // 2
+            )
+            if len(groups) == len(partials):
+                groups = [
+                    PARTIAL_SEPARATOR.join(partials[ii:ii + 2])
+                    for ii in range(0, len(partials), 2)
+                ]
+            print(f"reduce {len(partials)} summaries into {len(groups)}...")
+            partials = run(REDUCE_PROMPT, groups, executor)
+    return partials[0] if partials else ""
+
+
+def main(
+    fpath: str, dst: str | None = None, max_tokens: int = SUMMARY_MAX_TOKENS,
+    chunk_tokens: int = CHUNK_TOKENS, max_workers: int = MAX_WORKERS
+) -> None:
+    """Summarizes a text file, e.g. `transcript_merged.txt` or a text of `merge_texts`.
+
+    Args:
+        fpath (str): The path to the text file.
+        dst (str, optional): The file path to save the summary in.
+            Defaults to a file in a subdirectory `DEFAULT_OUTPUT_DIRNAME`.
+        max_tokens (int, optional): The maximum tokens of each summary.
+        chunk_tokens (int, optional): The maximum tokens of each chunk.
+        max_workers (int, optional): The number of concurrent calls.
+
+    Raises:
+        ValueError: If `fpath` is not a file path.
+    """
+    if not os.path.isfile(fpath):
+        raise ValueError("'fpath' must be a file path.")
+    dstdir: str = os.path.join(os.path.dirname(fpath), DEFAULT_OUTPUT_DIRNAME)
+    if not os.path.exists(dstdir):
+        os.makedirs(dstdir)
+    if not dst:
+        dst = os.path.join(
+            dstdir, os.path.splitext(os.path.basename(fpath))[0] + "_summary.txt"
+        )
+    with open(fpath, "r", encoding="utf-8") as ff:
+        text: str = ff.read()
+    print("summarize...")
+    summary: str = summarize(
+        text, max_tokens, chunk_tokens, max_workers,
+        os.path.join(dstdir, DEFAULT_CACHE_DIRNAME)
+    )
+    save(dst, summary)
+    print("done.")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str)
+    parser.add_argument(
+        "--dst", dest="dst", type=str, default=None
+    )
+    parser.add_argument(
+        "--max_tokens", dest="max_tokens", type=int, default=SUMMARY_MAX_TOKENS
+    )
+    parser.add_argument(
+        "--chunk_tokens", dest="chunk_tokens", type=int, default=CHUNK_TOKENS
+    )
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=MAX_WORKERS
+    )
+    args = parser.parse_args()
+    main(args.src, args.dst, args.max_tokens, args.chunk_tokens, args.workers)
@@ -1,4 +1,16 @@
 """ocr"""
 
-from .src import main as ocr
-from .src import merge_texts as ocr_merge_texts
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import dedup as ocr_dedup
+    from .src import main as ocr
+    from .src import merge_texts as ocr_merge_texts
+
+__all__ = ["ocr", "ocr_dedup", "ocr_merge_texts"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "ocr": ".src.main",
+    "ocr_dedup": ".src.dedup",
+    "ocr_merge_texts": ".src.merge_texts"
+}, fallback=".src.main")
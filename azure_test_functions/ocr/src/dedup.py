@@ -0,0 +1,252 @@
+"""dedup.py
+
+Near-duplicate detection of images before OCR.
+
+Re-scans and burst photos of the same page differ in their bytes but not in
+their perceptual hashes: the signs of the lowest frequencies of the DCT of a
+32x32 grayscale thumbnail (pHash, 64 bits). Two images whose hashes differ in
+at most a few bits show the same page, so the result of the first one can be
+reused for the others. The hashes of the analyzed images are kept in a
+`HashIndex` in the output directory, so duplicates of the images of previous
+runs are found as well.
+
+Decoding the images requires `Pillow`.
+"""
+
+import importlib
+import os
+import sqlite3
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import numpy.typing as npt
+from ...common.src.scanner import IMAGE_EXTENSIONS, scan
+
+HASH_INDEX_FILENAME: str = "hashes.sqlite3"
+HASH_SIZE: int = 8
+THUMBNAIL_SIZE: int = 32
+THRESHOLD: int = 4
+BATCH_SIZE: int = 1024
+
+
+def _dct_matrix(size: int) -> npt.NDArray[np.float64]:
+    k = np.arange(size)[:, np.newaxis]
+    n = np.arange(size)[np.newaxis, :]
+    matrix: npt.NDArray[np.float64] = (
+        np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    )
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT: npt.NDArray[np.float64] = _dct_matrix(THUMBNAIL_SIZE)[:HASH_SIZE]
+
+
+def require_pillow() -> Any:
+    """Returns `PIL.Image`.
+
+    Raises:
+        ImportError: If `Pillow` is not installed.
+    """
+    try:
+        return importlib.import_module("PIL.Image")
+    except ImportError as ex:
+        raise ImportError("'pillow' is required to find duplicates: pip install pillow") from ex
+
+
+def thumbnail(fpath: str) -> npt.NDArray[np.float32]:
+    """Returns the grayscale THUMBNAIL_SIZE x THUMBNAIL_SIZE thumbnail of an image.
+
+    A JPEG is decoded at a reduced scale, which is much faster than decoding it fully.
+
+    Raises:
+        ImportError: If `Pillow` is not installed.
+    """
+    image_module: Any = require_pillow()
+    with image_module.open(fpath) as image:
+        image.draft("L", (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+        small = image.convert("L").resize(
+            (THUMBNAIL_SIZE, THUMBNAIL_SIZE), image_module.Resampling.BOX
+        )
+        return np.asarray(small, dtype=np.float32)
+
+
+def phash_arrays(thumbnails: npt.NDArray[np.float32]) -> npt.NDArray[np.uint64]:
+    """Returns the perceptual hashes of a stack of thumbnails at once.
+
+    Args:
+        thumbnails (numpy.ndarray): An array of shape (n, THUMBNAIL_SIZE, THUMBNAIL_SIZE).
+
+    Returns:
+        numpy.ndarray: The hashes, an array of shape (n,).
+    """
+    low: npt.NDArray[np.float64] = np.einsum(
+        "ki,nij,lj->nkl", _DCT, thumbnails.astype(np.float64), _DCT
+    ).reshape(len(thumbnails), -1)
+    bits = low > np.median(low, axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view(">u8").astype(np.uint64).ravel()
+
+
+def phash(fpath: str) -> int:
+    """Returns the 64-bit perceptual hash of an image."""
+    return int(phash_arrays(thumbnail(fpath)[np.newaxis])[0])
+
+
+def hamming(hashes: npt.NDArray[np.uint64], value: int) -> npt.NDArray[np.uint8]:
+    """Returns the Hamming distances between hashes and a hash."""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    distances: npt.NDArray[np.uint8]
+    if hasattr(np, "bitwise_count"):
+        distances = np.bitwise_count(xor).astype(np.uint8)
+    else:
+        distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1, dtype=np.uint8)
+    return distances
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class HashIndex:
+    """Persistent index of the perceptual hashes of analyzed images.
+
+    The hashes are held in a NumPy array, grown by doubling its capacity,
+    so one lookup compares a hash with every hash in the index at once.
+
+    Args:
+        fpath (str): The path of the database, e.g. `<output_dir>/hashes.sqlite3`.
+    """
+
+    def __init__(self, fpath: str) -> None:
+        dirpath: str = os.path.dirname(fpath)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self.conn: sqlite3.Connection = sqlite3.connect(fpath)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "name TEXT PRIMARY KEY, hash INTEGER NOT NULL, output TEXT NOT NULL)"
+        )
+        rows: List[Tuple[str, int, str]] = self.conn.execute(
+            "SELECT name, hash, output FROM hashes ORDER BY rowid"
+        ).fetchall()
+        self.names: List[str] = [str(row[0]) for row in rows]
+        self.outputs: List[str] = [str(row[2]) for row in rows]
+        self._positions: Dict[str, int] = {name: ii for ii, name in enumerate(self.names)}
+        self._hashes: npt.NDArray[np.uint64] = np.zeros(max(len(rows), 64), dtype=np.uint64)
+        self._hashes[:len(rows)] = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+
+    @property
+    def hashes(self) -> npt.NDArray[np.uint64]:
+        """The hashes in order of `names`."""
+        return self._hashes[:len(self.names)]
+
+    def __enter__(self) -> "HashIndex":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def close(self) -> None:
+        """Closes the database."""
+        self.conn.close()
+
+    def find(self, value: int, threshold: int = THRESHOLD) -> Tuple[str, str, int] | None:
+        """Returns the nearest image whose hash differs in at most `threshold` bits.
+
+        Args:
+            value (int): The hash.
+            threshold (int, optional): The maximum Hamming distance. Defaults to THRESHOLD.
+
+        Returns:
+            tuple or None: The name, the output and the distance of the image, or None.
+        """
+        if not self.names:
+            return None
+        distances = hamming(self.hashes, value)
+        index: int = int(np.argmin(distances))
+        if int(distances[index]) > threshold:
+            return None
+        return self.names[index], self.outputs[index], int(distances[index])
+
+    def add(self, name: str, value: int, output: str) -> None:
+        """Adds the hash of an analyzed image with the path of its result."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)", (name, _to_signed(value), output)
+            )
+        index: int | None = self._positions.get(name)
+        if index is not None:
+            self._hashes[index] = np.uint64(value)
+            self.outputs[index] = output
+            return
+        if len(self.names) == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+        self._hashes[len(self.names)] = np.uint64(value)
+        self._positions[name] = len(self.names)
+        self.names.append(name)
+        self.outputs.append(output)
+
+
+def find_duplicates(
+    fpaths: List[str], threshold: int = THRESHOLD
+) -> Dict[str, List[Tuple[str, int]]]:
+    """Groups near-duplicate images.
+
+    Args:
+        fpaths (list of str): The paths of the images.
+        threshold (int, optional): The maximum Hamming distance. Defaults to THRESHOLD.
+
+    Returns:
+        dict: The first image of each group with duplicates, mapped to its
+        duplicates and their distances, in order of `fpaths`.
+    """
+    if not fpaths:
+        return {}
+    hashes: npt.NDArray[np.uint64] = np.concatenate([
+        phash_arrays(np.stack([thumbnail(fpath) for fpath in fpaths[ii:ii + BATCH_SIZE]]))
+        for ii in range(0, len(fpaths), BATCH_SIZE)
+    ])
+    groups: Dict[str, List[Tuple[str, int]]] = {}
+    representative: List[int] = []
+    for ii, value in enumerate(hashes):
+        if representative:
+            distances = hamming(hashes[representative], int(value))
+            nearest: int = int(np.argmin(distances))
+            if int(distances[nearest]) <= threshold:
+                groups.setdefault(fpaths[representative[nearest]], []).append(
+                    (fpaths[ii], int(distances[nearest]))
+                )
+                continue
+        representative.append(ii)
+    return groups
+
+
+def main(src: str, threshold: int = THRESHOLD, recursive: bool = False) -> None:
+    """Prints the groups of near-duplicate images in a directory."""
+    fpaths: List[str] = sorted(
+        entry.path for entry in scan(src, IMAGE_EXTENSIONS, recursive=recursive)
+    )
+    groups = find_duplicates(fpaths, threshold)
+    for first, duplicates in groups.items():
+        print(first)
+        for fpath, distance in duplicates:
+            print(f"    {fpath} (distance {distance})")
+    n_duplicates: int = sum(len(duplicates) for duplicates in groups.values())
+    print(f"{n_duplicates} duplicates in {len(fpaths)} images.")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str, help="the directory of images")
+    parser.add_argument(
+        "--threshold", dest="threshold", type=int, default=THRESHOLD,
+        help="the maximum number of different bits of the hashes of duplicates"
+    )
+    parser.add_argument(
+        "--recursive", dest="recursive", action="store_true"
+    )
+    args = parser.parse_args()
+    main(args.src, args.threshold, args.recursive)
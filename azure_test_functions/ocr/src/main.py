@@ -1,12 +1,24 @@
 """ocr"""
 
+from __future__ import annotations
+import contextlib
+import functools
 import json
 import os
+import shutil
 import time
-from typing import Dict, Any
-from azure.ai.vision.imageanalysis import ImageAnalysisClient
-from azure.ai.vision.imageanalysis.models import VisualFeatures
-from azure.core.credentials import AzureKeyCredential
+from typing import TYPE_CHECKING, Dict, Any, List, Tuple
+from ...common.src.executor import EXECUTOR, CircuitOpenError
+from ...common.src.manifest import Manifest, existing_path, parse_shard
+from ...common.src.metrics import METRICS, profiled
+from ...common.src.planner import ORDER_NAME, ORDERS, Quota, estimate, schedule
+from ...common.src.scanner import IMAGE_EXTENSIONS, scan
+from ...common.src.watcher import DEBOUNCE_SEC, INTERVAL_SEC, SNAPSHOT_FILENAME, Watcher
+from .pages import PAGED_EXTENSIONS, PAGES_INDEX_FILENAME, analyze_document, count_pages, is_paged
+
+if TYPE_CHECKING:
+    from azure.ai.vision.imageanalysis import ImageAnalysisClient
+    from .dedup import HashIndex
 
 TIMEOUT_SEC: float = 30.0
 WAIT_TIME_SEC: float = 3.0
@@ -14,8 +26,22 @@ DEFAULT_OUTPUT_DIRNAME: str = "analyzed"
 
 KEY_CV: str = os.environ.get("AZURE_CV_KEY", "")
 ENDPOINT_BASE: str = os.environ.get("AZURE_CV_ENDPOINT", "")
+TRANSACTIONS_PER_SEC: float = float(os.environ.get("AZURE_CV_TPS", "10"))
+PRICE_PER_1000_TRANSACTIONS: float = float(os.environ.get("AZURE_CV_PRICE_PER_1000", "1.5"))
+SEC_PER_IMAGE_DEFAULT: float = 1.0
+# dedup.THRESHOLD; dedup is imported only when used, as it loads NumPy.
+DEDUP_THRESHOLD: int = 4
+
+QUOTA: Quota = Quota(
+    unit="images",
+    units_per_sec=TRANSACTIONS_PER_SEC,
+    price_per_unit=PRICE_PER_1000_TRANSACTIONS / 1000,
+    sec_per_unit=SEC_PER_IMAGE_DEFAULT,
+    sec_per_item=WAIT_TIME_SEC
+)
 
 
+@METRICS.timed("ocr.save")
 def save(fpath: str, value: Dict[str, Any]) -> None:
     """Saves a dictionary to a JSON file.
 
@@ -29,11 +55,29 @@ def save(fpath: str, value: Dict[str, Any]) -> None:
         json.dump(value, ff, indent=4)
 
 
+@functools.lru_cache(maxsize=1)
+def client() -> ImageAnalysisClient:
+    """Returns the client of the Azure Computer Vision.
+
+    The client is created once per process, so the SDK is imported and
+    the connection is opened only by the first call of `analyze`.
+    """
+    # pylint: disable=import-outside-toplevel
+    from azure.ai.vision.imageanalysis import ImageAnalysisClient
+    from azure.core.credentials import AzureKeyCredential
+    return ImageAnalysisClient(
+        endpoint=ENDPOINT_BASE,
+        credential=AzureKeyCredential(KEY_CV),
+        timeout=TIMEOUT_SEC,
+        retry_total=0
+    )
+
+
 def analyze(fpath: str) -> Dict[str, Any]:
     """Analyzes an image using the Azure Computer Vision.
 
     This function takes the path to an image file, reads the image data, 
-    and sends it to the Azure Computer Vision for analysis.
+    and sends it to the Azure Computer Vision for analysis by `analyze_bytes`.
     The function returns the analysis results as a dictionary.
 
     Args:
@@ -46,28 +90,147 @@ def analyze(fpath: str) -> Dict[str, Any]:
     image_data: bytes = bytes()
     with open(fpath, "rb") as ff:
         image_data = ff.read()
+    return analyze_bytes(image_data)
 
-    client: ImageAnalysisClient = ImageAnalysisClient(
-        endpoint=ENDPOINT_BASE,
-        credential=AzureKeyCredential(KEY_CV),
-        timeout=TIMEOUT_SEC
-    )
-    result = client.analyze(
+
+@METRICS.timed("ocr.analyze")
+def analyze_bytes(image_data: bytes) -> Dict[str, Any]:
+    """Analyzes an encoded image, e.g. a page rendered by `pages.render_page`.
+
+    The request is sent through `EXECUTOR`, which retries throttled and failed requests.
+
+    Args:
+        image_data (bytes): The image.
+
+    Returns:
+        dict: A dictionary containing the analysis results.
+    """
+    METRICS.inc("upload_bytes_total", len(image_data), function="ocr.analyze")
+
+    # pylint: disable=import-outside-toplevel
+    from azure.ai.vision.imageanalysis.models import VisualFeatures
+    result = EXECUTOR.call(ENDPOINT_BASE, lambda: client().analyze(
         image_data,
         visual_features=[VisualFeatures.READ]
-    )
+    ))
     return result.as_dict()
 
 
-def analyze_from_dir(src: str) -> None:
+def measure(fpath: str) -> float:
+    """Returns the number of images sent for a file: its pages for a PDF or
+    a TIFF, counted from its header, and 1 otherwise."""
+    if not is_paged(fpath):
+        return 1.0
+    try:
+        return float(count_pages(fpath))
+    except ImportError:
+        return 1.0
+
+
+def _output_path(dstdir: str, fname: str) -> str:
+    return os.path.join(dstdir, os.path.splitext(fname)[0] + ".json")
+
+
+def _document_path(dstdir: str, fname: str) -> str:
+    return os.path.join(dstdir, os.path.splitext(fname)[0], PAGES_INDEX_FILENAME)
+
+
+def analyze_to(
+    fpath: str, dstdir: str, fname: str,
+    index: HashIndex | None = None, threshold: int = DEDUP_THRESHOLD
+) -> str:
+    """Analyzes an image or the pages of a document and saves the results.
+
+    With `index`, an image whose perceptual hash is within `threshold` bits of
+    an image analyzed before is not sent: the result of that image is copied.
+
+    Args:
+        fpath (str): The path of an image, a PDF or a TIFF.
+        dstdir (str): The output directory.
+        fname (str): The name of the file relative to the input directory.
+        index (HashIndex, optional): The hashes of the images analyzed before.
+        threshold (int, optional): The maximum Hamming distance of duplicates.
+            Defaults to DEDUP_THRESHOLD.
+
+    Returns:
+        str: The path of the result, `<dstdir>/<name>.json` for an image,
+        or of the index of the pages, `<dstdir>/<name>/pages.json` for a document.
+    """
+    if is_paged(fname):
+        return analyze_document(
+            fpath, os.path.dirname(_document_path(dstdir, fname))
+        )
+    dstpath: str = _output_path(dstdir, fname)
+    if not os.path.exists(os.path.dirname(dstpath)):
+        os.makedirs(os.path.dirname(dstpath))
+    value: int | None = None
+    if index is not None:
+        from .dedup import phash  # pylint: disable=import-outside-toplevel
+        value = phash(fpath)
+        found = index.find(value, threshold)
+        if found is not None and os.path.exists(found[1]):
+            print(f"duplicate of {found[0]} (distance {found[2]}). reuse its result.")
+            shutil.copyfile(found[1], dstpath)
+            METRICS.inc("ocr_duplicates_total")
+            return dstpath
+    save(dstpath, analyze(fpath))
+    if index is not None and value is not None:
+        index.add(fname, value, os.path.abspath(dstpath))
+    return dstpath
+
+
+@profiled("ocr.analyze_from_dir")
+def analyze_from_dir(
+    src: str, retry_failed: bool = False, rescan: bool = False,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, shard: Tuple[int, int] | None = None,
+    lease_sec: float | None = None, dedup: int | None = None,
+    dedup_index: str | None = None, plan: bool = False,
+    order: str = ORDER_NAME, priority: List[str] | None = None
+) -> None:
     """Analyzes images in a directory and saves results as JSON files.
 
     This function iterates over image files in the specified directory, analyzes each image
     using the `analyze` function, and saves the analysis results as JSON files in a designated
     output directory.
+    The state of each image is recorded in a `Manifest` in the output directory,
+    so a rerun only analyzes the pending images without listing the directory again.
+    A failed image is recorded and skipped, and is retried if `retry_failed` is True.
+    The images are found by `scan`, which only yields the files with one of
+    IMAGE_EXTENSIONS or PAGED_EXTENSIONS unless `include` is given, and skips
+    the output directory. The pages of a PDF or a TIFF are analyzed by
+    `pages.analyze_document` and saved in `<name>/page_<n>.json`.
+    With `dedup`, the perceptual hash of each image is looked up in a
+    `dedup.HashIndex` before the image is sent (see `analyze_to`).
+    The outputs of images in subdirectories are saved in the same subdirectories
+    of the output directory.
+    With `plan`, the images and the pages of the pending files are counted and
+    the time and the cost of the run are printed instead (see `planner.estimate`),
+    not counting the duplicates found by `dedup`.
 
     Args:
         src (str): The path to the directory containing image files.
+        retry_failed (bool, optional): Retries the images failed in the previous runs if True.
+        rescan (bool, optional): Lists the directory again to add new images if True.
+        recursive (bool, optional): Finds images in the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to analyze,
+            e.g. `["*.png"]`, replacing the filter by IMAGE_EXTENSIONS.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        shard (tuple of int, optional): `(i, N)` to process only the shard `i` of `N`
+            of the files, split by the hashes of their names.
+        lease_sec (float, optional): Claims the files with leases of this length
+            to share them with other workers running on the same directory.
+        dedup (int, optional): Reuses the result of an image analyzed before for
+            the images whose perceptual hashes differ from its hash in at most
+            this number of bits, e.g. DEDUP_THRESHOLD. Every image is analyzed if None.
+        dedup_index (str, optional): The path of the index of the hashes, to find
+            duplicates of the images of other directories.
+            Defaults to `<output_dir>/hashes.sqlite3`.
+        plan (bool, optional): Prints the estimated workload, time and cost
+            of the pending files without analyzing them if True.
+        order (str, optional): The order to analyze the files in, one of
+            `planner.ORDERS`: `name`, `small` (the fewest pages first) or `large`.
+        priority (list of str, optional): Glob patterns of the files to analyze first.
 
     Raises:
         ValueError: If the provided `src` is not a directory.
@@ -75,46 +238,139 @@ def analyze_from_dir(src: str) -> None:
     if not os.path.isdir(src):
         raise ValueError("'src' must be a directory path.")
     dstdir: str = os.path.join(src, DEFAULT_OUTPUT_DIRNAME)
-    if not os.path.exists(dstdir):
-        os.makedirs(dstdir)
-
-    # analyzed_list = []
-    filename_list = [
-        fname for fname in os.listdir(src)
-        if os.path.isfile(os.path.join(src, fname))
-    ]
-    n_files = len(filename_list)
-    print(f"# of files: {n_files}")
-    for ii, fname in enumerate(filename_list):
-        print(f"target: {fname} ({ii + 1}/{n_files})")
-        if not os.path.isfile(os.path.join(src, fname)):
-            continue
-        dstpath_target = os.path.join(
-            dstdir,
-            os.path.basename(fname).replace(
-                os.path.splitext(fname)[-1],
-                ".json"
+    with contextlib.ExitStack() as stack:
+        index: HashIndex | None = None
+        if dedup is not None and not plan:
+            # pylint: disable=import-outside-toplevel
+            from .dedup import HASH_INDEX_FILENAME, HashIndex, require_pillow
+            require_pillow()
+            index = stack.enter_context(
+                HashIndex(dedup_index or os.path.join(dstdir, HASH_INDEX_FILENAME))
+            )
+        manifest: Manifest = stack.enter_context(Manifest(dstdir, shard, lease_sec))
+        if rescan or not manifest.is_scanned():
+            manifest.add(
+                (entry.name, existing_path(
+                    (_document_path if is_paged(entry.name) else _output_path)(dstdir, entry.name)
+                ))
+                for entry in scan(
+                    src, None if include else IMAGE_EXTENSIONS | PAGED_EXTENSIONS, include,
+                    [DEFAULT_OUTPUT_DIRNAME, *(exclude or [])], recursive
+                )
             )
+        filename_list: List[str] = manifest.pending(retry_failed)
+        n_files = len(filename_list)
+        print(f"# of files: {n_files} ({manifest.summary()})")
+        if plan:
+            print(estimate(
+                filename_list, lambda name: measure(os.path.join(src, name)),
+                QUOTA, manifest.latencies()
+            ).format())
+            return
+        filename_list = schedule(
+            filename_list, lambda name: measure(os.path.join(src, name)), order, priority
         )
-        if os.path.exists(dstpath_target):
-            print("already analyzed. skip")
-            # with open(dstpath_target, "r", encoding="utf-8") as ff:
-            #     analyzed = json.load(ff)
-            # analyzed_list.append(analyzed)
-            continue
-        analyzed = analyze(os.path.join(src, fname))
-        # if analyzed is None:
-        #     print("failure in analysis. skip.")
-        #     time.sleep(WAIT_TIME_SEC)
-        #     continue
-        # analyzed_list.append(analyzed)
-        save(dstpath_target, analyzed)
-        print("done.")
-        time.sleep(WAIT_TIME_SEC)
-
-
-def main(fpath: str) -> None:
-    """Analyzes an image or a directory of images.
+        for ii, fname in enumerate(filename_list):
+            if not manifest.start(fname):
+                continue
+            print(f"target: {fname} ({ii + 1}/{n_files})")
+            st = time.perf_counter()
+            try:
+                dstpath_target = analyze_to(
+                    os.path.join(src, fname), dstdir, fname, index,
+                    DEDUP_THRESHOLD if dedup is None else dedup
+                )
+            except CircuitOpenError as ex:
+                manifest.fail(fname, repr(ex), time.perf_counter() - st)
+                print(f"{ex} stop.")
+                break
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                manifest.fail(fname, repr(ex), time.perf_counter() - st)
+                print(f"failure in analysis: {ex!r}. skip.")
+                continue
+            manifest.succeed(fname, dstpath_target, time.perf_counter() - st)
+            print("done.")
+            time.sleep(WAIT_TIME_SEC)
+        print(f"finished. {manifest.summary()}")
+
+
+def watch_dir(
+    src: str, recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, dedup: int | None = None,
+    dedup_index: str | None = None, interval: float = INTERVAL_SEC,
+    debounce: float = DEBOUNCE_SEC
+) -> None:
+    """Analyzes the images and documents added to or changed in a directory until interrupted.
+
+    The files are found by a `Watcher` comparing their modification times and
+    sizes with a snapshot in the output directory, so only the files added or
+    changed since the last batch, or since the last watch, are analyzed by
+    `analyze_from_dir`. The page results of a changed document are removed
+    so that every page is analyzed again. The items of the removed files are
+    removed from the manifest, and their results are kept.
+
+    Args:
+        src (str): The path to the directory to watch.
+        recursive (bool, optional): Watches the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to analyze.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        dedup (int, optional): Reuses the results of near-duplicate images (see `analyze_from_dir`).
+        dedup_index (str, optional): The path of the index of the hashes.
+        interval (float, optional): The seconds between polls. Defaults to INTERVAL_SEC.
+        debounce (float, optional): The seconds a file must stay unchanged
+            before it is analyzed. Defaults to DEBOUNCE_SEC.
+
+    Raises:
+        ValueError: If the provided `src` is not a directory.
+    """
+    if not os.path.isdir(src):
+        raise ValueError("'src' must be a directory path.")
+    dstdir: str = os.path.join(src, DEFAULT_OUTPUT_DIRNAME)
+    watcher = Watcher(
+        src, os.path.join(dstdir, SNAPSHOT_FILENAME),
+        None if include else IMAGE_EXTENSIONS | PAGED_EXTENSIONS, include,
+        [DEFAULT_OUTPUT_DIRNAME, *(exclude or [])], recursive, interval, debounce
+    )
+    print(f"watch {src}... (Ctrl+C to stop)")
+    with watcher:
+        try:
+            for changes in watcher.watch():
+                print(
+                    f"{len(changes.added)} added, {len(changes.modified)} modified, "
+                    f"{len(changes.removed)} removed."
+                )
+                for name in changes.modified:
+                    if is_paged(name):
+                        shutil.rmtree(
+                            os.path.dirname(_document_path(dstdir, name)), ignore_errors=True
+                        )
+                with Manifest(dstdir) as manifest:
+                    manifest.add(
+                        (name, existing_path(
+                            (_document_path if is_paged(name) else _output_path)(dstdir, name)
+                        ))
+                        for name in changes.added
+                    )
+                    manifest.reset(changes.modified)
+                    manifest.remove(changes.removed)
+                analyze_from_dir(
+                    src, recursive=recursive, dedup=dedup, dedup_index=dedup_index
+                )
+        except KeyboardInterrupt:
+            pass
+    print("stop watching.")
+
+
+def main(
+    fpath: str, retry_failed: bool = False, rescan: bool = False,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, shard: Tuple[int, int] | None = None,
+    lease_sec: float | None = None, dedup: int | None = None,
+    dedup_index: str | None = None, plan: bool = False,
+    order: str = ORDER_NAME, priority: List[str] | None = None,
+    watch: bool = False, interval: float = INTERVAL_SEC, debounce: float = DEBOUNCE_SEC
+) -> None:
+    """Analyzes an image, the pages of a PDF or a TIFF, or a directory of them.
 
     This function determines whether the provided path is a file or a directory.
     If it's a file, it analyzes the image and saves the results as a JSON file.
@@ -123,12 +379,46 @@ def main(fpath: str) -> None:
 
     Args:
         fpath (str): The path to an image file or a directory containing images.
+        retry_failed (bool, optional): Retries the images failed in the previous runs if True.
+        rescan (bool, optional): Lists the directory again to add new images if True.
+        recursive (bool, optional): Finds images in the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to analyze.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        shard (tuple of int, optional): `(i, N)` to process only the shard `i` of `N`
+            of the files, split by the hashes of their names.
+        lease_sec (float, optional): Claims the files with leases of this length
+            to share them with other workers running on the same directory.
+        dedup (int, optional): Reuses the result of an image analyzed before for
+            the images whose perceptual hashes differ from its hash in at most
+            this number of bits, e.g. DEDUP_THRESHOLD. Every image is analyzed if None.
+        dedup_index (str, optional): The path of the index of the hashes, to find
+            duplicates of the images of other directories.
+            Defaults to `<output_dir>/hashes.sqlite3`.
+        plan (bool, optional): Prints the estimated workload, time and cost
+            of the pending files without analyzing them if True.
+        order (str, optional): The order to analyze the files in, one of
+            `planner.ORDERS`: `name`, `small` (the fewest pages first) or `large`.
+        priority (list of str, optional): Glob patterns of the files to analyze first.
+        watch (bool, optional): Keeps analyzing the files added to or changed in
+            the directory until interrupted if True (see `watch_dir`).
+        interval (float, optional): The seconds between polls of `watch`.
+        debounce (float, optional): The seconds a file must stay unchanged in `watch`.
 
     Raises:
         ValueError: If the analysis fails or if the provided path is invalid.
     """
-    if os.path.isdir(fpath):
-        analyze_from_dir(fpath)
+    if watch:
+        watch_dir(fpath, recursive, include, exclude, dedup, dedup_index, interval, debounce)
+    elif os.path.isdir(fpath):
+        analyze_from_dir(
+            fpath, retry_failed, rescan, recursive, include, exclude, shard, lease_sec,
+            dedup, dedup_index, plan, order, priority
+        )
+    elif is_paged(fpath):
+        analyze_to(
+            fpath, os.path.join(os.path.dirname(fpath), DEFAULT_OUTPUT_DIRNAME),
+            os.path.basename(fpath)
+        )
     else:
         translated = analyze(fpath)
         if translated is None:
@@ -152,5 +442,67 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("src", type=str)
+    parser.add_argument(
+        "--retry_failed", dest="retry_failed", action="store_true"
+    )
+    parser.add_argument(
+        "--rescan", dest="rescan", action="store_true"
+    )
+    parser.add_argument(
+        "--recursive", dest="recursive", action="store_true"
+    )
+    parser.add_argument(
+        "--include", dest="include", type=str, nargs="+", default=None,
+        help="glob patterns of the files to analyze"
+    )
+    parser.add_argument(
+        "--exclude", dest="exclude", type=str, nargs="+", default=None,
+        help="glob patterns of the files and directories to skip"
+    )
+    parser.add_argument(
+        "--shard", dest="shard", type=parse_shard, default=None,
+        help="'i/N' to process only the shard i of N of the files"
+    )
+    parser.add_argument(
+        "--lease_sec", dest="lease_sec", type=float, default=None,
+        help="claim the files with leases of this length to share them with other workers"
+    )
+    parser.add_argument(
+        "--dedup", dest="dedup", type=int, nargs="?", const=DEDUP_THRESHOLD, default=None,
+        help="reuse the results for near-duplicate images differing in at most this number of bits"
+    )
+    parser.add_argument(
+        "--dedup_index", dest="dedup_index", type=str, default=None,
+        help="the path of the index of the hashes shared by several directories"
+    )
+    parser.add_argument(
+        "--plan", dest="plan", action="store_true",
+        help="print the estimated workload, time and cost without analyzing"
+    )
+    parser.add_argument(
+        "--order", dest="order", type=str, choices=ORDERS, default=ORDER_NAME,
+        help="the order to analyze the files in"
+    )
+    parser.add_argument(
+        "--priority", dest="priority", type=str, nargs="+", default=None,
+        help="glob patterns of the files to analyze first"
+    )
+    parser.add_argument(
+        "--watch", dest="watch", action="store_true",
+        help="keep analyzing the files added to or changed in the directory"
+    )
+    parser.add_argument(
+        "--interval", dest="interval", type=float, default=INTERVAL_SEC,
+        help="the seconds between polls of the directory in the watch mode"
+    )
+    parser.add_argument(
+        "--debounce", dest="debounce", type=float, default=DEBOUNCE_SEC,
+        help="the seconds a file must stay unchanged before it is analyzed in the watch mode"
+    )
     args = parser.parse_args()
-    main(args.src)
+    main(
+        args.src, args.retry_failed, args.rescan,
+        args.recursive, args.include, args.exclude, args.shard, args.lease_sec,
+        args.dedup, args.dedup_index, args.plan, args.order, args.priority,
+        args.watch, args.interval, args.debounce
+    )
@@ -3,8 +3,12 @@
 import json
 import os
 from typing import Dict, List, Any
+from ...common.src.scanner import JSON_EXTENSIONS, scan
+from ...common.src.watcher import DEBOUNCE_SEC, INTERVAL_SEC, SNAPSHOT_FILENAME, Watcher
+from .pages import PAGES_INDEX_FILENAME
 
 DEFAULT_OUTPUT_DIRNAME: str = "merged"
+EXCLUDE_PATTERNS: List[str] = [DEFAULT_OUTPUT_DIRNAME, PAGES_INDEX_FILENAME, SNAPSHOT_FILENAME]
 
 
 def is_in_bounding_rect(src: List[int], bounding: List[int]) -> bool:
@@ -86,7 +90,7 @@ def extract_texts(src: Dict[str, Any], bounding_rect: List[int] | None = None) -
             if is_in_bounding_rect(bounding_, bounding_rect):
                 texts_in.append(line["text"])
     else:
-        texts_in = src["readResult"]["blocks"][0]["lines"]
+        texts_in = [line["text"] for line in src["readResult"]["blocks"][0]["lines"]]
     return " ".join(texts_in)
 
 
@@ -130,6 +134,12 @@ def extract_texts_from_dir(
     """Extracts text from all JSON files in a given directory
     and saves the extracted text to a given directory.
 
+    The JSON files in the subdirectories, i.e. the results of `ocr --recursive`
+    and of the pages of documents, are also extracted and saved in the same
+    subdirectories of `dst_dir_path`.
+    The other files in the directory, e.g. the manifest and the snapshot of
+    `ocr --watch`, are skipped.
+
     Args:
         src (str): The path to the directory containing JSON files with OCR results.
         bounding_rect (list, optional): A list representing the bounding rectangle
@@ -152,29 +162,81 @@ def extract_texts_from_dir(
         raise NotADirectoryError("'dst_dir_path' must be a directory path.")
 
     dst: List[str | None] = []
-    for fname in sorted(os.listdir(src)):
-        fpath = os.path.join(src, fname)
-        if not os.path.isfile(fpath):
-            continue
-        dst_fpath: str | None = None
-        if dst_dir_path is not None:
-            dst_fpath = os.path.join(
-                dst_dir_path,
-                os.path.basename(fname).replace(
-                    os.path.splitext(fname)[-1],
-                    ".txt"
-                )
-            )
+    entries = scan(src, JSON_EXTENSIONS, exclude=EXCLUDE_PATTERNS, recursive=True)
+    for entry in sorted(entries, key=lambda entry: entry.name):
         dst.append(extract_texts_from_file(
-            fpath, bounding_rect, dst_fpath
+            entry.path, bounding_rect,
+            None if dst_dir_path is None else _text_path(dst_dir_path, entry.name)
         ))
 
     return dst
 
 
+def _text_path(dst_dir_path: str, name: str) -> str:
+    dst_fpath: str = os.path.join(dst_dir_path, os.path.splitext(name)[0] + ".txt")
+    if not os.path.exists(os.path.dirname(dst_fpath)):
+        os.makedirs(os.path.dirname(dst_fpath))
+    return dst_fpath
+
+
+def watch_dir(
+    src: str, bounding_rect: List[int] | None = None, dst_dir_path: str | None = None,
+    interval: float = INTERVAL_SEC, debounce: float = DEBOUNCE_SEC
+) -> None:
+    """Extracts the texts of the JSON files added to or changed in a directory until interrupted.
+
+    The files are found by a `Watcher` comparing their modification times and
+    sizes with a snapshot in `dst_dir_path`, so only the results added or
+    changed since the last batch, or since the last watch, are extracted.
+    The texts of the removed files are removed.
+
+    Args:
+        src (str): The path to the directory of the OCR results, e.g. `<dir>/analyzed`.
+        bounding_rect (list, optional): A list representing the bounding rectangle
+            in the format [x1, y1, x2, y2].
+        dst_dir_path (str, optional): A directory path to save the extracted texts in.
+            Defaults to a subdirectory `DEFAULT_OUTPUT_DIRNAME`.
+        interval (float, optional): The seconds between polls. Defaults to INTERVAL_SEC.
+        debounce (float, optional): The seconds a file must stay unchanged
+            before it is extracted. Defaults to DEBOUNCE_SEC.
+
+    Raises:
+        NotADirectoryError: If the specified path is not a directory.
+    """
+    if not os.path.isdir(src):
+        raise NotADirectoryError("'src' must be a directory path.")
+    if dst_dir_path is None:
+        dst_dir_path = os.path.join(src, DEFAULT_OUTPUT_DIRNAME)
+    watcher = Watcher(
+        src, os.path.join(dst_dir_path, SNAPSHOT_FILENAME), JSON_EXTENSIONS,
+        exclude=EXCLUDE_PATTERNS, recursive=True, interval=interval, debounce=debounce
+    )
+    print(f"watch {src}... (Ctrl+C to stop)")
+    with watcher:
+        try:
+            for changes in watcher.watch():
+                for name in changes.changed:
+                    try:
+                        extract_texts_from_file(
+                            os.path.join(src, name), bounding_rect,
+                            _text_path(dst_dir_path, name)
+                        )
+                    except (OSError, ValueError, KeyError, IndexError) as ex:
+                        print(f"failure in extraction of {name}: {ex!r}. skip.")
+                for name in changes.removed:
+                    dst_fpath: str = os.path.join(dst_dir_path, os.path.splitext(name)[0] + ".txt")
+                    if os.path.exists(dst_fpath):
+                        os.remove(dst_fpath)
+                print(f"{len(changes.changed)} extracted, {len(changes.removed)} removed.")
+        except KeyboardInterrupt:
+            pass
+    print("stop watching.")
+
+
 def main(
     file_or_dir_path: str, bounding_rect: List[int] | None = None,
-    dst_file_or_dir_path: str | None = None
+    dst_file_or_dir_path: str | None = None, watch: bool = False,
+    interval: float = INTERVAL_SEC, debounce: float = DEBOUNCE_SEC
 ) -> None:
     """Extracts text from a given file or directory and saves the results
     to a specified destination.
@@ -189,12 +251,19 @@ def main(
             or directory where the extracted text will be saved.
             If not provided, a default output directory will be created
             within the source directory.
+        watch (bool, optional): Keeps extracting the texts of the files added to or
+            changed in the directory until interrupted if True (see `watch_dir`).
+        interval (float, optional): The seconds between polls of `watch`.
+        debounce (float, optional): The seconds a file must stay unchanged in `watch`.
 
     Raises:
         ValueError: If `file_or_dir_path` is not a valid file or directory path.
         NotADirectoryError: If `file_or_dir_path` is a directory
             but `dst_file_or_dir_path` is not provided.
     """
+    if watch:
+        watch_dir(file_or_dir_path, bounding_rect, dst_file_or_dir_path, interval, debounce)
+        return
     print("extract...")
     if os.path.isdir(file_or_dir_path):
         if dst_file_or_dir_path is None:
@@ -243,5 +312,17 @@ if __name__ == "__main__":
         "--dst", dest="dst",
         type=str, default=None
     )
+    parser.add_argument(
+        "--watch", dest="watch", action="store_true",
+        help="keep extracting the texts of the files added to or changed in the directory"
+    )
+    parser.add_argument(
+        "--interval", dest="interval", type=float, default=INTERVAL_SEC,
+        help="the seconds between polls of the directory in the watch mode"
+    )
+    parser.add_argument(
+        "--debounce", dest="debounce", type=float, default=DEBOUNCE_SEC,
+        help="the seconds a file must stay unchanged before it is extracted in the watch mode"
+    )
     args = parser.parse_args()
-    main(args.src, args.bounding_rect, args.dst)
+    main(args.src, args.bounding_rect, args.dst, args.watch, args.interval, args.debounce)
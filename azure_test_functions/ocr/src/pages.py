@@ -0,0 +1,205 @@
+"""pages.py
+
+Page splitter of multi-page documents for OCR.
+
+The Azure Computer Vision analyzes one image per request, so a PDF or a
+multi-page TIFF is analyzed page by page. The pages are rasterized (PDF) or
+extracted (TIFF) lazily in a process pool and sent to concurrent analyses as
+soon as they are ready, so at most a few pages of a document are in memory.
+The result of each page is saved as `<document>/page_<n>.json` in the output
+directory, and the index of the pages as `<document>/pages.json` once every
+page is analyzed. Pages already saved are not analyzed again.
+
+Rasterizing a PDF requires `pypdfium2`, and extracting the pages of a TIFF
+requires `Pillow`; without `Pillow`, a TIFF is sent as one image as before.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import importlib
+import io
+import json
+import os
+from typing import Any, Deque, Dict, Iterator, List, Set, Tuple
+
+PDF_EXTENSIONS: Set[str] = {".pdf"}
+TIFF_EXTENSIONS: Set[str] = {".tif", ".tiff"}
+PAGED_EXTENSIONS: Set[str] = PDF_EXTENSIONS | TIFF_EXTENSIONS
+PAGES_INDEX_FILENAME: str = "pages.json"
+DPI: int = 200
+PROCESSES: int = 2
+WORKERS: int = 4
+IMAGE_FORMAT: str = "PNG"
+
+
+def is_paged(fpath: str) -> bool:
+    """Returns True if the file is a document to be analyzed page by page."""
+    return os.path.splitext(fpath)[-1].lower() in PAGED_EXTENSIONS
+
+
+def _import(module_name: str, package: str) -> Any:
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as ex:
+        raise ImportError(f"'{package}' is required to split the pages: pip install {package}") from ex
+
+
+def _has_pillow() -> bool:
+    try:
+        importlib.import_module("PIL.Image")
+    except ImportError:
+        return False
+    return True
+
+
+def count_pages(fpath: str) -> int:
+    """Returns the number of pages of a PDF or a TIFF without reading their contents.
+
+    Raises:
+        ImportError: If `pypdfium2` is not installed for a PDF.
+    """
+    if os.path.splitext(fpath)[-1].lower() in PDF_EXTENSIONS:
+        document = _import("pypdfium2", "pypdfium2").PdfDocument(fpath)
+        try:
+            return len(document)
+        finally:
+            document.close()
+    if not _has_pillow():
+        return 1
+    with _import("PIL.Image", "pillow").open(fpath) as image:
+        return int(getattr(image, "n_frames", 1))
+
+
+def render_page(fpath: str, index: int, dpi: int = DPI) -> bytes:
+    """Returns a page of a PDF or a TIFF as an encoded image.
+
+    Only the page is read, so this can be called for each page from other
+    processes. A PDF page is rasterized at `dpi`, and a TIFF page is re-encoded
+    in IMAGE_FORMAT as it is. Without `Pillow`, the TIFF file is returned as it is.
+
+    Args:
+        fpath (str): The path of the document.
+        index (int): The index of the page from 0.
+        dpi (int, optional): The resolution to rasterize a PDF in. Defaults to DPI.
+
+    Returns:
+        bytes: The image.
+    """
+    buffer = io.BytesIO()
+    if os.path.splitext(fpath)[-1].lower() in PDF_EXTENSIONS:
+        document = _import("pypdfium2", "pypdfium2").PdfDocument(fpath)
+        try:
+            page = document[index]
+            page.render(scale=dpi / 72).to_pil().save(buffer, format=IMAGE_FORMAT)
+            page.close()
+        finally:
+            document.close()
+        return buffer.getvalue()
+    if not _has_pillow():
+        with open(fpath, "rb") as ff:
+            return ff.read()
+    with _import("PIL.Image", "pillow").open(fpath) as image:
+        image.seek(index)
+        frame = image if image.mode in ("1", "L", "RGB") else image.convert("RGB")
+        frame.save(buffer, format=IMAGE_FORMAT)
+    return buffer.getvalue()
+
+
+def iter_pages(
+    fpath: str, indices: List[int], processes: int = PROCESSES, dpi: int = DPI
+) -> Iterator[Tuple[int, bytes]]:
+    """Yields pages of a document in order as they are rendered.
+
+    At most `2 * processes` pages are rendered ahead of the consumer.
+
+    Args:
+        fpath (str): The path of the document.
+        indices (list of int): The indices of the pages to yield.
+        processes (int, optional): The number of processes rendering pages.
+            The pages are rendered in this process if 0. Defaults to PROCESSES.
+        dpi (int, optional): The resolution to rasterize a PDF in. Defaults to DPI.
+
+    Yields:
+        tuple: The index and the image of a page.
+    """
+    if processes <= 0:
+        for index in indices:
+            yield index, render_page(fpath, index, dpi)
+        return
+    # loaded lazily by concurrent.futures, with multiprocessing
+    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+    with ProcessPoolExecutor(processes) as pool:
+        pending: Deque[Tuple[int, "Future[bytes]"]] = deque()
+        for index in indices:
+            pending.append((index, pool.submit(render_page, fpath, index, dpi)))
+            if len(pending) >= 2 * processes:
+                done_index, future = pending.popleft()
+                yield done_index, future.result()
+        while pending:
+            done_index, future = pending.popleft()
+            yield done_index, future.result()
+
+
+def page_path(docdir: str, index: int) -> str:
+    """Returns the path of the result of a page, numbered from 1."""
+    return os.path.join(docdir, f"page_{index + 1:04d}.json")
+
+
+def _analyze_page(data: bytes, dstpath: str) -> None:
+    """Analyzes a page and saves its result atomically, so an interrupted
+    write does not leave a truncated result taken as done."""
+    from . import main as ocr  # pylint: disable=import-outside-toplevel
+    tmppath: str = f"{dstpath}.{os.getpid()}.tmp"
+    ocr.save(tmppath, ocr.analyze_bytes(data))
+    os.replace(tmppath, dstpath)
+
+
+def analyze_document(
+    fpath: str, docdir: str, workers: int = WORKERS,
+    processes: int = PROCESSES, dpi: int = DPI
+) -> str:
+    """Analyzes the pages of a document and saves their results.
+
+    Pages are analyzed concurrently while the next ones are rendered, and
+    a page is released as soon as its result is saved.
+
+    Args:
+        fpath (str): The path of a PDF or a TIFF.
+        docdir (str): The directory to save the results of the pages in.
+        workers (int, optional): The number of concurrent analyses. Defaults to WORKERS.
+        processes (int, optional): The number of processes rendering pages. Defaults to PROCESSES.
+        dpi (int, optional): The resolution to rasterize a PDF in. Defaults to DPI.
+
+    Returns:
+        str: The path of the index of the pages, `<docdir>/pages.json`.
+
+    Raises:
+        ImportError: If the library to split the pages is not installed.
+        Exception: The error of the first page failed. The pages saved
+            before are not analyzed again at the next call.
+    """
+    if not os.path.exists(docdir):
+        os.makedirs(docdir)
+    n_pages: int = count_pages(fpath)
+    indices: List[int] = [
+        index for index in range(n_pages) if not os.path.exists(page_path(docdir, index))
+    ]
+    print(f"{n_pages} pages, {len(indices)} to analyze.")
+    with ThreadPoolExecutor(workers) as pool:
+        pending: Deque["Future[None]"] = deque()
+        for index, data in iter_pages(fpath, indices, processes, dpi):
+            pending.append(pool.submit(_analyze_page, data, page_path(docdir, index)))
+            while len(pending) >= workers or (pending and pending[0].done()):
+                pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+    index_path: str = os.path.join(docdir, PAGES_INDEX_FILENAME)
+    pages: Dict[str, Any] = {
+        "source": os.path.basename(fpath),
+        "pages": [os.path.basename(page_path(docdir, index)) for index in range(n_pages)]
+    }
+    tmppath: str = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmppath, "w", encoding="utf-8") as ff:
+        json.dump(pages, ff, indent=4)
+    os.replace(tmppath, index_path)
+    return index_path
@@ -0,0 +1,12 @@
+"""pipeline"""
+
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as pipeline
+
+__all__ = ["pipeline"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "pipeline": ".src.main"
+}, fallback=".src.main")
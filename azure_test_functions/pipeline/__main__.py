@@ -0,0 +1,56 @@
+"""pipeline"""
+
+from .src.main import (
+    main, MODES, MODE_OCR, LANGUAGE_TO, SPEECH_LANGUAGE,
+    RECOGNIZE_WORKERS, TRANSLATE_WORKERS, EMBED_WORKERS
+)
+from .src.runner import QUEUE_SIZE
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str, help="the directory of images or audio files")
+    parser.add_argument(
+        "--mode", dest="mode", type=str, choices=MODES, default=MODE_OCR
+    )
+    parser.add_argument(
+        "--la", dest="la", type=str, default=LANGUAGE_TO,
+        help="language to translate into"
+    )
+    parser.add_argument(
+        "--la_from", dest="la_from", type=str, default=None,
+        help="language to translate from"
+    )
+    parser.add_argument(
+        "--speech_la", dest="speech_la", type=str, default=SPEECH_LANGUAGE,
+        help="language to transcribe the audio in"
+    )
+    parser.add_argument(
+        "--fast_mode", dest="fast_mode", action="store_true"
+    )
+    parser.add_argument(
+        "--bounding_rect", dest="bounding_rect", nargs=4,
+        type=int, default=None
+    )
+    parser.add_argument(
+        "--dst", dest="dst", type=str, default=None,
+        help="the directory of a vector store to embed the translations into"
+    )
+    parser.add_argument(
+        "--recognize_workers", dest="recognize_workers", type=int, default=RECOGNIZE_WORKERS
+    )
+    parser.add_argument(
+        "--translate_workers", dest="translate_workers", type=int, default=TRANSLATE_WORKERS
+    )
+    parser.add_argument(
+        "--embed_workers", dest="embed_workers", type=int, default=EMBED_WORKERS
+    )
+    parser.add_argument(
+        "--queue_size", dest="queue_size", type=int, default=QUEUE_SIZE
+    )
+    args = parser.parse_args()
+    main(
+        args.src, args.mode, args.la, args.la_from, args.speech_la, args.fast_mode,
+        args.bounding_rect, args.dst, args.recognize_workers, args.translate_workers,
+        args.embed_workers, args.queue_size
+    )
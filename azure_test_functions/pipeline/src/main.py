@@ -0,0 +1,429 @@
+"""pipeline"""
+
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+import warnings
+from ...common.src.scanner import AUDIO_EXTENSIONS, IMAGE_EXTENSIONS, scan
+from ...ocr.src import main as ocr
+from ...ocr.src import merge_texts
+from ...speech_to_text.src import main as speech_to_text
+from ...translation.src import main as translation
+from .runner import Pipeline, Stage, QUEUE_SIZE
+
+MODE_OCR: str = "ocr"
+MODE_STT: str = "stt"
+MODES: List[str] = [MODE_OCR, MODE_STT]
+RECOGNIZE_WORKERS: int = 4
+TRANSLATE_WORKERS: int = 4
+EMBED_WORKERS: int = 2
+MERGED_FILENAME: str = "translated_merged.txt"
+LANGUAGE_TO: str = translation.LANGUAGE_TO
+SPEECH_LANGUAGE: str = speech_to_text.LANGUAGE
+
+
+@dataclass
+class Document:
+    """A file passing through the stages."""
+    name: str
+    path: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    text: str = ""
+    outputs: Dict[str, str] = field(default_factory=dict)
+    chunks: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)
+    hashes: List[str] | None = None
+    vectors: Any = None
+
+    def __str__(self) -> str:
+        return self.name
+
+
+def _makedirs(dirpath: str) -> str:
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    return dirpath
+
+
+def _read(fpath: str) -> str:
+    with open(fpath, "r", encoding="utf-8") as ff:
+        return ff.read()
+
+
+def iter_documents(src: str, extensions: Iterable[str] | None = None) -> Iterator[Document]:
+    """Yields the files with one of `extensions` in a directory as they are listed.
+
+    The files are yielded in the order of the directory (see `scan`), not
+    sorted, so the first document is sent before a large directory is listed.
+    """
+    for entry in scan(src, extensions):
+        yield Document(entry.name, entry.path)
+
+
+def ocr_stages(
+    src: str, bounding_rect: List[int] | None = None,
+    workers: int = RECOGNIZE_WORKERS
+) -> Tuple[List[Stage], str]:
+    """Returns the stages of `ocr` and `ocr_merge_texts`.
+
+    The outputs are saved at the same paths as the CLIs save them, i.e.
+    `<src>/analyzed/<name>.json` and `<src>/analyzed/merged/<name>.txt`,
+    and an image whose analysis is already saved is not sent again.
+
+    Args:
+        src (str): The directory of the images.
+        bounding_rect (list, optional): The rectangle to extract the texts in.
+        workers (int, optional): The number of concurrent analyses.
+            Defaults to RECOGNIZE_WORKERS.
+
+    Returns:
+        tuple: The stages and the directory of the texts.
+    """
+    analyzed_dir: str = _makedirs(os.path.join(src, ocr.DEFAULT_OUTPUT_DIRNAME))
+    merged_dir: str = _makedirs(os.path.join(analyzed_dir, merge_texts.DEFAULT_OUTPUT_DIRNAME))
+
+    def analyze(doc: Document) -> Document:
+        dstpath: str = ocr._output_path(analyzed_dir, doc.name)  # pylint: disable=protected-access
+        if os.path.exists(dstpath):
+            with open(dstpath, "r", encoding="utf-8") as ff:
+                doc.data = json.load(ff)
+        else:
+            doc.data = ocr.analyze(doc.path)
+            ocr.save(dstpath, doc.data)
+        doc.outputs["ocr"] = dstpath
+        return doc
+
+    def merge(doc: Document) -> Document | None:
+        doc.text = merge_texts.extract_texts(doc.data, bounding_rect)
+        doc.data = {}
+        doc.name = os.path.splitext(doc.name)[0] + ".txt"
+        dstpath: str = os.path.join(merged_dir, doc.name)
+        merge_texts.save(dstpath, doc.text)
+        doc.outputs["merge"] = dstpath
+        return doc if doc.text.strip() else None
+
+    return [Stage("ocr", analyze, workers), Stage("merge", merge, 1)], merged_dir
+
+
+def stt_stages(
+    src: str, lang: str = speech_to_text.LANGUAGE, fast_mode: bool = False,
+    workers: int = RECOGNIZE_WORKERS
+) -> Tuple[List[Stage], str]:
+    """Returns the stage of `speech_to_text`.
+
+    The transcripts are saved at `<src>/transcribed/<name>.txt` as the CLI
+    saves them, and an audio file whose transcript is already saved is not sent again.
+
+    Args:
+        src (str): The directory of the audio files.
+        lang (str, optional): The language to transcribe the audio in.
+        fast_mode (bool, optional): Uses the fast transcription API if True.
+        workers (int, optional): The number of concurrent transcriptions.
+            Defaults to RECOGNIZE_WORKERS.
+
+    Returns:
+        tuple: The stages and the directory of the transcripts.
+    """
+    transcribed_dir: str = _makedirs(
+        os.path.join(src, speech_to_text.DEFAULT_OUTPUT_DIRNAME)
+    )
+
+    def transcribe(doc: Document) -> Document:
+        # pylint: disable=protected-access
+        dstpath: str = speech_to_text._output_path(transcribed_dir, doc.name)
+        if os.path.exists(dstpath):
+            doc.text = _read(dstpath)
+        else:
+            if fast_mode:
+                doc.text = speech_to_text.analyze_with_fast(doc.path, lang)
+            else:
+                doc.text = speech_to_text.analyze(doc.path, lang)
+            if not doc.text:
+                raise ValueError("no speech recognized")
+            speech_to_text.save(dstpath, doc.text)
+        doc.name = os.path.basename(dstpath)
+        doc.outputs["stt"] = dstpath
+        return doc
+
+    return [Stage("stt", transcribe, workers)], transcribed_dir
+
+
+def translation_stage(
+    src: str, from_language: str = translation.LANGUAGE_FROM,
+    to_language: str = translation.LANGUAGE_TO,
+    workers: int = TRANSLATE_WORKERS
+) -> Tuple[Stage, str]:
+    """Returns the stage of `translation`.
+
+    The translations are saved at `<src>/translated/<name>_translated.txt`
+    as the CLI saves them, and a text already translated is not sent again.
+
+    Args:
+        src (str): The directory of the texts to translate.
+        from_language (str, optional): Defaults to `translation.LANGUAGE_FROM`.
+        to_language (str, optional): Defaults to `translation.LANGUAGE_TO`.
+        workers (int, optional): The number of concurrent translations.
+            Defaults to TRANSLATE_WORKERS.
+
+    Returns:
+        tuple: The stage and the directory of the translations.
+    """
+    translated_dir: str = _makedirs(os.path.join(src, translation.DEFAULT_OUTPUT_DIRNAME))
+
+    def translate(doc: Document) -> Document:
+        # pylint: disable=protected-access
+        dstpath: str = translation._output_path(translated_dir, doc.name)
+        if os.path.exists(dstpath):
+            doc.text = _read(dstpath)
+        else:
+            translated: str | None = translation.translate(doc.text, from_language, to_language)
+            if translated is None:
+                raise ValueError("no translation returned")
+            doc.text = translated
+            translation.save(dstpath, doc.text)
+        doc.outputs["translation"] = dstpath
+        return doc
+
+    return Stage("translation", translate, workers), translated_dir
+
+
+def embedding_stages(
+    dst: str, workers: int = EMBED_WORKERS
+) -> Tuple[List[Stage], Any]:
+    """Returns the stages of `embedding`.
+
+    The chunks of the translations are looked up in the cache of the store by
+    one thread, embedded by `workers` threads and appended to the store by one
+    thread, so the store and the cache are the same as if `azure_test_embedding`
+    were run over the translations.
+
+    Args:
+        dst (str): The directory of the vector store.
+        workers (int, optional): The number of concurrent requests.
+            Defaults to EMBED_WORKERS.
+
+    Returns:
+        tuple: The stages and the cache to close after the run.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    from ...embedding.src import main as embedding
+    from ...embedding.src.cache import EmbeddingCache, chunk_hash
+    from ...embedding.src.store import VectorStore
+    store = VectorStore(dst, embedding.MODEL)
+    cache = EmbeddingCache(dst, embedding.MODEL or "", embedding.ENDPOINT_BASE or "")
+    cache_lock = threading.Lock()
+    seen: Set[str] = set()
+
+    def chunk(doc: Document) -> Document:
+        source: str = doc.outputs["translation"]
+        spans: List[Tuple[int, int]] = embedding.chunk_text(doc.text)
+        hashes: List[str] = [chunk_hash(doc.text[start:end]) for start, end in spans]
+        with cache_lock:
+            if cache.file_hashes(source) == hashes:
+                return doc
+            known: Dict[str, int] = cache.lookup(hashes)
+        doc.hashes = hashes
+        doc.chunks = []
+        for ii, ((start, end), hh) in enumerate(zip(spans, hashes)):
+            if hh in known or hh in seen:
+                continue
+            seen.add(hh)
+            doc.chunks.append((doc.text[start:end], {
+                "hash": hh, "source": source, "chunk": ii, "start": start, "end": end
+            }))
+        return doc
+
+    def embed(doc: Document) -> Document:
+        vectors = [
+            embedding.embed(texts)
+            for texts, _ in embedding.iter_batches(iter(doc.chunks))
+        ]
+        doc.vectors = np.concatenate(vectors) if vectors else None
+        return doc
+
+    def append(doc: Document) -> Document:
+        with cache_lock:
+            if doc.vectors is not None:
+                start: int = store.count
+                store.append(doc.vectors, [meta for _, meta in doc.chunks])
+                cache.add({meta["hash"]: start + ii for ii, (_, meta) in enumerate(doc.chunks)})
+            if doc.hashes is not None:
+                cache.set_file_hashes(doc.outputs["translation"], doc.hashes)
+        doc.outputs["embedding"] = dst
+        doc.chunks, doc.hashes, doc.vectors = [], None, None
+        return doc
+
+    return [
+        Stage("chunk", chunk, 1), Stage("embedding", embed, workers), Stage("store", append, 1)
+    ], cache
+
+
+def _print_summary(pipeline: Pipeline) -> None:
+    for stats in pipeline.summary():
+        first_done: str = (
+            "-" if stats["first_done_sec"] is None else f"{stats['first_done_sec']:.1f} sec"
+        )
+        print(
+            f"{stats['stage']}: {stats['workers']} workers, {stats['done']} done, "
+            f"{stats['dropped']} dropped, {stats['failed']} failed, "
+            f"{stats['mean_sec']:.2f} sec/item, {stats['items_per_sec']:.2f} items/sec, "
+            f"{stats['utilization']:.0%} busy, first done at {first_done}"
+        )
+    if pipeline.latencies_sec:
+        print(
+            f"end-to-end latency: first {pipeline.latencies_sec[0]:.1f} sec, "
+            f"max {max(pipeline.latencies_sec):.1f} sec, "
+            f"elapsed {pipeline.elapsed_sec:.1f} sec."
+        )
+
+
+def main(
+    src: str, mode: str = MODE_OCR,
+    language: str = LANGUAGE_TO, from_language: str | None = None,
+    speech_language: str = SPEECH_LANGUAGE, fast_mode: bool = False,
+    bounding_rect: List[int] | None = None, dst: str | None = None,
+    recognize_workers: int = RECOGNIZE_WORKERS,
+    translate_workers: int = TRANSLATE_WORKERS,
+    embed_workers: int = EMBED_WORKERS, queue_size: int = QUEUE_SIZE
+) -> List[Dict[str, Any]]:
+    """Recognizes, translates and optionally embeds the files in a directory
+    in one pipelined run.
+
+    Instead of running `azure_test_ocr`, `azure_test_ocr_merge_texts`,
+    `azure_test_translation` and `azure_test_embedding` one after another over
+    the whole directory, each file moves to the next stage as soon as it is
+    done. The stages run concurrently with their own numbers of workers and
+    are connected by queues of at most `queue_size` files, so a slow stage
+    holds back the earlier ones instead of piling up their outputs.
+    The outputs are saved at the same paths as the CLIs save them, and the
+    outputs already saved are read instead of calling the service again,
+    so an interrupted run can simply be run again.
+
+    Args:
+        src (str): The directory of the images (`ocr`) or audio files (`stt`).
+        mode (str, optional): One of MODES. Defaults to MODE_OCR.
+        language (str, optional): The language to translate into.
+            Defaults to LANGUAGE_TO.
+        from_language (str, optional): The language to translate from.
+            Defaults to the language of `speech_language` in `stt` mode,
+            or else `translation.LANGUAGE_FROM`.
+        speech_language (str, optional): The language to transcribe the audio in.
+            Defaults to SPEECH_LANGUAGE.
+        fast_mode (bool, optional): Uses the fast transcription API if True.
+        bounding_rect (list, optional): The rectangle to extract the recognized texts in.
+        dst (str, optional): The directory of the vector store to embed the
+            translations into. They are not embedded if None.
+        recognize_workers (int, optional): Defaults to RECOGNIZE_WORKERS.
+        translate_workers (int, optional): Defaults to TRANSLATE_WORKERS.
+        embed_workers (int, optional): Defaults to EMBED_WORKERS.
+        queue_size (int, optional): Defaults to QUEUE_SIZE.
+
+    Returns:
+        list of dict: The statistics of the stages, see `StageStats.as_dict`.
+
+    Raises:
+        NotADirectoryError: If `src` is not a directory.
+        ValueError: If `mode` is not one of MODES.
+    """
+    if not os.path.isdir(src):
+        raise NotADirectoryError("'src' must be a directory path.")
+    if mode not in MODES:
+        raise ValueError(f"'mode' must be one of {MODES}.")
+    stages: List[Stage] = []
+    if mode == MODE_OCR:
+        stages, text_dir = ocr_stages(src, bounding_rect, recognize_workers)
+    else:
+        stages, text_dir = stt_stages(src, speech_language, fast_mode, recognize_workers)
+        if from_language is None:
+            from_language = speech_language.split("-")[0]
+    stage, translated_dir = translation_stage(
+        text_dir, from_language or translation.LANGUAGE_FROM, language, translate_workers
+    )
+    stages.append(stage)
+    cache = None
+    if dst is not None:
+        # pylint: disable=import-outside-toplevel
+        from ...embedding.src import main as embedding
+        if not embedding.ENDPOINT_KEY:
+            warnings.warn("No key for Azure OpenAI embedding allocated.")
+            return []
+        embed_stages, cache = embedding_stages(dst, embed_workers)
+        stages.extend(embed_stages)
+
+    pipeline = Pipeline(stages, queue_size)
+    print(f"run {' -> '.join(stage.name for stage in stages)}...")
+    documents: List[Document] = []
+    try:
+        extensions: Set[str] = IMAGE_EXTENSIONS if mode == MODE_OCR else AUDIO_EXTENSIONS
+        for doc in pipeline.run(iter_documents(src, extensions)):
+            documents.append(doc)
+            print(f"done: {doc.name} ({pipeline.latencies_sec[-1]:.1f} sec)")
+    except KeyboardInterrupt:
+        print("stop due to KeyboardInterrupt.")
+        return pipeline.summary()
+    finally:
+        if cache is not None:
+            cache.close()
+    _print_summary(pipeline)
+    print("save a merged translated...")
+    translation.save(
+        os.path.join(translated_dir, MERGED_FILENAME),
+        "\n\n".join(
+            _read(doc.outputs["translation"])
+            for doc in sorted(documents, key=lambda doc: doc.name)
+        )
+    )
+    print("done.")
+    return pipeline.summary()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", type=str, help="the directory of images or audio files")
+    parser.add_argument(
+        "--mode", dest="mode", type=str, choices=MODES, default=MODE_OCR
+    )
+    parser.add_argument(
+        "--la", dest="la", type=str, default=LANGUAGE_TO,
+        help="language to translate into"
+    )
+    parser.add_argument(
+        "--la_from", dest="la_from", type=str, default=None,
+        help="language to translate from"
+    )
+    parser.add_argument(
+        "--speech_la", dest="speech_la", type=str, default=SPEECH_LANGUAGE,
+        help="language to transcribe the audio in"
+    )
+    parser.add_argument(
+        "--fast_mode", dest="fast_mode", action="store_true"
+    )
+    parser.add_argument(
+        "--bounding_rect", dest="bounding_rect", nargs=4,
+        type=int, default=None
+    )
+    parser.add_argument(
+        "--dst", dest="dst", type=str, default=None,
+        help="the directory of a vector store to embed the translations into"
+    )
+    parser.add_argument(
+        "--recognize_workers", dest="recognize_workers", type=int, default=RECOGNIZE_WORKERS
+    )
+    parser.add_argument(
+        "--translate_workers", dest="translate_workers", type=int, default=TRANSLATE_WORKERS
+    )
+    parser.add_argument(
+        "--embed_workers", dest="embed_workers", type=int, default=EMBED_WORKERS
+    )
+    parser.add_argument(
+        "--queue_size", dest="queue_size", type=int, default=QUEUE_SIZE
+    )
+    args = parser.parse_args()
+    main(
+        args.src, args.mode, args.la, args.la_from, args.speech_la, args.fast_mode,
+        args.bounding_rect, args.dst, args.recognize_workers, args.translate_workers,
+        args.embed_workers, args.queue_size
+    )
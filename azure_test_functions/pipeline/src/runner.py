@@ -0,0 +1,206 @@
+"""runner.py
+
+Runner of stages connected by bounded in-memory queues.
+
+Each stage has its own worker threads reading items from the queue before it
+and putting their results into the queue after it. An item moves to the
+next stage as soon as it is done, and a worker blocks while the next queue
+is full, so a slow stage holds back the stages before it (backpressure)
+instead of letting the intermediate results pile up in memory.
+"""
+
+from dataclasses import dataclass
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+QUEUE_SIZE: int = 8
+
+_DONE: object = object()
+
+
+@dataclass
+class Stage:
+    """A step of a pipeline.
+
+    `func` takes an item and returns the item to pass to the next stage,
+    or None to drop it. An item whose `func` raises is counted as failed
+    and dropped, and the other items go on.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+class StageStats:
+    """Throughput of a stage.
+
+    Args:
+        name (str): The name of the stage.
+        workers (int): The number of worker threads.
+    """
+
+    def __init__(self, name: str, workers: int) -> None:
+        self.name: str = name
+        self.workers: int = workers
+        self._lock = threading.Lock()
+        self.n_done: int = 0
+        self.n_dropped: int = 0
+        self.n_failed: int = 0
+        self.busy_sec: float = 0.0
+        self.first_done_sec: float | None = None
+        self.last_done_sec: float | None = None
+
+    def record(self, busy_sec: float, since_start_sec: float, outcome: str) -> None:
+        """Counts an item which is `done`, `dropped` or `failed`."""
+        with self._lock:
+            self.busy_sec += busy_sec
+            if outcome == "failed":
+                self.n_failed += 1
+                return
+            if outcome == "dropped":
+                self.n_dropped += 1
+            else:
+                self.n_done += 1
+            if self.first_done_sec is None:
+                self.first_done_sec = since_start_sec
+            self.last_done_sec = since_start_sec
+
+    def as_dict(self, elapsed_sec: float) -> Dict[str, Any]:
+        """Returns the counts, the mean seconds per item and the items per second.
+
+        Args:
+            elapsed_sec (float): The seconds since the pipeline started.
+        """
+        with self._lock:
+            n_items: int = self.n_done + self.n_dropped + self.n_failed
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "done": self.n_done,
+                "dropped": self.n_dropped,
+                "failed": self.n_failed,
+                "mean_sec": self.busy_sec / n_items if n_items else 0.0,
+                "items_per_sec": n_items / elapsed_sec if elapsed_sec > 0 else 0.0,
+                "utilization": (
+                    self.busy_sec / (elapsed_sec * self.workers) if elapsed_sec > 0 else 0.0
+                ),
+                "first_done_sec": self.first_done_sec,
+            }
+
+
+class Pipeline:
+    """Stages run concurrently over a stream of items.
+
+    Args:
+        stages (list of Stage): The stages in order.
+        queue_size (int, optional): The maximum items waiting before each stage.
+            Defaults to QUEUE_SIZE.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = QUEUE_SIZE) -> None:
+        if not stages:
+            raise ValueError("'stages' must not be empty.")
+        self.stages: List[Stage] = stages
+        self.queue_size: int = queue_size
+        self.stats: List[StageStats] = []
+        self.latencies_sec: List[float] = []
+        self._started_at: float = 0.0
+        self._finished_at: float | None = None
+
+    @property
+    def elapsed_sec(self) -> float:
+        """The seconds since the pipeline started, up to its end."""
+        end: float = time.perf_counter() if self._finished_at is None else self._finished_at
+        return end - self._started_at
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Passes items through the stages.
+
+        `items` is consumed lazily by a feeder thread, so it may be a
+        generator listing a directory. The results are yielded in order of
+        completion, not of input.
+
+        Args:
+            items (iterable): The inputs of the first stage.
+
+        Yields:
+            The outputs of the last stage.
+        """
+        self._started_at = time.perf_counter()
+        self._finished_at = None
+        self.stats = [StageStats(stage.name, stage.workers) for stage in self.stages]
+        self.latencies_sec = []
+        queues: List[queue.Queue[Tuple[float, Any] | object]] = [
+            queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+        threads: List[threading.Thread] = [
+            threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)
+        ]
+        for ii, stage in enumerate(self.stages):
+            remaining: List[int] = [stage.workers]
+            lock = threading.Lock()
+            threads.extend(
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, self.stats[ii], queues[ii], queues[ii + 1], remaining, lock),
+                    daemon=True
+                )
+                for _ in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+        while True:
+            entry = queues[-1].get()
+            if entry is _DONE:
+                break
+            assert isinstance(entry, tuple)
+            entered_at, item = entry
+            self.latencies_sec.append(time.perf_counter() - entered_at)
+            yield item
+        self._finished_at = time.perf_counter()
+
+    def _feed(self, items: Iterable[Any], dst: "queue.Queue[Tuple[float, Any] | object]") -> None:
+        try:
+            for item in items:
+                dst.put((time.perf_counter(), item))
+        finally:
+            dst.put(_DONE)
+
+    def _work(
+        self, stage: Stage, stats: StageStats,
+        src: "queue.Queue[Tuple[float, Any] | object]",
+        dst: "queue.Queue[Tuple[float, Any] | object]",
+        remaining: List[int], lock: threading.Lock
+    ) -> None:
+        while True:
+            entry = src.get()
+            if entry is _DONE:
+                # let the other workers of the stage see the end as well,
+                # and tell the next stage when the last one has finished.
+                src.put(_DONE)
+                with lock:
+                    remaining[0] -= 1
+                    is_last: bool = remaining[0] == 0
+                if is_last:
+                    dst.put(_DONE)
+                return
+            assert isinstance(entry, tuple)
+            entered_at, item = entry
+            st: float = time.perf_counter()
+            try:
+                result = stage.func(item)
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                stats.record(time.perf_counter() - st, time.perf_counter() - self._started_at, "failed")
+                print(f"failure in {stage.name}: {item}: {ex!r}. skip.")
+                continue
+            now: float = time.perf_counter()
+            stats.record(now - st, now - self._started_at, "dropped" if result is None else "done")
+            if result is not None:
+                dst.put((entered_at, result))
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Returns the statistics of the stages, see `StageStats.as_dict`."""
+        elapsed_sec: float = self.elapsed_sec
+        return [stats.as_dict(elapsed_sec) for stats in self.stats]
@@ -0,0 +1,12 @@
+"""service"""
+
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as service
+
+__all__ = ["service"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "service": ".src.main"
+}, fallback=".src.main")
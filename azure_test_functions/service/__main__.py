@@ -0,0 +1,35 @@
+"""service"""
+
+from .src.main import main, HOST, JOBS, MAX_WORKERS, PORT
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host", dest="host", type=str, default=HOST
+    )
+    parser.add_argument(
+        "--port", dest="port", type=int, default=PORT
+    )
+    parser.add_argument(
+        "--socket", dest="socket", type=str, default=None,
+        help="the path of a Unix socket to listen on instead of the port"
+    )
+    parser.add_argument(
+        "--spool", dest="spool", type=str, default=None,
+        help="a directory to run the jobs put into"
+    )
+    parser.add_argument(
+        "--no_http", dest="no_http", action="store_true"
+    )
+    parser.add_argument(
+        "--kinds", dest="kinds", type=str, nargs="+", choices=list(JOBS), default=None
+    )
+    parser.add_argument(
+        "--max_workers", dest="max_workers", type=int, default=MAX_WORKERS
+    )
+    args = parser.parse_args()
+    main(
+        args.host, args.port, args.socket, args.spool, args.no_http,
+        args.kinds, args.max_workers
+    )
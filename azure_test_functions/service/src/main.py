@@ -0,0 +1,528 @@
+"""service
+
+Resident worker running the service functions for other processes.
+
+A CLI invocation pays for the start of Python, the imports of the SDKs and
+new connections before it sends one request. The worker pays for them once:
+it imports the modules and creates their clients at start, and then runs the
+jobs of other processes with the same warm clients:
+    * over HTTP, on a TCP port or a Unix socket: `POST /<kind>` with the
+      parameters of the job as a JSON object, answered by `{"result": ...}`,
+    * from a spool directory: a `<name>.json` file holding
+      `{"kind": ..., "params": {...}}` is moved to `running/<worker>/` while
+      it runs, and its result is written to `done/<name>.json` or
+      `failed/<name>.json`. The jobs left running by a dead worker are moved
+      back into the spool.
+At most `max_workers` jobs run at once over both; an HTTP request waiting
+longer than QUEUE_TIMEOUT_SEC for a free slot is answered by 503.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Dict, List, Set
+import urllib.request
+from ...common.src.manifest import default_worker, is_worker_alive
+from ...common.src.metrics import METRICS
+from ...common.src.scanner import JSON_EXTENSIONS, scan
+
+HOST: str = "127.0.0.1"
+PORT: int = 8765
+MAX_WORKERS: int = 8
+QUEUE_TIMEOUT_SEC: float = 60.0
+POLL_SEC: float = 1.0
+TIMEOUT_SEC: float = 600.0
+RUNNING_DIRNAME: str = "running"
+DONE_DIRNAME: str = "done"
+FAILED_DIRNAME: str = "failed"
+
+
+@dataclass
+class Job:
+    """A kind of job.
+
+    Args:
+        module (str): The module running the job, relative to the package.
+        required (list of str): The names of the required parameters.
+        run (callable): Runs the job on the module with the parameters.
+        warm (callable): Creates the clients of the module.
+    """
+    module: str
+    required: List[str]
+    run: Callable[[Any, Dict[str, Any]], Any]
+    warm: Callable[[Any], Any]
+
+
+@functools.lru_cache(maxsize=1)
+def _bing_session() -> Any:
+    return importlib.import_module("...bing_search.src.main", __package__).create_session()
+
+
+def _ocr(module: Any, params: Dict[str, Any]) -> Any:
+    analyzed: Dict[str, Any] = module.analyze(params["path"])
+    if params.get("dst"):
+        module.save(params["dst"], analyzed)
+    return analyzed
+
+
+def _translation(module: Any, params: Dict[str, Any]) -> Any:
+    return module.translate(
+        params["text"], params.get("from_language") or module.LANGUAGE_FROM,
+        params.get("language") or module.LANGUAGE_TO
+    )
+
+
+def _speech_to_text(module: Any, params: Dict[str, Any]) -> Any:
+    language: str = params.get("language") or module.LANGUAGE
+    if params.get("fast_mode", True):
+        return module.analyze_with_fast(params["path"], language)
+    return module.analyze(params["path"], language)
+
+
+def _gpt(module: Any, params: Dict[str, Any]) -> Any:
+    return module.chat(params["query"], int(params.get("max_tokens") or module.MAX_TOKENS))
+
+
+def _bing_search(module: Any, params: Dict[str, Any]) -> Any:
+    return module.search_with_retry(
+        params["query"], params.get("mkt") or module.MARKET_DEFAULT, _bing_session()
+    )
+
+
+def _embedding(module: Any, params: Dict[str, Any]) -> Any:
+    return module.embed(list(params["texts"])).tolist()
+
+
+JOBS: Dict[str, Job] = {
+    "ocr": Job("...ocr.src.main", ["path"], _ocr, lambda module: module.client()),
+    "translation": Job(
+        "...translation.src.main", ["text"], _translation, lambda module: module.client()
+    ),
+    "speech_to_text": Job(
+        "...speech_to_text.src.main", ["path"], _speech_to_text, lambda module: module.session()
+    ),
+    "gpt": Job("...gpt.src.main", ["query"], _gpt, lambda module: module.client()),
+    "bing_search": Job(
+        "...bing_search.src.main", ["query"], _bing_search, lambda module: _bing_session()
+    ),
+    "embedding": Job(
+        "...embedding.src.main", ["texts"], _embedding, lambda module: module.session()
+    ),
+}
+
+
+class BusyError(RuntimeError):
+    """Raised if no slot for a job is free within the timeout."""
+
+
+class ParameterError(ValueError):
+    """Raised if the parameters of a job are missing or not a JSON object."""
+
+
+class Worker:
+    """Runs jobs with the clients of the modules kept warm.
+
+    Args:
+        kinds (list of str, optional): The kinds of jobs to accept, keys of JOBS.
+            Every kind if None.
+        max_workers (int, optional): The number of jobs running at once. Defaults to MAX_WORKERS.
+
+    Raises:
+        ValueError: If a kind is not in JOBS.
+    """
+
+    def __init__(self, kinds: List[str] | None = None, max_workers: int = MAX_WORKERS) -> None:
+        unknown: List[str] = [kind for kind in kinds or [] if kind not in JOBS]
+        if unknown:
+            raise ValueError(f"unknown kinds of jobs: {unknown}. must be some of {list(JOBS)}.")
+        self.kinds: List[str] = list(kinds or JOBS)
+        self.max_workers: int = max_workers
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self.active: int = 0
+
+    def warm(self) -> None:
+        """Imports the modules and creates their clients.
+
+        A module whose SDK is not installed is reported and skipped, so that
+        the other kinds of jobs are still served.
+        """
+        for kind in self.kinds:
+            job: Job = JOBS[kind]
+            st: float = time.perf_counter()
+            try:
+                job.warm(importlib.import_module(job.module, __package__))
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                print(f"failure in warming up {kind}: {ex!r}.")
+                continue
+            print(f"{kind} ready in {time.perf_counter() - st:.2f} sec.")
+
+    def run(
+        self, kind: str, params: Dict[str, Any], timeout: float | None = QUEUE_TIMEOUT_SEC
+    ) -> Any:
+        """Runs a job when a slot is free.
+
+        Args:
+            kind (str): One of `kinds`.
+            params (dict): The parameters of the job.
+            timeout (float, optional): The time to wait for a free slot in seconds.
+                Waits forever if None.
+
+        Returns:
+            Any: The JSON serializable result of the job.
+
+        Raises:
+            KeyError: If `kind` is not accepted.
+            ParameterError: If a required parameter is missing.
+            BusyError: If no slot is free within `timeout`.
+            Exception: The errors of the job.
+        """
+        if kind not in self.kinds:
+            raise KeyError(kind)
+        job: Job = JOBS[kind]
+        missing: List[str] = [key for key in job.required if key not in params]
+        if missing:
+            raise ParameterError(f"missing parameters of {kind}: {missing}")
+        if not self._slots.acquire(timeout=timeout):
+            METRICS.inc("jobs_total", kind=kind, outcome="busy")
+            raise BusyError(f"no free slot for {kind} in {timeout} sec")
+        with self._lock:
+            self.active += 1
+            METRICS.set("jobs_active", self.active)
+        try:
+            with METRICS.timer("job_seconds", kind=kind):
+                result = job.run(importlib.import_module(job.module, __package__), params)
+        except BaseException:
+            METRICS.inc("jobs_total", kind=kind, outcome="error")
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+                METRICS.set("jobs_active", self.active)
+            self._slots.release()
+        METRICS.inc("jobs_total", kind=kind, outcome="ok")
+        return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # the headers and the body are sent separately
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def address_string(self) -> str:
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def _reply(self, status: int, value: Any, content_type: str = "application/json") -> None:
+        data: bytes = (
+            value.encode("utf-8") if isinstance(value, str) else json.dumps(value).encode("utf-8")
+        )
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        worker: Worker = self.server.worker
+        if self.path == "/health":
+            self._reply(200, {
+                "status": "ok", "kinds": worker.kinds,
+                "active": worker.active, "max_workers": worker.max_workers
+            })
+        elif self.path == "/metrics":
+            self._reply(200, METRICS.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._reply(404, {"error": f"not found: {self.path}"})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        length: int = int(self.headers.get("Content-Length") or 0)
+        kind: str = self.path.strip("/")
+        try:
+            try:
+                params: Any = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as ex:
+                raise ParameterError(f"the parameters are not valid JSON: {ex}") from ex
+            if not isinstance(params, dict):
+                raise ParameterError("the parameters must be a JSON object.")
+            result: Any = self.server.worker.run(kind, params)
+        except KeyError as ex:
+            if kind in self.server.worker.kinds:
+                self._reply(500, {"error": repr(ex)})
+            else:
+                self._reply(404, {"error": f"unknown kind of job: {kind}"})
+            return
+        except ParameterError as ex:
+            self._reply(400, {"error": str(ex)})
+            return
+        except BusyError as ex:
+            self._reply(503, {"error": str(ex)})
+            return
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            self._reply(500, {"error": repr(ex)})
+            return
+        self._reply(200, {"result": result})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    handler: type = _Handler
+
+    def __init__(self, address: Any, worker: Worker) -> None:
+        super().__init__(address, self.handler)
+        self.worker: Worker = worker
+
+
+class _UnixHandler(_Handler):
+    disable_nagle_algorithm = False
+
+
+class _UnixServer(_Server):
+    address_family = socket.AF_UNIX
+    handler = _UnixHandler
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):  # type: ignore[arg-type]
+            os.remove(self.server_address)  # type: ignore[arg-type]
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def serve_http(
+    worker: Worker, host: str = HOST, port: int = PORT, socket_path: str | None = None
+) -> ThreadingHTTPServer:
+    """Starts the HTTP API in a background thread.
+
+    Args:
+        worker (Worker): The worker to run the jobs.
+        host (str, optional): Defaults to HOST.
+        port (int, optional): Defaults to PORT. A free port is chosen if 0.
+        socket_path (str, optional): The path of a Unix socket to listen on
+            instead of the TCP port.
+
+    Returns:
+        ThreadingHTTPServer: The server, to be stopped by `shutdown`.
+    """
+    server: _Server = (
+        _UnixServer(socket_path, worker) if socket_path else _Server((host, port), worker)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host!s}:{port}"
+
+
+def _write_json(fpath: str, value: Any) -> None:
+    tmppath: str = fpath + ".tmp"
+    with open(tmppath, "w", encoding="utf-8") as ff:
+        json.dump(value, ff, indent=4, ensure_ascii=False)
+    os.replace(tmppath, fpath)
+
+
+def _running_dir(spool: str) -> str:
+    """Returns the directory of this process in `running`, `<host>_<pid>`."""
+    return os.path.join(spool, RUNNING_DIRNAME, default_worker().replace(":", "_"))
+
+
+def reclaim_spool(spool: str) -> List[str]:
+    """Moves the jobs left in the `running` directory by dead workers back into the spool.
+
+    Each worker claims the jobs into its own directory in `running`, so the
+    jobs of a worker killed or crashed mid-job are run again by the others.
+    The jobs of the workers on other hosts are left alone, since it cannot be
+    told whether they still run.
+
+    Args:
+        spool (str): The spool directory.
+
+    Returns:
+        list of str: The file names of the jobs moved back.
+    """
+    names: List[str] = []
+    for entry in os.scandir(os.path.join(spool, RUNNING_DIRNAME)):
+        host, _, pid = entry.name.rpartition("_")
+        if not entry.is_dir() or is_worker_alive(f"{host}:{pid}") is not False:
+            continue
+        for name in os.listdir(entry.path):
+            try:
+                os.rename(os.path.join(entry.path, name), os.path.join(spool, name))
+            except OSError:  # reclaimed by another worker
+                continue
+            names.append(name)
+        try:
+            os.rmdir(entry.path)
+        except OSError:
+            pass
+    return names
+
+
+def run_spooled(worker: Worker, spool: str, name: str) -> bool:
+    """Runs a job claimed from a spool directory and writes its result.
+
+    Args:
+        worker (Worker): The worker to run the job.
+        spool (str): The spool directory.
+        name (str): The file name of the job in the `running` directory of this process.
+
+    Returns:
+        bool: True if the job succeeded.
+    """
+    fpath: str = os.path.join(_running_dir(spool), name)
+    st: float = time.perf_counter()
+    record: Dict[str, Any] = {}
+    try:
+        with open(fpath, "r", encoding="utf-8") as ff:
+            record = json.load(ff)
+        record["result"] = worker.run(str(record.get("kind")), dict(record.get("params") or {}), None)
+        dirname: str = DONE_DIRNAME
+    except Exception as ex:  # pylint: disable=broad-exception-caught
+        record["error"] = repr(ex)
+        dirname = FAILED_DIRNAME
+    record["elapsed_sec"] = time.perf_counter() - st
+    _write_json(os.path.join(spool, dirname, name), record)
+    os.remove(fpath)
+    return dirname == DONE_DIRNAME
+
+
+def serve_spool(worker: Worker, spool: str, stop: threading.Event | None = None) -> None:
+    """Runs the jobs put into a spool directory until `stop` is set.
+
+    A job is claimed by moving its file into the directory of this process in
+    `running`, which is atomic, so several workers may serve the same spool
+    directory. Jobs are claimed only while a slot is free, so the others stay
+    in the spool for the other workers. The jobs of dead workers are moved
+    back into the spool by `reclaim_spool` before each poll.
+
+    Args:
+        worker (Worker): The worker to run the jobs.
+        spool (str): The spool directory.
+        stop (threading.Event, optional): Stops serving when set. Serves forever if None.
+    """
+    running_dir: str = _running_dir(spool)
+    for dirpath in [
+        running_dir, os.path.join(spool, DONE_DIRNAME), os.path.join(spool, FAILED_DIRNAME)
+    ]:
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+    stop = stop or threading.Event()
+    running: Set["Future[bool]"] = set()
+    with ThreadPoolExecutor(worker.max_workers) as executor:
+        while not stop.is_set():
+            running = {future for future in running if not future.done()}
+            reclaimed: List[str] = reclaim_spool(spool)
+            if reclaimed:
+                print(f"reclaimed {len(reclaimed)} jobs of dead workers: {reclaimed}")
+            names: List[str] = sorted(entry.name for entry in scan(spool, JSON_EXTENSIONS))
+            for name in names[:worker.max_workers - len(running)]:
+                try:
+                    os.rename(os.path.join(spool, name), os.path.join(running_dir, name))
+                except OSError:  # claimed by another worker
+                    continue
+                running.add(executor.submit(run_spooled, worker, spool, name))
+            stop.wait(POLL_SEC)
+
+
+def submit(kind: str, params: Dict[str, Any], url: str = f"http://{HOST}:{PORT}") -> Any:
+    """Runs a job on a worker over HTTP and returns its result.
+
+    Raises:
+        urllib.error.HTTPError: If the worker answers with an error.
+    """
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/{kind}", data=json.dumps(params).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=TIMEOUT_SEC) as response:
+        return json.loads(response.read())["result"]
+
+
+def main(
+    host: str = HOST, port: int = PORT, socket_path: str | None = None,
+    spool: str | None = None, no_http: bool = False,
+    kinds: List[str] | None = None, max_workers: int = MAX_WORKERS
+) -> None:
+    """Serves jobs until interrupted.
+
+    Args:
+        host (str, optional): The host of the HTTP API. Defaults to HOST.
+        port (int, optional): The port of the HTTP API. Defaults to PORT.
+        socket_path (str, optional): The path of a Unix socket to listen on instead of the port.
+        spool (str, optional): A spool directory to run the jobs put into.
+        no_http (bool, optional): Serves only the spool directory if True.
+        kinds (list of str, optional): The kinds of jobs to accept. Every kind if None.
+        max_workers (int, optional): The number of jobs running at once. Defaults to MAX_WORKERS.
+
+    Raises:
+        ValueError: If nothing is to be served.
+    """
+    if no_http and spool is None:
+        raise ValueError("give 'spool' to serve without HTTP.")
+    worker = Worker(kinds, max_workers)
+    worker.warm()
+    server: ThreadingHTTPServer | None = None
+    if not no_http:
+        server = serve_http(worker, host, port, socket_path)
+        print(f"serving {worker.kinds} on {socket_path or _url(server)}. press Ctrl+C to stop.")
+    stop = threading.Event()
+    try:
+        if spool is not None:
+            print(f"serving the jobs put into {spool}.")
+            serve_spool(worker, spool, stop)
+        else:
+            while True:
+                time.sleep(1.0)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    print("stopped.")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host", dest="host", type=str, default=HOST
+    )
+    parser.add_argument(
+        "--port", dest="port", type=int, default=PORT
+    )
+    parser.add_argument(
+        "--socket", dest="socket", type=str, default=None,
+        help="the path of a Unix socket to listen on instead of the port"
+    )
+    parser.add_argument(
+        "--spool", dest="spool", type=str, default=None,
+        help="a directory to run the jobs put into"
+    )
+    parser.add_argument(
+        "--no_http", dest="no_http", action="store_true"
+    )
+    parser.add_argument(
+        "--kinds", dest="kinds", type=str, nargs="+", choices=list(JOBS), default=None
+    )
+    parser.add_argument(
+        "--max_workers", dest="max_workers", type=int, default=MAX_WORKERS
+    )
+    args = parser.parse_args()
+    main(
+        args.host, args.port, args.socket, args.spool, args.no_http,
+        args.kinds, args.max_workers
+    )
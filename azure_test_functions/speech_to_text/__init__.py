@@ -1,3 +1,14 @@
 """speech_to_text"""
 
-from .src import main as speech_to_text
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as speech_to_text
+    from .src import streaming as speech_to_text_streaming
+
+__all__ = ["speech_to_text", "speech_to_text_streaming"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "speech_to_text": ".src.main",
+    "speech_to_text_streaming": ".src.streaming"
+}, fallback=".src.main")
@@ -1,5 +1,7 @@
 """ocr"""
 
+from ..common.src.manifest import parse_shard
+from ..common.src.planner import ORDER_NAME, ORDERS
 from .src.main import main, LANGUAGE
 
 if __name__ == "__main__":
@@ -16,7 +18,48 @@ if __name__ == "__main__":
     parser.add_argument(
         "--fast_mode", dest="fast_mode", action="store_true"
     )
+    parser.add_argument(
+        "--retry_failed", dest="retry_failed", action="store_true"
+    )
+    parser.add_argument(
+        "--rescan", dest="rescan", action="store_true"
+    )
+    parser.add_argument(
+        "--recursive", dest="recursive", action="store_true"
+    )
+    parser.add_argument(
+        "--include", dest="include", type=str, nargs="+", default=None,
+        help="glob patterns of the files to transcribe"
+    )
+    parser.add_argument(
+        "--exclude", dest="exclude", type=str, nargs="+", default=None,
+        help="glob patterns of the files and directories to skip"
+    )
+    parser.add_argument(
+        "--shard", dest="shard", type=parse_shard, default=None,
+        help="'i/N' to process only the shard i of N of the files"
+    )
+    parser.add_argument(
+        "--lease_sec", dest="lease_sec", type=float, default=None,
+        help="claim the files with leases of this length to share them with other workers"
+    )
+    parser.add_argument(
+        "--plan", dest="plan", action="store_true",
+        help="print the estimated workload, time and cost without transcribing"
+    )
+    parser.add_argument(
+        "--order", dest="order", type=str, choices=ORDERS, default=ORDER_NAME,
+        help="the order to transcribe the files in"
+    )
+    parser.add_argument(
+        "--priority", dest="priority", type=str, nargs="+", default=None,
+        help="glob patterns of the files to transcribe first"
+    )
     args = parser.parse_args()
     if args.fast_mode:
         print("use the fast transcription API.")
-    main(args.src, args.la, args.fast_mode)
+    main(
+        args.src, args.la, args.fast_mode, args.retry_failed, args.rescan,
+        args.recursive, args.include, args.exclude, args.shard, args.lease_sec,
+        args.plan, args.order, args.priority
+    )
@@ -1,30 +1,31 @@
 """speech_to_text"""
 
+import functools
+import importlib
 import json
 import os
 import time
-from typing import Dict, List, Type, Union
-from typing_extensions import TypeAlias
-from azure.cognitiveservices.speech import (
-    SpeechConfig, AudioConfig, SpeechRecognizer,
-    SpeechRecognitionResult, SpeechRecognitionEventArgs,
-    ResultReason
-)
-from mutagen.mp3 import MP3
-from mutagen.wave import WAVE
+from typing import Dict, List, Tuple
 import requests
-
-MUTAGEN_ANALYZER_TYPE: TypeAlias = MP3 | WAVE
-MUTAGEN_ANALYZER_DICT: Dict[str, Union[Type[MP3], Type[WAVE]]] = {
-    "mp3": MP3,
-    "wav": WAVE
+from ...common.src.executor import EXECUTOR, CircuitOpenError
+from ...common.src.manifest import Manifest, existing_path, parse_shard
+from ...common.src.merged import MergedText
+from ...common.src.metrics import METRICS, profiled
+from ...common.src.planner import ORDER_NAME, ORDERS, Quota, estimate, schedule
+from ...common.src.scanner import AUDIO_EXTENSIONS, scan
+
+MUTAGEN_ANALYZER_DICT: Dict[str, Tuple[str, str]] = {
+    "mp3": ("mutagen.mp3", "MP3"),
+    "wav": ("mutagen.wave", "WAVE")
 }
 
 AUDIO_DURATION_SEC_DEFAULT: float = 120.0
+AUDIO_BYTES_PER_SEC: float = 16000.0
 TIMEOUT_SEC: float = 30.0
 WAIT_TIME_SEC: float = 3.0
 LANGUAGE: str = "ja-JP"
 DEFAULT_OUTPUT_DIRNAME: str = "transcribed"
+MERGED_FILENAME: str = "transcript_merged.txt"
 
 KEY_SPEECH: str = os.environ.get("AZURE_SPEECH_KEY", "")
 ENDPOINT_BASE: str = os.environ.get("AZURE_SPEECH_ENDPOINT", "")
@@ -32,9 +33,21 @@ ENDPOINT_REGION: str = os.environ.get(
     "AZURE_SPEECH_ENDPOINT_REGION", ""
 )
 ENDPOINT_FAST: str = f"{ENDPOINT_BASE}/speechtotext/transcriptions:transcribe?api-version=2024-05-15-preview"
+AUDIO_SEC_PER_SEC: float = float(os.environ.get("AZURE_SPEECH_AUDIO_SEC_PER_SEC", "0"))
+PRICE_PER_HOUR: float = float(os.environ.get("AZURE_SPEECH_PRICE_PER_HOUR", "1.0"))
+SEC_PER_AUDIO_SEC_DEFAULT: float = 0.1
+
+QUOTA: Quota = Quota(
+    unit="audio seconds",
+    units_per_sec=AUDIO_SEC_PER_SEC,
+    price_per_unit=PRICE_PER_HOUR / 3600,
+    sec_per_unit=SEC_PER_AUDIO_SEC_DEFAULT,
+    sec_per_item=WAIT_TIME_SEC
+)
 _KEYBOARD_INTERRUPT_FLAG: bool = False
 
 
+@METRICS.timed("speech_to_text.save")
 def save(fpath: str, value: str) -> None:
     """Saves a string to a specified file.
 
@@ -50,11 +63,20 @@ def save(fpath: str, value: str) -> None:
         ff.write(value)
 
 
+@functools.lru_cache(maxsize=1)
+def session() -> requests.Session:
+    """Returns the session of the fast transcription API, created once per process
+    so that its connections are reused by the calls of `analyze_with_fast`."""
+    return requests.Session()
+
+
+@METRICS.timed("speech_to_text.analyze_with_fast")
 def analyze_with_fast(fpath: str, lang: str = LANGUAGE) -> str:
     """Analyzes an audio file using the Fast Transcription API.
 
     Sends an audio file to the specified endpoint for transcription and 
     profanity filtering using a pre-defined configuration.
+    The request is sent through `EXECUTOR`, which retries throttled and failed requests.
 
     Args:
         fpath: The path to the audio file (WAV format).
@@ -78,19 +100,64 @@ def analyze_with_fast(fpath: str, lang: str = LANGUAGE) -> str:
         "channels": [0, 1]
     }
 
-    files = {
-        "audio": ("audio.wav", open(fpath, "rb")),
-        "definition": (None, json.dumps(definition), "application/json")
-    }
+    def post() -> requests.Response:
+        with open(fpath, "rb") as ff:
+            files = {
+                "audio": ("audio.wav", ff),
+                "definition": (None, json.dumps(definition), "application/json")
+            }
+            response = session().post(
+                ENDPOINT_FAST, headers=headers, files=files,
+                timeout=TIMEOUT_SEC * 2
+            )
+        response.raise_for_status()
+        return response
 
-    response = requests.post(
-        ENDPOINT_FAST, headers=headers, files=files,
-        timeout=TIMEOUT_SEC * 2
+    METRICS.inc(
+        "upload_bytes_total", os.path.getsize(fpath), function="speech_to_text.analyze_with_fast"
     )
-    response.raise_for_status()
+    response = EXECUTOR.call(ENDPOINT_BASE, post)
     return response.json()['combinedPhrases'][0]['text']
 
 
+def audio_duration_sec(fpath: str) -> float | None:
+    """Returns the duration of an audio file read from its header by `mutagen`,
+    or None if the format is not known.
+
+    Raises:
+        mutagen.MutagenError: If a file of MUTAGEN_ANALYZER_DICT cannot be read.
+    """
+    mutagen_analyzer = MUTAGEN_ANALYZER_DICT.get(
+        os.path.splitext(fpath)[-1][1:].lower(), None)
+    if mutagen_analyzer is not None:
+        module_name, class_name = mutagen_analyzer
+        audio = getattr(importlib.import_module(module_name), class_name)(fpath)
+    else:
+        try:
+            audio = importlib.import_module("mutagen").File(fpath)
+        except Exception:  # pylint: disable=broad-exception-caught
+            return None
+    if audio is None or audio.info is None:
+        return None
+    return float(audio.info.length)
+
+
+def measure(fpath: str) -> float:
+    """Returns the seconds of audio of a file, which the service charges for.
+
+    A file whose format is not known to `mutagen` is estimated from its size
+    at AUDIO_BYTES_PER_SEC (128 kbps).
+    """
+    try:
+        duration_sec: float | None = audio_duration_sec(fpath)
+    except Exception:  # pylint: disable=broad-exception-caught
+        duration_sec = None
+    if duration_sec is None:
+        return os.path.getsize(fpath) / AUDIO_BYTES_PER_SEC
+    return duration_sec
+
+
+@METRICS.timed("speech_to_text.analyze")
 def analyze(fpath: str, lang: str = LANGUAGE) -> str:
     """Analyzes an audio file and returns a list of speech recognition results.
 
@@ -105,6 +172,13 @@ def analyze(fpath: str, lang: str = LANGUAGE) -> str:
     Returns:
         A list of `SpeechRecognitionResult` objects containing the recognized text.
     """
+    # pylint: disable=import-outside-toplevel
+    from azure.cognitiveservices.speech import (
+        SpeechConfig, AudioConfig, SpeechRecognizer,
+        SpeechRecognitionResult, SpeechRecognitionEventArgs,
+        ResultReason
+    )
+    METRICS.inc("upload_bytes_total", os.path.getsize(fpath), function="speech_to_text.analyze")
     audio_config = AudioConfig(filename=fpath)
     speech_config = SpeechConfig(
         subscription=KEY_SPEECH, region=ENDPOINT_REGION,
@@ -115,13 +189,7 @@ def analyze(fpath: str, lang: str = LANGUAGE) -> str:
     )
     results: List[SpeechRecognitionResult] = []
 
-    audio_duration_sec: float = AUDIO_DURATION_SEC_DEFAULT
-    mutagen_analyzer = MUTAGEN_ANALYZER_DICT.get(
-        os.path.splitext(fpath)[-1][1:], None)
-    if mutagen_analyzer is not None:
-        audio: MUTAGEN_ANALYZER_TYPE = mutagen_analyzer(fpath)
-        if audio.info is not None:
-            audio_duration_sec = audio.info.length
+    duration_sec: float = audio_duration_sec(fpath) or AUDIO_DURATION_SEC_DEFAULT
 
     def continuous_recognition_handler(evt: SpeechRecognitionEventArgs) -> None:
         nonlocal results
@@ -133,7 +201,7 @@ def analyze(fpath: str, lang: str = LANGUAGE) -> str:
         speech_recognizer.start_continuous_recognition()
         previous_length: int = 0
         st = time.time()
-        while time.time() < st + audio_duration_sec:
+        while time.time() < st + duration_sec:
             time.sleep(1.0)
             if previous_length == 0:
                 continue
@@ -150,17 +218,52 @@ def analyze(fpath: str, lang: str = LANGUAGE) -> str:
     return " ".join(results)
 
 
-def analyze_from_dir(src: str, lang: str = LANGUAGE, fast_mode: bool = True) -> None:
+def _output_path(dstdir: str, fname: str) -> str:
+    return os.path.join(dstdir, os.path.splitext(fname)[0] + ".txt")
+
+
+@profiled("speech_to_text.analyze_from_dir")
+def analyze_from_dir(
+    src: str, lang: str = LANGUAGE, fast_mode: bool = True,
+    retry_failed: bool = False, rescan: bool = False,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, shard: Tuple[int, int] | None = None,
+    lease_sec: float | None = None, plan: bool = False,
+    order: str = ORDER_NAME, priority: List[str] | None = None
+) -> None:
     """Analyzes images in a directory and saves results as JSON files.
 
     This function iterates over image files in the specified directory, analyzes each image
     using the `analyze` function, and saves the analysis results as JSON files in a designated
     output directory.
+    The state of each file is recorded in a `Manifest` in the output directory,
+    so a rerun only analyzes the pending files without listing the directory again.
+    A failed file is recorded and skipped, and is retried if `retry_failed` is True.
+    The files are found by `scan`, which only yields the files with one of
+    AUDIO_EXTENSIONS unless `include` is given, and skips the output directory.
+    With `plan`, the seconds of audio of the pending files are read from their
+    headers and the time and the cost of the run are printed instead
+    (see `planner.estimate`).
 
     Args:
         src (str): The path to the directory containing image files.
         lang (str): The language to transcribe the audio in.
         fast_mode (bool): Use the fast transcription API if True.
+        retry_failed (bool, optional): Retries the files failed in the previous runs if True.
+        rescan (bool, optional): Lists the directory again to add new files if True.
+        recursive (bool, optional): Finds files in the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to transcribe,
+            e.g. `["*.m4a"]`, replacing the filter by AUDIO_EXTENSIONS.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        shard (tuple of int, optional): `(i, N)` to process only the shard `i` of `N`
+            of the files, split by the hashes of their names.
+        lease_sec (float, optional): Claims the files with leases of this length
+            to share them with other workers running on the same directory.
+        plan (bool, optional): Prints the estimated workload, time and cost
+            of the pending files without transcribing them if True.
+        order (str, optional): The order to transcribe the files in, one of
+            `planner.ORDERS`: `name`, `small` (the shortest first) or `large`.
+        priority (list of str, optional): Glob patterns of the files to transcribe first.
 
     Raises:
         NotADirectoryError: If the provided `src` is not a directory.
@@ -169,62 +272,85 @@ def analyze_from_dir(src: str, lang: str = LANGUAGE, fast_mode: bool = True) ->
     if not os.path.isdir(src):
         raise NotADirectoryError("'src' must be a directory path.")
     dstdir: str = os.path.join(src, DEFAULT_OUTPUT_DIRNAME)
-    if not os.path.exists(dstdir):
-        os.makedirs(dstdir)
-
-    analyzed_list = []
-    filename_list = [
-        fname for fname in os.listdir(src)
-        if os.path.isfile(os.path.join(src, fname))
-    ]
-    n_files = len(filename_list)
-    print(f"# of files: {n_files}")
-    try:
-        for ii, fname in enumerate(filename_list):
-            print(f"target: {fname} ({ii + 1}/{n_files})")
-            if not os.path.isfile(os.path.join(src, fname)):
-                continue
-            dstpath_target = os.path.join(
-                dstdir,
-                os.path.basename(fname).replace(
-                    os.path.splitext(fname)[-1],
-                    ".txt"
+    with Manifest(dstdir, shard, lease_sec) as manifest:
+        if rescan or not manifest.is_scanned():
+            manifest.add(
+                (entry.name, existing_path(_output_path(dstdir, entry.name)))
+                for entry in scan(
+                    src, None if include else AUDIO_EXTENSIONS, include,
+                    [DEFAULT_OUTPUT_DIRNAME, *(exclude or [])], recursive
                 )
             )
-            if os.path.exists(dstpath_target):
-                print("already analyzed. skip")
-                with open(dstpath_target, "r", encoding="utf-8") as ff:
-                    analyzed_list.append(ff.read())
-                continue
-            analyzed: str = ""
-            if fast_mode:
-                analyzed = analyze_with_fast(os.path.join(src, fname), lang)
-            else:
-                analyzed = analyze(os.path.join(src, fname), lang)
-            if _KEYBOARD_INTERRUPT_FLAG:
-                print("skip analysis of the rest files due to KeyBoardInterrupt.")
-                break
-            if not analyzed:
-                print("failure in analysis. skip.")
+        filename_list: List[str] = manifest.pending(retry_failed)
+        n_files = len(filename_list)
+        print(f"# of files: {n_files} ({manifest.summary()})")
+        if plan:
+            print(estimate(
+                filename_list, lambda name: measure(os.path.join(src, name)),
+                QUOTA, manifest.latencies()
+            ).format())
+            return
+        filename_list = schedule(
+            filename_list, lambda name: measure(os.path.join(src, name)), order, priority
+        )
+        try:
+            for ii, fname in enumerate(filename_list):
+                if not manifest.start(fname):
+                    continue
+                print(f"target: {fname} ({ii + 1}/{n_files})")
+                dstpath_target = _output_path(dstdir, fname)
+                st = time.perf_counter()
+                analyzed: str = ""
+                try:
+                    if fast_mode:
+                        analyzed = analyze_with_fast(os.path.join(src, fname), lang)
+                    else:
+                        analyzed = analyze(os.path.join(src, fname), lang)
+                except CircuitOpenError as ex:
+                    manifest.fail(fname, repr(ex), time.perf_counter() - st)
+                    print(f"{ex} stop.")
+                    break
+                except Exception as ex:  # pylint: disable=broad-exception-caught
+                    manifest.fail(fname, repr(ex), time.perf_counter() - st)
+                    print(f"failure in analysis: {ex!r}. skip.")
+                    time.sleep(WAIT_TIME_SEC)
+                    continue
+                if _KEYBOARD_INTERRUPT_FLAG:
+                    print("skip analysis of the rest files due to KeyBoardInterrupt.")
+                    break
+                if not analyzed:
+                    manifest.fail(fname, "no speech recognized", time.perf_counter() - st)
+                    print("failure in analysis. skip.")
+                    time.sleep(WAIT_TIME_SEC)
+                    continue
+                if not os.path.exists(os.path.dirname(dstpath_target)):
+                    os.makedirs(os.path.dirname(dstpath_target))
+                save(dstpath_target, analyzed)
+                manifest.succeed(fname, dstpath_target, time.perf_counter() - st)
+                print("done.")
                 time.sleep(WAIT_TIME_SEC)
-                continue
-            analyzed_list.append(analyzed)
-            save(dstpath_target, analyzed)
-            print("done.")
-            time.sleep(WAIT_TIME_SEC)
-    except KeyboardInterrupt:
-        _KEYBOARD_INTERRUPT_FLAG = True
-
-    if _KEYBOARD_INTERRUPT_FLAG:
-        return
-    print("save a merged transcript...")
-    dstpath_target = os.path.join(
-        dstdir, "transcript_merged.txt"
-    )
-    save(dstpath_target, "\n\n".join(analyzed_list))
-
-
-def main(file_or_dir_path: str, lang: str, fast_mode: bool) -> None:
+        except KeyboardInterrupt:
+            _KEYBOARD_INTERRUPT_FLAG = True
+
+        if _KEYBOARD_INTERRUPT_FLAG:
+            return
+        if (shard is not None or lease_sec is not None) and not manifest.is_finished():
+            print(f"other workers are still running. leave the merge to them. ({manifest.summary()})")
+            return
+        print(f"save a merged transcript... ({manifest.summary()})")
+        outputs: List[str] = manifest.outputs()
+    n_read: int = MergedText(os.path.join(dstdir, MERGED_FILENAME)).update(outputs)
+    print(f"{n_read} of {len(outputs)} transcripts merged.")
+
+
+def main(
+    file_or_dir_path: str, lang: str, fast_mode: bool,
+    retry_failed: bool = False, rescan: bool = False,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, shard: Tuple[int, int] | None = None,
+    lease_sec: float | None = None, plan: bool = False,
+    order: str = ORDER_NAME, priority: List[str] | None = None
+) -> None:
     """Analyzes an audio file or directory and saves the analysis results as JSON.
 
     This function recursively analyzes all audio files within the specified directory
@@ -237,13 +363,30 @@ def main(file_or_dir_path: str, lang: str, fast_mode: bool) -> None:
             Supported audio formats are WAV and MP3.
         lang (str): The language to transcribe the audio in.
         fast_mode (bool): Use the fast transcription API if True.
+        retry_failed (bool, optional): Retries the files failed in the previous runs if True.
+        rescan (bool, optional): Lists the directory again to add new files if True.
+        recursive (bool, optional): Finds files in the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to transcribe.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        shard (tuple of int, optional): `(i, N)` to process only the shard `i` of `N`
+            of the files, split by the hashes of their names.
+        lease_sec (float, optional): Claims the files with leases of this length
+            to share them with other workers running on the same directory.
+        plan (bool, optional): Prints the estimated workload, time and cost
+            of the pending files without transcribing them if True.
+        order (str, optional): The order to transcribe the files in, one of
+            `planner.ORDERS`: `name`, `small` (the shortest first) or `large`.
+        priority (list of str, optional): Glob patterns of the files to transcribe first.
 
     Raises:
         ValueError: If the specified path is invalid or if the analysis fails.
         OSError: If an error occurs during file operations.
     """
     if os.path.isdir(file_or_dir_path):
-        analyze_from_dir(file_or_dir_path, lang, fast_mode)
+        analyze_from_dir(
+            file_or_dir_path, lang, fast_mode, retry_failed, rescan,
+            recursive, include, exclude, shard, lease_sec, plan, order, priority
+        )
     else:
         print("analyze...")
         analyzed: str = ""
@@ -284,7 +427,48 @@ if __name__ == "__main__":
     parser.add_argument(
         "--fast_mode", dest="fast_mode", action="store_true"
     )
+    parser.add_argument(
+        "--retry_failed", dest="retry_failed", action="store_true"
+    )
+    parser.add_argument(
+        "--rescan", dest="rescan", action="store_true"
+    )
+    parser.add_argument(
+        "--recursive", dest="recursive", action="store_true"
+    )
+    parser.add_argument(
+        "--include", dest="include", type=str, nargs="+", default=None,
+        help="glob patterns of the files to transcribe"
+    )
+    parser.add_argument(
+        "--exclude", dest="exclude", type=str, nargs="+", default=None,
+        help="glob patterns of the files and directories to skip"
+    )
+    parser.add_argument(
+        "--shard", dest="shard", type=parse_shard, default=None,
+        help="'i/N' to process only the shard i of N of the files"
+    )
+    parser.add_argument(
+        "--lease_sec", dest="lease_sec", type=float, default=None,
+        help="claim the files with leases of this length to share them with other workers"
+    )
+    parser.add_argument(
+        "--plan", dest="plan", action="store_true",
+        help="print the estimated workload, time and cost without transcribing"
+    )
+    parser.add_argument(
+        "--order", dest="order", type=str, choices=ORDERS, default=ORDER_NAME,
+        help="the order to transcribe the files in"
+    )
+    parser.add_argument(
+        "--priority", dest="priority", type=str, nargs="+", default=None,
+        help="glob patterns of the files to transcribe first"
+    )
     args = parser.parse_args()
     if args.fast_mode:
         print("use the fast transcription API.")
-    main(args.src, args.la, args.fast_mode)
+    main(
+        args.src, args.la, args.fast_mode, args.retry_failed, args.rescan,
+        args.recursive, args.include, args.exclude, args.shard, args.lease_sec,
+        args.plan, args.order, args.priority
+    )
@@ -0,0 +1,411 @@
+"""streaming.py
+
+Streaming recognition of audio as it arrives.
+
+`analyze` reads a whole file through `AudioConfig(filename=...)`, so the
+first text is known only after the recording has ended. A `StreamRecognizer`
+writes chunks of PCM audio, e.g. from a generator, a socket or a recording
+process, into a `PushAudioInputStream` while the service recognizes them, and
+reports the interim results of the current utterance and the final result of
+each utterance as they arrive, through callbacks, an iterator (`recognize`)
+or an async iterator (`recognize_async`). The connection is opened before
+the first chunk is written, so the first interim text follows the speech by
+a few hundred milliseconds.
+
+Each recognizer has its own stream and connection, and the SDK delivers the
+results on its own threads, so several streams can be recognized at once in
+one process, e.g. with `asyncio.gather` over `recognize_async`.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import importlib
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import wave
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, List, Tuple
+)
+from ...common.src.metrics import METRICS
+from .main import ENDPOINT_REGION, KEY_SPEECH, LANGUAGE
+
+SAMPLE_RATE: int = 16000
+BITS_PER_SAMPLE: int = 16
+CHANNELS: int = 1
+CHUNK_SEC: float = 0.1
+SEGMENTATION_SILENCE_MS: int = 500
+STOP_TIMEOUT_SEC: float = 30.0
+INTERIM: str = "interim"
+FINAL: str = "final"
+
+
+@dataclass
+class StreamResult:
+    """A result of a stream.
+
+    Attributes:
+        kind (str): INTERIM for a hypothesis of the current utterance, replaced
+            by the next results, or FINAL for the result of an utterance.
+        text (str): The recognized text.
+        offset_sec (float): The start of the utterance in the audio.
+        latency_sec (float): The seconds from the first chunk written to the result.
+    """
+    kind: str
+    text: str
+    offset_sec: float
+    latency_sec: float
+
+
+class StreamError(RuntimeError):
+    """Raised when the recognition of a stream is canceled by an error."""
+
+
+def _sdk() -> Any:
+    return importlib.import_module("azure.cognitiveservices.speech")
+
+
+class StreamRecognizer:
+    """Continuous recognition of audio written in chunks.
+
+    Args:
+        lang (str, optional): The language of the audio. Defaults to LANGUAGE.
+        sample_rate (int, optional): The samples per second of the PCM audio.
+            Defaults to SAMPLE_RATE.
+        bits_per_sample (int, optional): The bits of a sample. Defaults to BITS_PER_SAMPLE.
+        channels (int, optional): The number of channels. Defaults to CHANNELS.
+        on_result (callable, optional): Called with each `StreamResult` on a thread of the SDK.
+        segmentation_silence_ms (int, optional): The silence closing an utterance,
+            shorter than the default of the service so that final results come
+            sooner. Defaults to SEGMENTATION_SILENCE_MS.
+    """
+
+    def __init__(
+        self, lang: str = LANGUAGE, sample_rate: int = SAMPLE_RATE,
+        bits_per_sample: int = BITS_PER_SAMPLE, channels: int = CHANNELS,
+        on_result: Callable[[StreamResult], None] | None = None,
+        segmentation_silence_ms: int = SEGMENTATION_SILENCE_MS
+    ) -> None:
+        self._speechsdk: Any = _sdk()
+        self._stream: Any = self._speechsdk.audio.PushAudioInputStream(
+            stream_format=self._speechsdk.audio.AudioStreamFormat(
+                samples_per_second=sample_rate, bits_per_sample=bits_per_sample,
+                channels=channels
+            )
+        )
+        speech_config = self._speechsdk.SpeechConfig(
+            subscription=KEY_SPEECH, region=ENDPOINT_REGION,
+            speech_recognition_language=lang
+        )
+        speech_config.set_property(
+            self._speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+            str(segmentation_silence_ms)
+        )
+        self._recognizer: Any = self._speechsdk.SpeechRecognizer(
+            speech_config=speech_config,
+            audio_config=self._speechsdk.audio.AudioConfig(stream=self._stream)
+        )
+        self._recognizer.recognizing.connect(self._on_recognizing)
+        self._recognizer.recognized.connect(self._on_recognized)
+        self._recognizer.canceled.connect(self._on_canceled)
+        self._recognizer.session_stopped.connect(self._on_stopped)
+        self._callbacks: List[Callable[[StreamResult], None]] = (
+            [on_result] if on_result is not None else []
+        )
+        self._stopped = threading.Event()
+        self._started: bool = False
+        self._closed: bool = False
+        self._first_write: float | None = None
+        self._first_result: bool = False
+        self.error: str | None = None
+
+    def __enter__(self) -> "StreamRecognizer":
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def subscribe(self, callback: Callable[[StreamResult], None]) -> None:
+        """Adds a callback called with each `StreamResult`."""
+        self._callbacks.append(callback)
+
+    def start(self) -> None:
+        """Opens the connection and starts the recognition, before the audio arrives."""
+        if self._started:
+            return
+        self._speechsdk.Connection.from_recognizer(self._recognizer).open(True)
+        self._recognizer.start_continuous_recognition_async().get()
+        self._started = True
+
+    def write(self, chunk: bytes) -> None:
+        """Writes a chunk of audio, starting the recognition if needed.
+        The chunks written after `close` or `abort` are dropped."""
+        if self._closed:
+            return
+        if not self._started:
+            self.start()
+        if self._first_write is None:
+            self._first_write = time.perf_counter()
+        self._stream.write(chunk)
+        METRICS.inc("upload_bytes_total", len(chunk), function="speech_to_text.stream")
+
+    def close(self, timeout: float = STOP_TIMEOUT_SEC) -> None:
+        """Ends the audio and waits for the final results of the rest of it.
+
+        Raises:
+            StreamError: If the recognition has been canceled by an error.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stream.close()
+        if self._started:
+            self._stopped.wait(timeout)
+            self._recognizer.stop_continuous_recognition_async().get()
+        if self.error is not None:
+            raise StreamError(self.error)
+
+    def abort(self) -> None:
+        """Ends the audio and stops the recognition at once, dropping the
+        results not received yet, e.g. when they are no longer read."""
+        if self._closed:
+            return
+        self._closed = True
+        self._stream.close()
+        if self._started:
+            self._recognizer.stop_continuous_recognition_async().get()
+
+    def feed(self, chunks: Iterable[bytes]) -> None:
+        """Writes the chunks as they come and closes the stream.
+
+        Raises:
+            StreamError: If the recognition has been canceled by an error.
+        """
+        for chunk in chunks:
+            if self._stopped.is_set() or self._closed:
+                break
+            self.write(chunk)
+        self.close()
+
+    def _emit(self, kind: str, result: Any) -> None:
+        latency_sec: float = (
+            time.perf_counter() - self._first_write if self._first_write is not None else 0.0
+        )
+        if not self._first_result:
+            self._first_result = True
+            METRICS.observe("stream_first_result_seconds", latency_sec)
+        stream_result = StreamResult(kind, result.text, result.offset / 1e7, latency_sec)
+        for callback in list(self._callbacks):
+            callback(stream_result)
+
+    def _on_recognizing(self, evt: Any) -> None:
+        if evt.result.text:
+            self._emit(INTERIM, evt.result)
+
+    def _on_recognized(self, evt: Any) -> None:
+        if evt.result.reason == self._speechsdk.ResultReason.RecognizedSpeech and evt.result.text:
+            self._emit(FINAL, evt.result)
+
+    def _on_canceled(self, evt: Any) -> None:
+        details = evt.cancellation_details
+        if details.reason == self._speechsdk.CancellationReason.Error and self.error is None:
+            self.error = f"{details.code}: {details.error_details}"
+        self._stopped.set()
+
+    def _on_stopped(self, evt: Any) -> None:  # pylint: disable=unused-argument
+        self._stopped.set()
+
+
+def recognize(
+    chunks: Iterable[bytes], lang: str = LANGUAGE, sample_rate: int = SAMPLE_RATE,
+    bits_per_sample: int = BITS_PER_SAMPLE, channels: int = CHANNELS
+) -> Iterator[StreamResult]:
+    """Yields the results of a stream of audio chunks as they arrive.
+
+    The chunks are written from another thread, so a slow source, e.g. a
+    socket, does not hold back the results.
+
+    Args:
+        chunks (iterable of bytes): The PCM audio.
+        lang (str, optional): The language of the audio. Defaults to LANGUAGE.
+        sample_rate (int, optional): The samples per second. Defaults to SAMPLE_RATE.
+        bits_per_sample (int, optional): The bits of a sample. Defaults to BITS_PER_SAMPLE.
+        channels (int, optional): The number of channels. Defaults to CHANNELS.
+
+    Yields:
+        StreamResult: The interim and final results.
+
+    Raises:
+        StreamError: If the recognition has been canceled by an error.
+    """
+    results: "queue.Queue[StreamResult | Exception | None]" = queue.Queue()
+    recognizer = StreamRecognizer(
+        lang, sample_rate, bits_per_sample, channels, on_result=results.put
+    )
+
+    def run() -> None:
+        try:
+            recognizer.feed(chunks)
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            results.put(ex)
+            return
+        results.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        recognizer.abort()  # if the results are no longer read
+
+
+async def recognize_async(
+    chunks: AsyncIterable[bytes] | Iterable[bytes], lang: str = LANGUAGE,
+    sample_rate: int = SAMPLE_RATE, bits_per_sample: int = BITS_PER_SAMPLE,
+    channels: int = CHANNELS
+) -> AsyncIterator[StreamResult]:
+    """Yields the results of a stream of audio chunks as they arrive, in an event loop.
+
+    The results are handed from the threads of the SDK to the loop, so many
+    streams can be recognized concurrently, e.g. one task per client.
+
+    Args:
+        chunks (async iterable or iterable of bytes): The PCM audio. A plain
+            iterable is read in the default executor of the loop.
+        lang (str, optional): The language of the audio. Defaults to LANGUAGE.
+        sample_rate (int, optional): The samples per second. Defaults to SAMPLE_RATE.
+        bits_per_sample (int, optional): The bits of a sample. Defaults to BITS_PER_SAMPLE.
+        channels (int, optional): The number of channels. Defaults to CHANNELS.
+
+    Yields:
+        StreamResult: The interim and final results.
+
+    Raises:
+        StreamError: If the recognition has been canceled by an error.
+    """
+    loop = asyncio.get_running_loop()
+    results: "asyncio.Queue[StreamResult | Exception | None]" = asyncio.Queue()
+
+    def put(result: StreamResult) -> None:
+        loop.call_soon_threadsafe(results.put_nowait, result)
+
+    recognizer = StreamRecognizer(lang, sample_rate, bits_per_sample, channels, on_result=put)
+
+    async def feed() -> None:
+        try:
+            if isinstance(chunks, AsyncIterable):
+                await loop.run_in_executor(None, recognizer.start)
+                async for chunk in chunks:
+                    recognizer.write(chunk)
+                await loop.run_in_executor(None, recognizer.close)
+            else:
+                await loop.run_in_executor(None, recognizer.feed, chunks)
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            results.put_nowait(ex)
+            return
+        results.put_nowait(None)
+
+    task = asyncio.ensure_future(feed())
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
+        await loop.run_in_executor(None, recognizer.abort)
+
+
+def wav_format(fpath: str) -> Tuple[int, int, int]:
+    """Returns the sample rate, the bits per sample and the channels of a WAV file."""
+    with wave.open(fpath, "rb") as wav:
+        return wav.getframerate(), wav.getsampwidth() * 8, wav.getnchannels()
+
+
+def iter_wav_chunks(
+    fpath: str, chunk_sec: float = CHUNK_SEC, realtime: bool = False
+) -> Iterator[bytes]:
+    """Yields the PCM audio of a WAV file in chunks.
+
+    Args:
+        fpath (str): The path of the WAV file.
+        chunk_sec (float, optional): The seconds of audio of a chunk. Defaults to CHUNK_SEC.
+        realtime (bool, optional): Yields the chunks at the pace of the audio,
+            as a recording would, if True.
+    """
+    with wave.open(fpath, "rb") as wav:
+        n_frames: int = max(int(wav.getframerate() * chunk_sec), 1)
+        st: float = time.monotonic()
+        ii: int = 0
+        while True:
+            data: bytes = wav.readframes(n_frames)
+            if not data:
+                return
+            if realtime:
+                time.sleep(max(st + ii * chunk_sec - time.monotonic(), 0.0))
+            ii += 1
+            yield data
+
+
+def iter_socket_chunks(sock: socket.socket, chunk_bytes: int = 6400) -> Iterator[bytes]:
+    """Yields the bytes received from a socket until the peer closes it."""
+    while True:
+        data: bytes = sock.recv(chunk_bytes)
+        if not data:
+            return
+        yield data
+
+
+def iter_stdin_chunks(chunk_bytes: int = 6400) -> Iterator[bytes]:
+    """Yields the bytes read from the standard input until its end."""
+    while True:
+        data: bytes = os.read(sys.stdin.fileno(), chunk_bytes)
+        if not data:
+            return
+        yield data
+
+
+def main(src: str, lang: str = LANGUAGE, realtime: bool = False) -> None:
+    """Prints the interim and final results of a WAV file, or of raw PCM audio
+    from the standard input (`-`) at SAMPLE_RATE, BITS_PER_SAMPLE and CHANNELS."""
+    chunks: Iterable[bytes]
+    if src == "-":
+        chunks, audio_format = iter_stdin_chunks(), (SAMPLE_RATE, BITS_PER_SAMPLE, CHANNELS)
+    else:
+        chunks, audio_format = iter_wav_chunks(src, realtime=realtime), wav_format(src)
+    for result in recognize(chunks, lang, *audio_format):
+        if result.kind == INTERIM:
+            print(f"\r{result.text}", end="", flush=True)
+        else:
+            print(f"\r{result.text} ({result.latency_sec:.2f} sec)")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "src", type=str, help="the path of a WAV file, or '-' for raw 16 kHz 16-bit mono PCM"
+    )
+    parser.add_argument(
+        "--la", dest="la", default=LANGUAGE,
+        help="language to transcribe the audio in"
+    )
+    parser.add_argument(
+        "--realtime", dest="realtime", action="store_true",
+        help="send a file at the pace of the audio, as a recording would be"
+    )
+    args = parser.parse_args()
+    main(args.src, args.la, args.realtime)
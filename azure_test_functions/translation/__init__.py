@@ -1,3 +1,12 @@
 """translation"""
 
-from .src import main as translation
+from typing import TYPE_CHECKING
+from ..common.src.lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .src import main as translation
+
+__all__ = ["translation"]
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    "translation": ".src.main"
+}, fallback=".src.main")
@@ -1,5 +1,8 @@
 """translation"""
 
+from ..common.src.manifest import parse_shard
+from ..common.src.planner import ORDER_NAME, ORDERS
+from ..common.src.watcher import DEBOUNCE_SEC, INTERVAL_SEC
 from .src.main import main, LANGUAGE_TO
 
 if __name__ == "__main__":
@@ -9,5 +12,58 @@ if __name__ == "__main__":
     parser.add_argument(
         "--la", dest="la", type=str, default=LANGUAGE_TO
     )
+    parser.add_argument(
+        "--retry_failed", dest="retry_failed", action="store_true"
+    )
+    parser.add_argument(
+        "--rescan", dest="rescan", action="store_true"
+    )
+    parser.add_argument(
+        "--recursive", dest="recursive", action="store_true"
+    )
+    parser.add_argument(
+        "--include", dest="include", type=str, nargs="+", default=None,
+        help="glob patterns of the files to translate"
+    )
+    parser.add_argument(
+        "--exclude", dest="exclude", type=str, nargs="+", default=None,
+        help="glob patterns of the files and directories to skip"
+    )
+    parser.add_argument(
+        "--shard", dest="shard", type=parse_shard, default=None,
+        help="'i/N' to process only the shard i of N of the files"
+    )
+    parser.add_argument(
+        "--lease_sec", dest="lease_sec", type=float, default=None,
+        help="claim the files with leases of this length to share them with other workers"
+    )
+    parser.add_argument(
+        "--plan", dest="plan", action="store_true",
+        help="print the estimated workload, time and cost without translating"
+    )
+    parser.add_argument(
+        "--order", dest="order", type=str, choices=ORDERS, default=ORDER_NAME,
+        help="the order to translate the files in"
+    )
+    parser.add_argument(
+        "--priority", dest="priority", type=str, nargs="+", default=None,
+        help="glob patterns of the files to translate first"
+    )
+    parser.add_argument(
+        "--watch", dest="watch", action="store_true",
+        help="keep translating the files added to or changed in the directory"
+    )
+    parser.add_argument(
+        "--interval", dest="interval", type=float, default=INTERVAL_SEC,
+        help="the seconds between polls of the directory in the watch mode"
+    )
+    parser.add_argument(
+        "--debounce", dest="debounce", type=float, default=DEBOUNCE_SEC,
+        help="the seconds a file must stay unchanged before it is translated in the watch mode"
+    )
     args = parser.parse_args()
-    main(args.src, args.la)
+    main(
+        args.src, args.la, args.retry_failed, args.rescan,
+        args.recursive, args.include, args.exclude, args.shard, args.lease_sec,
+        args.plan, args.order, args.priority, args.watch, args.interval, args.debounce
+    )
@@ -1,9 +1,20 @@
 """translation"""
 
+from __future__ import annotations
+import functools
 import os
 import time
-from azure.ai.translation.text import TextTranslationClient
-from azure.core.credentials import AzureKeyCredential
+from typing import TYPE_CHECKING, List, Tuple
+from ...common.src.executor import EXECUTOR, CircuitOpenError
+from ...common.src.manifest import Manifest, existing_path, parse_shard
+from ...common.src.merged import MergedText
+from ...common.src.metrics import METRICS, profiled
+from ...common.src.planner import ORDER_NAME, ORDERS, Quota, estimate, schedule
+from ...common.src.scanner import TEXT_EXTENSIONS, scan
+from ...common.src.watcher import DEBOUNCE_SEC, INTERVAL_SEC, SNAPSHOT_FILENAME, Watcher
+
+if TYPE_CHECKING:
+    from azure.ai.translation.text import TextTranslationClient
 
 TIMEOUT_SEC: float = 30.0
 WAIT_TIME_SEC: float = 5.0
@@ -11,15 +22,28 @@ DEFAULT_OUTPUT_DIRNAME: str = "translated"
 LANGUAGE_FROM: str = "en"
 LANGUAGE_TO: str = "ja"
 EXCLUDE_SUFFIX: str = "merged"
+MERGED_FILENAME: str = "translated_merged.txt"
 
 KEY_TRANSLATION: str = os.environ.get("AZURE_TRANSLATION_KEY", "")
 ENDPOINT_BASE: str | None = os.environ.get("AZURE_TRANSLATION_ENDPOINT", None)
 ENDPOINT_REGION: str | None = os.environ.get("AZURE_TRANSLATION_ENDPOINT_REGION", None)
+CHARS_PER_HOUR: float = float(os.environ.get("AZURE_TRANSLATION_CHARS_PER_HOUR", "40000000"))
+PRICE_PER_MILLION_CHARS: float = float(os.environ.get("AZURE_TRANSLATION_PRICE_PER_MILLION", "10.0"))
+SEC_PER_CHAR_DEFAULT: float = 0.0002
+
+QUOTA: Quota = Quota(
+    unit="characters",
+    units_per_sec=CHARS_PER_HOUR / 3600,
+    price_per_unit=PRICE_PER_MILLION_CHARS / 1_000_000,
+    sec_per_unit=SEC_PER_CHAR_DEFAULT,
+    sec_per_item=WAIT_TIME_SEC
+)
 
 
 _KEYBOARD_INTERRUPT_FLAG: bool = False
 
 
+@METRICS.timed("translation.save")
 def save(fpath: str, value: str) -> None:
     """Saves a string to a specified file.
 
@@ -35,12 +59,34 @@ def save(fpath: str, value: str) -> None:
         ff.write(value)
 
 
+@functools.lru_cache(maxsize=1)
+def client() -> TextTranslationClient:
+    """Returns the client of the Azure Text Translation service.
+
+    The client is created once per process, so the SDK is imported and
+    the connection is opened only by the first call of `translate`.
+    """
+    # pylint: disable=import-outside-toplevel
+    from azure.ai.translation.text import TextTranslationClient
+    from azure.core.credentials import AzureKeyCredential
+    return TextTranslationClient(
+        endpoint=ENDPOINT_BASE,
+        credential=AzureKeyCredential(KEY_TRANSLATION),
+        region=ENDPOINT_REGION,
+        timeout=TIMEOUT_SEC,
+        retry_total=0
+    )
+
+
+@METRICS.timed("translation.translate")
 def translate(
     text: str, from_language: str = LANGUAGE_FROM,
     to_language: str = LANGUAGE_TO
 ) -> str | None:
     """Translates text from one language to another using Azure Text Translation service.
 
+    The request is sent through `EXECUTOR`, which retries throttled and failed requests.
+
     Args:
         text (str): The text to be translated.
         from_language (str, optional): The language code of the source text. 
@@ -56,18 +102,13 @@ def translate(
 
     """
     input_text_elements = [text]
+    METRICS.inc("upload_bytes_total", len(text.encode("utf-8")), function="translation.translate")
     translation: str | None = None
     try:
-        client: TextTranslationClient = TextTranslationClient(
-            endpoint=ENDPOINT_BASE,
-            credential=AzureKeyCredential(KEY_TRANSLATION),
-            region=ENDPOINT_REGION,
-            timeout=TIMEOUT_SEC
-        )
-        response = client.translate(
+        response = EXECUTOR.call(ENDPOINT_BASE or "", lambda: client().translate(
             body=input_text_elements, to_language=[
                 to_language], from_language=from_language
-        )
+        ))
         if response:
             translation = response[0].translations[0].text
     except KeyboardInterrupt:
@@ -95,22 +136,65 @@ def translate_from_file(fpath: str, language: str = LANGUAGE_TO) -> str | None:
         return translate(ff.read(), to_language=language)
 
 
-def translate_from_dir(src: str, language: str = LANGUAGE_TO) -> None:
+def measure(fpath: str) -> float:
+    """Returns the number of characters of a text file, which the service charges for."""
+    with open(fpath, "r", encoding="utf-8") as ff:
+        return float(len(ff.read()))
+
+
+def _output_path(dstdir: str, fname: str) -> str:
+    return os.path.join(dstdir, os.path.splitext(fname)[0] + "_translated.txt")
+
+
+@profiled("translation.translate_from_dir")
+def translate_from_dir(
+    src: str, language: str = LANGUAGE_TO,
+    retry_failed: bool = False, rescan: bool = False,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, shard: Tuple[int, int] | None = None,
+    lease_sec: float | None = None, plan: bool = False,
+    order: str = ORDER_NAME, priority: List[str] | None = None
+) -> None:
     """Translates text files from a directory to a specified language
     using Azure Text Translation service.
 
-    This function iterates through all text files (excluding files with extensions
-    in `EXCLUDE_SUFFIX`) in the specified directory and translates them
+    This function iterates through all text files (excluding files whose names
+    contain `EXCLUDE_SUFFIX`) in the specified directory and translates them
     to the target language using the `translate_from_file` function.
+    The files are found by `scan`, which only yields the files with one of
+    TEXT_EXTENSIONS unless `include` is given, and skips the output directory.
+    The translations of files in subdirectories are saved in the same
+    subdirectories of the output directory.
     The translated content is saved in a new file with the original filename appended with
     "_translated.txt". Existing translations are skipped.
     Finally, all translated content is merged into a single file named "translated_merged.txt"
-    in the output directory. 
+    in the output directory, updated incrementally from the translations added
+    or changed since the last merge (see `merged.MergedText`).
+    The state of each file is recorded in a `Manifest` in the output directory,
+    so a rerun only translates the pending files without listing the directory again.
+    A failed file is recorded and skipped, and is retried if `retry_failed` is True.
+    With `plan`, the characters of the pending files are counted and the time
+    and the cost of the run are printed instead (see `planner.estimate`).
 
     Args:
         src (str): The path to the directory containing the text files to be translated.
             Raises `ValueError` if the path is not a directory.
         language (str, optional): The language code of the target text. Defaults to `LANGUAGE_TO`.
+        retry_failed (bool, optional): Retries the files failed in the previous runs if True.
+        rescan (bool, optional): Lists the directory again to add new files if True.
+        recursive (bool, optional): Finds files in the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to translate,
+            e.g. `["*.md"]`, replacing the filter by TEXT_EXTENSIONS.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        shard (tuple of int, optional): `(i, N)` to process only the shard `i` of `N`
+            of the files, split by the hashes of their names.
+        lease_sec (float, optional): Claims the files with leases of this length
+            to share them with other workers running on the same directory.
+        plan (bool, optional): Prints the estimated workload, time and cost
+            of the pending files without translating them if True.
+        order (str, optional): The order to translate the files in, one of
+            `planner.ORDERS`: `name`, `small` (the shortest first) or `large`.
+        priority (list of str, optional): Glob patterns of the files to translate first.
 
     Returns:
         None
@@ -122,84 +206,174 @@ def translate_from_dir(src: str, language: str = LANGUAGE_TO) -> None:
     using asynchronous or parallel processing for better performance.
 
     **Error Handling:** While the function raises `ValueError` for invalid input paths, it catches 
-    other potential exceptions during translation.  Consider adding more specific error handling 
-    to provide informative messages to the user.
+    other potential exceptions during translation and records them in the manifest.
     """
     global _KEYBOARD_INTERRUPT_FLAG  # pylint: disable=global-statement
     if not os.path.isdir(src):
         raise ValueError("'src' must be a directory path.")
     dstdir: str = os.path.join(src, DEFAULT_OUTPUT_DIRNAME)
-    if not os.path.exists(dstdir):
-        os.makedirs(dstdir)
-
-    translated_list = []
-    filename_list = [
-        fname for fname in os.listdir(src)
-        if os.path.isfile(os.path.join(src, fname))
-    ]
-    n_files = len(filename_list)
-    print(f"# of files: {n_files}")
-    try:
-        for ii, fname in enumerate(filename_list):
-            print(f"target: {fname} ({ii + 1}/{n_files})")
-            if not os.path.isfile(os.path.join(src, fname)):
-                continue
-            dstpath_target = os.path.join(
-                dstdir,
-                os.path.basename(fname).replace(
-                    os.path.splitext(fname)[-1],
-                    "_translated.txt"
+    with Manifest(dstdir, shard, lease_sec) as manifest:
+        if rescan or not manifest.is_scanned():
+            manifest.add(
+                (entry.name, existing_path(_output_path(dstdir, entry.name)))
+                for entry in scan(
+                    src, None if include else TEXT_EXTENSIONS, include,
+                    [DEFAULT_OUTPUT_DIRNAME, f"*{EXCLUDE_SUFFIX}*", *(exclude or [])],
+                    recursive
                 )
             )
-            translated: str | None = None
-            if os.path.exists(dstpath_target):
-                print("already translated.")
-                with open(dstpath_target, "r", encoding="utf-8") as ff:
-                    translated = ff.read()
-                    translated_list.append(translated)
-                continue
-            if EXCLUDE_SUFFIX in fname:
-                print("a file to exclude. skip.")
-                continue
-            translated = translate_from_file(
-                os.path.join(src, fname),
-                language
-            )
-            if _KEYBOARD_INTERRUPT_FLAG:
-                print("skip analysis of the rest files due to KeyBoardInterrupt.")
-                break
-            if translated is None:
-                print("failure in translation. skip.")
-                continue
-            translated_list.append(translated)
-            dstpath_target = os.path.join(
-                dstdir,
-                os.path.basename(fname).replace(
-                    os.path.splitext(fname)[-1],
-                    "_translated.txt"
-                )
-            )
-            save(dstpath_target, translated)
-            print(f"done. wait {WAIT_TIME_SEC} sec...")
-            time.sleep(WAIT_TIME_SEC)
-    except KeyboardInterrupt:
-        _KEYBOARD_INTERRUPT_FLAG = True
-
-    if _KEYBOARD_INTERRUPT_FLAG:
-        return
-    print("save a merged translated...")
-    dstpath_target = os.path.join(
-        dstdir, "translated_merged.txt"
-    )
-    save(dstpath_target, "\n\n".join(translated_list))
+        filename_list: List[str] = manifest.pending(retry_failed)
+        n_files = len(filename_list)
+        print(f"# of files: {n_files} ({manifest.summary()})")
+        if plan:
+            print(estimate(
+                filename_list, lambda name: measure(os.path.join(src, name)),
+                QUOTA, manifest.latencies()
+            ).format())
+            return
+        filename_list = schedule(
+            filename_list, lambda name: measure(os.path.join(src, name)), order, priority
+        )
+        try:
+            for ii, fname in enumerate(filename_list):
+                if not manifest.start(fname):
+                    continue
+                print(f"target: {fname} ({ii + 1}/{n_files})")
+                dstpath_target = _output_path(dstdir, fname)
+                st = time.perf_counter()
+                translated: str | None = None
+                try:
+                    translated = translate_from_file(
+                        os.path.join(src, fname),
+                        language
+                    )
+                except CircuitOpenError as ex:
+                    manifest.fail(fname, repr(ex), time.perf_counter() - st)
+                    print(f"{ex} stop.")
+                    break
+                except Exception as ex:  # pylint: disable=broad-exception-caught
+                    manifest.fail(fname, repr(ex), time.perf_counter() - st)
+                    print(f"failure in translation: {ex!r}. skip.")
+                    continue
+                if _KEYBOARD_INTERRUPT_FLAG:
+                    print("skip analysis of the rest files due to KeyBoardInterrupt.")
+                    break
+                if translated is None:
+                    manifest.fail(fname, "no translation returned", time.perf_counter() - st)
+                    print("failure in translation. skip.")
+                    continue
+                if not os.path.exists(os.path.dirname(dstpath_target)):
+                    os.makedirs(os.path.dirname(dstpath_target))
+                save(dstpath_target, translated)
+                manifest.succeed(fname, dstpath_target, time.perf_counter() - st)
+                print(f"done. wait {WAIT_TIME_SEC} sec...")
+                time.sleep(WAIT_TIME_SEC)
+        except KeyboardInterrupt:
+            _KEYBOARD_INTERRUPT_FLAG = True
+
+        if _KEYBOARD_INTERRUPT_FLAG:
+            return
+        if (shard is not None or lease_sec is not None) and not manifest.is_finished():
+            print(f"other workers are still running. leave the merge to them. ({manifest.summary()})")
+            return
+        print(f"save a merged translated... ({manifest.summary()})")
+        outputs: List[str] = manifest.outputs()
+    n_read: int = MergedText(os.path.join(dstdir, MERGED_FILENAME)).update(outputs)
+    print(f"{n_read} of {len(outputs)} translations merged.")
+
+
+def watch_dir(
+    src: str, language: str = LANGUAGE_TO,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, interval: float = INTERVAL_SEC,
+    debounce: float = DEBOUNCE_SEC
+) -> None:
+    """Translates the text files added to or changed in a directory until interrupted.
+
+    The files are found by a `Watcher` comparing their modification times and
+    sizes with a snapshot in the output directory, so only the files added or
+    changed since the last batch, or since the last watch, are translated by
+    `translate_from_dir`, and the merged translation is updated incrementally.
+    The items of the removed files are removed from the manifest and the
+    merged translation, and their translations are kept.
 
+    Args:
+        src (str): The path to the directory to watch.
+        language (str, optional): The language code of the target text. Defaults to `LANGUAGE_TO`.
+        recursive (bool, optional): Watches the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to translate.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        interval (float, optional): The seconds between polls. Defaults to INTERVAL_SEC.
+        debounce (float, optional): The seconds a file must stay unchanged
+            before it is translated. Defaults to DEBOUNCE_SEC.
 
-def main(fpath: str, language: str = LANGUAGE_TO) -> None:
+    Raises:
+        ValueError: If the `src` argument is not a directory path.
+    """
+    if not os.path.isdir(src):
+        raise ValueError("'src' must be a directory path.")
+    dstdir: str = os.path.join(src, DEFAULT_OUTPUT_DIRNAME)
+    watcher = Watcher(
+        src, os.path.join(dstdir, SNAPSHOT_FILENAME),
+        None if include else TEXT_EXTENSIONS, include,
+        [DEFAULT_OUTPUT_DIRNAME, f"*{EXCLUDE_SUFFIX}*", *(exclude or [])], recursive,
+        interval, debounce
+    )
+    print(f"watch {src}... (Ctrl+C to stop)")
+    with watcher:
+        try:
+            for changes in watcher.watch():
+                print(
+                    f"{len(changes.added)} added, {len(changes.modified)} modified, "
+                    f"{len(changes.removed)} removed."
+                )
+                with Manifest(dstdir) as manifest:
+                    manifest.add(
+                        (name, existing_path(_output_path(dstdir, name)))
+                        for name in changes.added
+                    )
+                    manifest.reset(changes.modified)
+                    manifest.remove(changes.removed)
+                translate_from_dir(src, language, recursive=recursive)
+                if _KEYBOARD_INTERRUPT_FLAG:
+                    break
+        except KeyboardInterrupt:
+            pass
+    print("stop watching.")
+
+
+def main(
+    fpath: str, language: str = LANGUAGE_TO,
+    retry_failed: bool = False, rescan: bool = False,
+    recursive: bool = False, include: List[str] | None = None,
+    exclude: List[str] | None = None, shard: Tuple[int, int] | None = None,
+    lease_sec: float | None = None, plan: bool = False,
+    order: str = ORDER_NAME, priority: List[str] | None = None,
+    watch: bool = False, interval: float = INTERVAL_SEC, debounce: float = DEBOUNCE_SEC
+) -> None:
     """Translates text or text files to a specified language.
 
     Args:
         fpath (str): The path to the file or directory to be translated.
         language (str, optional): The language code of the target text. Defaults to `LANGUAGE_TO`.
+        retry_failed (bool, optional): Retries the files failed in the previous runs if True.
+        rescan (bool, optional): Lists the directory again to add new files if True.
+        recursive (bool, optional): Finds files in the subdirectories as well if True.
+        include (list of str, optional): Glob patterns of the files to translate.
+        exclude (list of str, optional): Glob patterns of the files and directories to skip.
+        shard (tuple of int, optional): `(i, N)` to process only the shard `i` of `N`
+            of the files, split by the hashes of their names.
+        lease_sec (float, optional): Claims the files with leases of this length
+            to share them with other workers running on the same directory.
+        plan (bool, optional): Prints the estimated workload, time and cost
+            of the pending files without translating them if True.
+        order (str, optional): The order to translate the files in, one of
+            `planner.ORDERS`: `name`, `small` (the shortest first) or `large`.
+        priority (list of str, optional): Glob patterns of the files to translate first.
+        watch (bool, optional): Keeps translating the files added to or changed in
+            the directory until interrupted if True (see `watch_dir`).
+        interval (float, optional): The seconds between polls of `watch`.
+        debounce (float, optional): The seconds a file must stay unchanged in `watch`.
 
     Raises:
         ValueError: If `fpath` is not a valid file or directory path, or if translation fails.
@@ -218,8 +392,13 @@ def main(fpath: str, language: str = LANGUAGE_TO) -> None:
     **Error Handling:** Raises a `ValueError` if there is an error during the translation process
     or if the input path is invalid.
     """
-    if os.path.isdir(fpath):
-        translate_from_dir(fpath, language)
+    if watch:
+        watch_dir(fpath, language, recursive, include, exclude, interval, debounce)
+    elif os.path.isdir(fpath):
+        translate_from_dir(
+            fpath, language, retry_failed, rescan, recursive, include, exclude,
+            shard, lease_sec, plan, order, priority
+        )
     else:
         translated = translate_from_file(fpath, language)
         if translated is None:
@@ -246,5 +425,58 @@ if __name__ == "__main__":
     parser.add_argument(
         "--la", dest="la", type=str, default=LANGUAGE_TO
     )
+    parser.add_argument(
+        "--retry_failed", dest="retry_failed", action="store_true"
+    )
+    parser.add_argument(
+        "--rescan", dest="rescan", action="store_true"
+    )
+    parser.add_argument(
+        "--recursive", dest="recursive", action="store_true"
+    )
+    parser.add_argument(
+        "--include", dest="include", type=str, nargs="+", default=None,
+        help="glob patterns of the files to translate"
+    )
+    parser.add_argument(
+        "--exclude", dest="exclude", type=str, nargs="+", default=None,
+        help="glob patterns of the files and directories to skip"
+    )
+    parser.add_argument(
+        "--shard", dest="shard", type=parse_shard, default=None,
+        help="'i/N' to process only the shard i of N of the files"
+    )
+    parser.add_argument(
+        "--lease_sec", dest="lease_sec", type=float, default=None,
+        help="claim the files with leases of this length to share them with other workers"
+    )
+    parser.add_argument(
+        "--plan", dest="plan", action="store_true",
+        help="print the estimated workload, time and cost without translating"
+    )
+    parser.add_argument(
+        "--order", dest="order", type=str, choices=ORDERS, default=ORDER_NAME,
+        help="the order to translate the files in"
+    )
+    parser.add_argument(
+        "--priority", dest="priority", type=str, nargs="+", default=None,
+        help="glob patterns of the files to translate first"
+    )
+    parser.add_argument(
+        "--watch", dest="watch", action="store_true",
+        help="keep translating the files added to or changed in the directory"
+    )
+    parser.add_argument(
+        "--interval", dest="interval", type=float, default=INTERVAL_SEC,
+        help="the seconds between polls of the directory in the watch mode"
+    )
+    parser.add_argument(
+        "--debounce", dest="debounce", type=float, default=DEBOUNCE_SEC,
+        help="the seconds a file must stay unchanged before it is translated in the watch mode"
+    )
     args = parser.parse_args()
-    main(args.src, args.la)
+    main(
+        args.src, args.la, args.retry_failed, args.rescan,
+        args.recursive, args.include, args.exclude, args.shard, args.lease_sec,
+        args.plan, args.order, args.priority, args.watch, args.interval, args.debounce
+    )